@@ -2,34 +2,245 @@ import streamlit as st
 import pandas as pd
 import sqlite3
 from datetime import datetime
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from difflib import SequenceMatcher
 import chardet
 import gdown
 import os
+import re
+import json
+import numbers
+import hashlib
+import mimetypes
+import gzip
+import random
+import shutil
+import threading
+import time
+import httplib2
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseDownload
 from google.oauth2.service_account import Credentials
 from io import BytesIO
 import io
+from alon_lab_orders_import import parse_import_file, normalize_date_column, IMPORT_DATE_COLUMNS, STATUS_OPTIONS
 
 
-# Google Drive file ID of the uploaded SQLite database
-GOOGLE_DRIVE_FILE_ID = "1wwnKYEPhtTb-59aGfkX5jQXmfbUKcXFK"
-LOCAL_DB_FILE = "inventory.db"
-
-# Load credentials from Streamlit secrets
-credentials_info = st.secrets["google_drive"]
-credentials_dict = {
-    "type": credentials_info["type"],
-    "project_id": credentials_info["project_id"],
-    "private_key_id": credentials_info["private_key_id"],
-    "private_key": credentials_info["private_key"].replace("\\n", "\n"),  # Handle multiline key
-    "client_email": credentials_info["client_email"],
-    "client_id": credentials_info["client_id"],
-    "auth_uri": credentials_info["auth_uri"],
-    "token_uri": credentials_info["token_uri"],
-    "auth_provider_x509_cert_url": credentials_info["auth_provider_x509_cert_url"],
-    "client_x509_cert_url": credentials_info["client_x509_cert_url"]
+# Function to read an optional secret; local-only installs may have no secrets file at all
+def read_secret(key, default=None):
+    try:
+        return st.secrets.get(key, default)
+    except FileNotFoundError:
+        return default
+
+# Sync mode: "offline_first" applies writes locally and syncs in the background, "online" syncs
+# before returning, "local" never touches Google Drive (the old alon_lab_orders_local.py behaviour)
+SYNC_MODE = (
+    os.environ.get("LAB_ORDERS_SYNC_MODE")
+    or read_secret("sync_mode")
+    or ("offline_first" if read_secret("google_drive") else "local")
+)
+
+# SQL tracing: when LAB_ORDERS_SQL_TRACE (or sql_trace) names a file, every statement run through
+# get_db_connection is appended to it as one JSON line; the progress handler fires every N VM steps
+SQL_TRACE_FILE = os.environ.get("LAB_ORDERS_SQL_TRACE") or read_secret("sql_trace")
+SQL_TRACE_PROGRESS_STEPS = 100
+
+# Default lab shard: Google Drive file ID of the uploaded SQLite database and its local copy
+DEFAULT_LAB = "Alon Lab"
+DEFAULT_DRIVE_FILE_ID = "1wwnKYEPhtTb-59aGfkX5jQXmfbUKcXFK"
+DEFAULT_LOCAL_DB_FILE = "inventory.db"
+
+# Function to load lab shards from the optional [lab_shards] secrets table. Each entry is a lab
+# (or a lab-year) with a drive_file_id, an optional local_db_file and an optional read_only flag.
+def load_lab_shards():
+    configured = read_secret("lab_shards", {})
+    if not configured:
+        return {DEFAULT_LAB: {"drive_file_id": DEFAULT_DRIVE_FILE_ID, "local_db_file": DEFAULT_LOCAL_DB_FILE, "read_only": False}}
+
+    shards = {}
+    for lab, shard in configured.items():
+        slug = re.sub(r"[^0-9a-z]+", "_", lab.lower()).strip("_")
+        shards[lab] = {
+            "drive_file_id": shard["drive_file_id"],
+            "local_db_file": shard.get("local_db_file", f"inventory_{slug}.db"),
+            "read_only": bool(shard.get("read_only", False)),
+        }
+    return shards
+
+# Route this session to its active shard; reads and writes below touch only this shard
+LAB_SHARDS = load_lab_shards()
+ACTIVE_LAB = st.session_state.get("active_lab") if st.session_state.get("active_lab") in LAB_SHARDS else next(iter(LAB_SHARDS))
+GOOGLE_DRIVE_FILE_ID = LAB_SHARDS[ACTIVE_LAB]["drive_file_id"]
+LOCAL_DB_FILE = LAB_SHARDS[ACTIVE_LAB]["local_db_file"]
+ACTIVE_SHARD_READ_ONLY = LAB_SHARDS[ACTIVE_LAB]["read_only"]
+READ_ONLY_DB_FILES = {shard["local_db_file"] for shard in LAB_SHARDS.values() if shard["read_only"]}
+
+# Upload tuning: chunk size must be a multiple of 256 KB for Drive resumable sessions
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+UPLOAD_MAX_RETRIES = 6
+UPLOAD_BACKOFF_BASE = 1.0  # seconds
+UPLOAD_BACKOFF_CAP = 32.0  # seconds
+RETRYABLE_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+# Sync payloads are gzip-compressed snapshots; downloads accept either gzip or a raw database
+SYNC_PAYLOAD_FILE = LOCAL_DB_FILE + ".gz"
+
+# Uploads are taken from consistent local snapshots; the newest few are kept for restores
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_RETENTION = 10
+SQLITE_HEADER = b"SQLite format 3\x00"
+GZIP_MAGIC = b"\x1f\x8b"
+
+# Background maintenance: PRAGMA optimize every check, full VACUUM/ANALYZE when due
+MAINTENANCE_CHECK_SECONDS = 15 * 60
+MAINTENANCE_INTERVAL_SECONDS = 24 * 60 * 60
+MAINTENANCE_FREE_PAGE_RATIO = 0.2
+
+# Spend summary dimensions, as SQL expressions over an inventory row ({row} is NEW, OLD or inventory).
+# Cost is a per-unit price, so spend for a line is cost * quantity.
+SPEND_SUMMARY_DIMENSIONS = {
+    "vendor": "{row}.vendor",
+    "requested_by": "{row}.requested_by",
+    "status": "{row}.status",
+    "month": "CASE WHEN {row}.order_date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]*' THEN substr({row}.order_date, 1, 7) ELSE 'Undated' END",
+}
+SPEND_QUANTITY_EXPRESSION = "COALESCE({row}.quantity, 1)"
+SPEND_EXPRESSION = "COALESCE({row}.cost, 0) * COALESCE({row}.quantity, 1)"
+
+# Near-duplicate detection: canonical vendor aliases, sorted-neighborhood window and score thresholds
+VENDOR_ALIASES = {
+    "sigma": "sigmaaldrich",
+    "aldrich": "sigmaaldrich",
+    "milliporesigma": "sigmaaldrich",
+    "thermo": "thermofisher",
+    "thermofisherscientific": "thermofisher",
+    "thermoscientific": "thermofisher",
+    "invitrogen": "thermofisher",
+    "emdmillipore": "millipore",
+    "cellsignalingtechnology": "cellsignaling",
+    "cst": "cellsignaling",
+}
+VENDOR_SUFFIXES = ("inc", "llc", "ltd", "corp", "corporation", "company", "co")
+NEAR_DUPLICATE_WINDOW = 5
+NEAR_DUPLICATE_MIN_CATALOG_SCORE = 0.85
+NEAR_DUPLICATE_THRESHOLD = 0.85
+
+# Product metadata lookup: local on-disk cache (not synced), in-process LRU in front of it
+PRODUCT_CACHE_FILE = "product_cache.db"
+PRODUCT_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+PRODUCT_CACHE_MAX_ENTRIES = 5000
+PRODUCT_MEMORY_CACHE_SIZE = 512
+PRODUCT_LOOKUP_WORKERS = 8
+PRODUCT_FIELDS = ("name", "url", "unit", "cost")
+
+# Optional vendor resolvers: canonical vendor -> callable(catalog_number) returning a
+# dict with any of PRODUCT_FIELDS, or None when the product is unknown
+PRODUCT_RESOLVERS = {}
+
+# Consumption forecast: receipts and history span needed for a rate, lead time for vendors
+# without order history, and how far ahead the "Due for Reorder" list looks
+FORECAST_MIN_RECEIPTS = 2
+FORECAST_MIN_SPAN_DAYS = 7
+FORECAST_DEFAULT_LEAD_DAYS = 7
+FORECAST_HORIZON_DAYS = 14
+
+# Attachments (quotes, invoices, SDS files) live in a content-addressed blob store outside the
+# database; only references are synced. Blobs upload lazily to an optional Drive folder, local
+# copies of uploaded blobs form an LRU cache, and unreferenced blobs are collected after a grace period.
+ATTACHMENT_DIR = "attachments"
+ATTACHMENT_INDEX_FILE = os.path.join(ATTACHMENT_DIR, "index.db")
+ATTACHMENT_KINDS = ["Quote", "Invoice", "SDS", "Other"]
+ATTACHMENT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+ATTACHMENT_GC_GRACE_SECONDS = 7 * 24 * 60 * 60
+ATTACHMENT_DRIVE_FOLDER_ID = read_secret("attachment_folder_id")
+
+# Bulk import: one worker process per uploaded file, up to the number of cores
+IMPORT_WORKERS = os.cpu_count() or 1
+
+# Columns an import can set, with the values new rows get where the file leaves them blank.
+# Upserts may overwrite every column except the item key.
+IMPORT_DEFAULTS = {
+    "requested_by": "Unknown",
+    "catalog_number": None,
+    "vendor": None,
+    "name": "Unknown Item",
+    "url": "",
+    "quantity": 1,
+    "unit": "",
+    "notes": "",
+    "cost": 0.0,
+    "status": "Requested",
+    "order_date": None,
+    "received_date": None,
+}
+IMPORT_UPDATE_FIELDS = [column for column in IMPORT_DEFAULTS if column not in ("catalog_number", "vendor")]
+
+# How adding an item that already exists under the same catalog number and vendor is merged into it:
+# 'replace' takes the submitted value, 'keep' keeps the stored one, 'sum' adds the two, and 'append'
+# adds the submitted text to the stored text unless it is already there. The add form leaves URL,
+# unit and cost blank unless a lookup filled them, so a repeated add keeps the stored ones.
+ADD_MERGE_RULES = {
+    "requested_by": "replace",
+    "name": "replace",
+    "url": "keep",
+    "quantity": "replace",
+    "unit": "keep",
+    "notes": "replace",
+    "cost": "keep",
+    "status": "replace",
 }
+ADD_MERGE_EXPRESSIONS = {
+    "replace": "excluded.{field}",
+    "sum": "COALESCE(inventory.{field}, 0) + COALESCE(excluded.{field}, 0)",
+    "append": (
+        "CASE WHEN COALESCE(excluded.{field}, '') = '' OR instr(COALESCE(inventory.{field}, ''), excluded.{field}) THEN inventory.{field} "
+        "WHEN COALESCE(inventory.{field}, '') = '' THEN excluded.{field} "
+        "ELSE inventory.{field} || ' | ' || excluded.{field} END"
+    ),
+}
+ITEM_KEY = "lower(trim(catalog_number)), lower(trim(vendor))"
+
+# The date an item's status change stamps when it is edited to that status
+STATUS_DATE_FIELDS = {"Ordered": "order_date", "Received": "received_date"}
+
+# Offline-first sync: background cadence, journal retention, and the tables adopted from the remote copy
+SYNC_INTERVAL_SECONDS = 60
+JOURNAL_RETENTION_DAYS = 30
+INVENTORY_SYNC_FIELDS = [
+    "uid", "requested_by", "catalog_number", "vendor", "name", "url",
+    "quantity", "unit", "notes", "cost", "status", "order_date", "received_date"
+]
+STATUS_EVENT_SYNC_FIELDS = ["from_status", "to_status", "changed_at", "actor", "quantity"]
+ATTACHMENT_SYNC_FIELDS = ["sha256", "kind", "file_name", "mime_type", "size_bytes", "added_by", "added_at"]
+
+# Change feed: how often open inventory views poll for other sessions' writes, how many feed
+# entries are kept, and how many changed rows are patched in before a full reload is cheaper
+CHANGE_POLL_SECONDS = 5
+CHANGE_FEED_RETENTION = 10000
+CHANGE_PATCH_LIMIT = 500
+SYNCED_TABLES = ("inventory", "status_events", "attachments", "applied_ops", "sync_conflicts", "spend_summary")
+# Synced tables that hold a local item id, which adopting a merged copy maps by uid
+ITEM_ID_COLUMNS = {"inventory": "id", "status_events": "item_id", "attachments": "item_id"}
+
+# Load credentials from Streamlit secrets (not needed in local mode)
+credentials_info = read_secret("google_drive")
+credentials_dict = None
+if credentials_info:
+    credentials_dict = {
+        "type": credentials_info["type"],
+        "project_id": credentials_info["project_id"],
+        "private_key_id": credentials_info["private_key_id"],
+        "private_key": credentials_info["private_key"].replace("\\n", "\n"),  # Handle multiline key
+        "client_email": credentials_info["client_email"],
+        "client_id": credentials_info["client_id"],
+        "auth_uri": credentials_info["auth_uri"],
+        "token_uri": credentials_info["token_uri"],
+        "auth_provider_x509_cert_url": credentials_info["auth_provider_x509_cert_url"],
+        "client_x509_cert_url": credentials_info["client_x509_cert_url"]
+    }
 
 # Create credentials object for Google API
 
@@ -41,19 +252,126 @@ def get_drive_service():
 
 
 # Function to download the database file from Google Drive
-def download_db():
-    if not os.path.exists(LOCAL_DB_FILE) or not validate_db():
+def download_db(local_db_file=LOCAL_DB_FILE, drive_file_id=GOOGLE_DRIVE_FILE_ID):
+    if SYNC_MODE == "local":
+        return
+    if not os.path.exists(local_db_file) or not validate_db(local_db_file):
         st.info("Downloading database from Google Drive...")
         try:
-            gdown.cached_download(f"https://drive.google.com/uc?id={GOOGLE_DRIVE_FILE_ID}", LOCAL_DB_FILE, quiet=False)
+            download_payload_file = local_db_file + ".download"
+            if os.path.exists(download_payload_file):
+                os.remove(download_payload_file)
+            gdown.cached_download(f"https://drive.google.com/uc?id={drive_file_id}", download_payload_file, quiet=False)
+            restore_db_payload(download_payload_file, local_db_file)
             st.success("Database downloaded successfully.")
         except Exception as e:
             st.error(f"Failed to download the database: {e}")
 
+# Function to write a gzip-compressed copy of the database for syncing
+def compress_db_payload(source_path=LOCAL_DB_FILE, payload_path=SYNC_PAYLOAD_FILE):
+    with open(source_path, "rb") as source, gzip.open(payload_path, "wb", compresslevel=6) as payload:
+        shutil.copyfileobj(source, payload)
+    return payload_path
+
+# Function to take a consistent copy of the database with the SQLite online backup API
+def create_db_snapshot(db_file=LOCAL_DB_FILE, retention=SNAPSHOT_RETENTION):
+    os.makedirs(SNAPSHOT_DIR, exist_ok=True)
+    stem = os.path.splitext(os.path.basename(db_file))[0]
+    snapshot_path = os.path.join(SNAPSHOT_DIR, f"{stem}-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.db")
+
+    source = sqlite3.connect(db_file)
+    target = sqlite3.connect(snapshot_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    for expired in list_db_snapshots(db_file)[retention:]:
+        os.remove(expired)
+    return snapshot_path
+
+# Function to list local snapshots of a database, newest first
+def list_db_snapshots(db_file=LOCAL_DB_FILE):
+    if not os.path.isdir(SNAPSHOT_DIR):
+        return []
+    stem = os.path.splitext(os.path.basename(db_file))[0]
+    pattern = re.compile(rf"^{re.escape(stem)}-\d{{8}}-\d{{6}}-\d{{6}}\.db$")
+    snapshots = [os.path.join(SNAPSHOT_DIR, name) for name in os.listdir(SNAPSHOT_DIR) if pattern.match(name)]
+    return sorted(snapshots, reverse=True)
+
+# Function to roll the live database back to a snapshot; open connections see the restored pages
+def restore_db_snapshot(snapshot_path, db_file=LOCAL_DB_FILE):
+    source = sqlite3.connect(snapshot_path)
+    target = sqlite3.connect(db_file)
+    try:
+        previous_version = latest_change_version(target)
+        base_revision = read_app_meta(target, "remote_revision")
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    # The snapshot may predate newer tables, and its feed is older than what sessions have seen
+    init_db(db_file)
+    conn = sqlite3.connect(db_file)
+    try:
+        publish_reload(conn, previous_version)
+        if SYNC_MODE != "local":
+            # The snapshot carries the revision it was taken at, which would make the next sync merge the
+            # remote copy over it. Keep the live copy's base instead, and have the next sync upload the
+            # restored data over that revision (and only that one) rather than merge it.
+            conn.execute("DELETE FROM app_meta WHERE key IN ('remote_revision', 'restore_conflict')")
+            if base_revision is not None:
+                write_app_meta(conn, "remote_revision", base_revision)
+            write_app_meta(conn, "restore_pending", os.path.basename(snapshot_path))
+        conn.commit()
+    finally:
+        conn.close()
+
+# Function to read whether a restored snapshot still has to reach Google Drive, and the newer remote
+# revision that stopped it, if any
+def read_restore_state(db_file=None):
+    conn = get_db_connection(db_file)
+    restore_pending = read_app_meta(conn, "restore_pending")
+    restore_conflict = read_app_meta(conn, "restore_conflict")
+    conn.close()
+    return restore_pending, restore_conflict
+
+# Function to settle a restore that Google Drive moved past: keeping it lets the next sync upload it
+# over the newer remote revision; discarding it lets the next sync merge the remote copy over it
+def resolve_restore_conflict(keep, db_file=None):
+    conn = get_db_connection(db_file, read_only=False)
+    cursor = conn.cursor()
+    if keep:
+        write_app_meta(cursor, "remote_revision", read_app_meta(cursor, "restore_conflict"))
+    else:
+        cursor.execute("DELETE FROM app_meta WHERE key IN ('restore_pending', 'remote_revision')")
+    cursor.execute("DELETE FROM app_meta WHERE key = 'restore_conflict'")
+    conn.commit()
+    conn.close()
+
+# Function to install a downloaded payload as the local database, decompressing it if needed
+def restore_db_payload(payload_path, target_path=LOCAL_DB_FILE):
+    with open(payload_path, "rb") as payload:
+        header = payload.read(len(SQLITE_HEADER))
+
+    if header.startswith(GZIP_MAGIC):
+        staging_path = target_path + ".tmp"
+        with gzip.open(payload_path, "rb") as source, open(staging_path, "wb") as target:
+            shutil.copyfileobj(source, target)
+        os.replace(staging_path, target_path)
+        os.remove(payload_path)
+    elif header == SQLITE_HEADER:
+        os.replace(payload_path, target_path)
+    else:
+        os.remove(payload_path)
+        raise ValueError("Downloaded file is neither a SQLite database nor a gzip snapshot")
+
 # Function to check if the database contains required tables
-def validate_db():
+def validate_db(db_file=None):
     try:
-        conn = get_db_connection()
+        conn = get_db_connection(db_file)
         cursor = conn.cursor()
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='inventory';")
         table_exists = cursor.fetchone()
@@ -62,23 +380,79 @@ def validate_db():
     except sqlite3.Error:
         return False
 
-# Function to upload the updated database file back to Google Drive
-
+# Function to compute an exponential backoff delay with full jitter
+def backoff_delay(attempt, base=UPLOAD_BACKOFF_BASE, cap=UPLOAD_BACKOFF_CAP):
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+# Function to drive a resumable upload chunk by chunk, retrying transient failures.
+# After a failed chunk the client library queries the session for the last byte the
+# server acknowledged, so retries resume where they left off instead of at byte zero.
+def run_resumable_upload(request, progress_callback=None, max_retries=UPLOAD_MAX_RETRIES, sleep=time.sleep):
+    response = None
+    attempt = 0
+    while response is None:
+        try:
+            status, response = request.next_chunk()
+        except HttpError as e:
+            if e.resp.status not in RETRYABLE_STATUS_CODES or attempt >= max_retries:
+                raise
+            sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+        except (OSError, httplib2.HttpLib2Error):
+            if attempt >= max_retries:
+                raise
+            sleep(backoff_delay(attempt))
+            attempt += 1
+            continue
+
+        attempt = 0
+        if status is not None and progress_callback:
+            progress_callback(status.progress())
+
+    if progress_callback:
+        progress_callback(1.0)
+    return response
+
+# Function to build the Drive update request for a local file as a chunked resumable upload
+def build_upload_request(service, file_path, mimetype='application/gzip', chunksize=UPLOAD_CHUNK_SIZE, drive_file_id=GOOGLE_DRIVE_FILE_ID):
+    media = MediaFileUpload(file_path, mimetype=mimetype, chunksize=chunksize, resumable=True)
+    return service.files().update(
+        fileId=drive_file_id,
+        media_body=media,
+        fields="id,headRevisionId"
+    )
+
+# Function to upload the updated database file back to Google Drive. In offline-first mode this
+# only wakes the background sync worker; the change is already durable in the local journal.
 def upload_db():
+    if SYNC_MODE == "local":
+        return
+    if ACTIVE_SHARD_READ_ONLY:
+        st.warning(f"{ACTIVE_LAB} is archived and read-only; changes are not uploaded.")
+        return
+
+    sync_state = get_sync_state(LOCAL_DB_FILE, GOOGLE_DRIVE_FILE_ID)
+    if SYNC_MODE == "offline_first":
+        sync_state["wake"].set()
+        st.toast("Saved locally; syncing to Google Drive in the background.")
+        return
+
     st.info("Uploading updated database to Google Drive...")
+    progress_bar = st.progress(0.0, text="Uploading database...")
     try:
-        service = get_drive_service()
-        
-        media = MediaFileUpload(LOCAL_DB_FILE, mimetype='application/x-sqlite3', resumable=True)
-        
-        service.files().update(
-            fileId=GOOGLE_DRIVE_FILE_ID,
-            media_body=media
-        ).execute()
+        with sync_state["lock"]:
+            sync_shard(
+                LOCAL_DB_FILE,
+                GOOGLE_DRIVE_FILE_ID,
+                progress_callback=lambda fraction: progress_bar.progress(fraction, text=f"Uploading database... {fraction:.0%}")
+            )
 
         st.success("Database uploaded successfully to Google Drive.")
     except Exception as e:
         st.error(f"Failed to upload the database: {e}")
+    finally:
+        progress_bar.empty()
 
 
 #def upload_db():
@@ -113,17 +487,159 @@ def upload_db():
 #   except Exception as e:
 #       st.error(f"Failed to upload the database: {e}")
 
-# Database connection
-def get_db_connection():
-    return sqlite3.connect(LOCAL_DB_FILE, check_same_thread=False)
+# Function to describe bound parameters without their values: how many there are and their types
+def parameter_shape(parameters):
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    return [type(value).__name__ for value in parameters]
+
+# Query plans by statement text, so each distinct statement is explained once per run
+SQL_TRACE_PLANS = {}
+
+# Traced statements. Each record holds the statement, its parameter shape, the rows it wrote or
+# fetched, the time spent executing and fetching, how many SQLite statements it ran (trigger bodies
+# included, counted by the trace callback), its VM steps (counted by the progress handler) and
+# its EXPLAIN QUERY PLAN. A record is written when its cursor runs again or closes, or the
+# connection closes, so rows fetched after execute() are counted too.
+class TracingCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        execute = super().execute
+        return self.connection.traced(self, sql, parameters, lambda: execute(sql, parameters))
+
+    def executemany(self, sql, seq_of_parameters):
+        # Parameters may be a one-shot iterator; the first row is needed for the query plan
+        rows = list(seq_of_parameters)
+        executemany = super().executemany
+        return self.connection.traced(self, sql, rows[0] if rows else (), lambda: executemany(sql, rows), len(rows))
+
+    def fetchone(self):
+        return self.connection.fetched(self, super().fetchone, lambda row: row is not None)
+
+    def fetchmany(self, *args, **kwargs):
+        fetchmany = super().fetchmany
+        return self.connection.fetched(self, lambda: fetchmany(*args, **kwargs), len)
+
+    def fetchall(self):
+        return self.connection.fetched(self, super().fetchall, len)
+
+    def __next__(self):
+        return self.connection.fetched(self, super().__next__, lambda row: 1)
+
+    def close(self):
+        self.connection.flush_trace(self)
+        super().close()
+
+
+class TracingConnection(sqlite3.Connection):
+    def __init__(self, database, *args, **kwargs):
+        super().__init__(database, *args, **kwargs)
+        self.database = os.path.basename(str(database))
+        self.pending_trace = {}
+        self.active_trace = None
+        self.set_trace_callback(self.count_statement)
+        self.set_progress_handler(self.count_steps, SQL_TRACE_PROGRESS_STEPS)
+
+    def cursor(self, factory=TracingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def count_statement(self, statement):
+        if self.active_trace:
+            self.active_trace["statements"] += 1
+
+    def count_steps(self):
+        if self.active_trace:
+            self.active_trace["vm_steps"] += SQL_TRACE_PROGRESS_STEPS
+        return 0
+
+    def query_plan(self, sql, parameters):
+        if sql not in SQL_TRACE_PLANS:
+            try:
+                plan = sqlite3.Cursor(self).execute(f"EXPLAIN QUERY PLAN {sql}", parameters).fetchall()
+                SQL_TRACE_PLANS[sql] = [row[3] for row in plan]
+            except sqlite3.Error:
+                SQL_TRACE_PLANS[sql] = None  # Not explainable (e.g. a script or a pragma with side effects)
+        return SQL_TRACE_PLANS[sql]
+
+    def timed(self, record, run):
+        self.active_trace = record
+        started = time.perf_counter()
+        try:
+            return run()
+        finally:
+            record["duration_ms"] += (time.perf_counter() - started) * 1000
+            self.active_trace = None
+
+    def traced(self, cursor, sql, parameters, run, batch=1):
+        self.flush_trace(cursor)
+        record = {
+            "at": event_timestamp(), "db": self.database, "thread": threading.current_thread().name,
+            "sql": "\n".join(filter(None, (line.strip() for line in sql.splitlines()))), "parameters": parameter_shape(parameters), "batch": batch,
+            "rows": 0, "duration_ms": 0.0, "statements": 0, "vm_steps": 0, "plan": self.query_plan(sql, parameters),
+        }
+        self.pending_trace[cursor] = record
+        result = self.timed(record, run)
+        record["rows"] = max(cursor.rowcount, 0)
+        return result
+
+    def fetched(self, cursor, run, count):
+        record = self.pending_trace.get(cursor)
+        if record is None:
+            return run()
+        rows = self.timed(record, run)
+        record["rows"] += count(rows)
+        return rows
+
+    def flush_trace(self, cursor=None):
+        cursors = [cursor] if cursor is not None else list(self.pending_trace)
+        records = [self.pending_trace.pop(pending) for pending in cursors if pending in self.pending_trace]
+        if records:
+            write_sql_trace(records)
+
+    def close(self):
+        self.flush_trace()
+        super().close()
+
+# Function to append traced statements to the SQL trace file
+def write_sql_trace(records):
+    with open(SQL_TRACE_FILE, "a") as trace:
+        trace.writelines(json.dumps({**record, "duration_ms": round(record["duration_ms"], 3)}) + "\n" for record in records)
+
+# Database connection (defaults to the active shard; archived shards reject writes)
+def get_db_connection(db_file=None, read_only=None):
+    db_file = db_file or LOCAL_DB_FILE
+    if SQL_TRACE_FILE:
+        conn = sqlite3.connect(db_file, check_same_thread=False, factory=TracingConnection)
+    else:
+        conn = sqlite3.connect(db_file, check_same_thread=False)
+    if read_only if read_only is not None else db_file in READ_ONLY_DB_FILES:
+        conn.execute("PRAGMA query_only = ON")
+    return conn
 
 ## Database connection old
 #def get_db_connection():
 #    return sqlite3.connect("inventory.db")
 
+# Function to get the current timestamp in the format used by status events
+def event_timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# Function to append a status event, with the item's quantity as it stands after the change;
+# callers pass their cursor so it commits with the change
+def record_status_event(cursor, item_id, from_status, to_status, actor):
+    cursor.execute('''
+        INSERT INTO status_events (item_id, from_status, to_status, changed_at, actor, quantity)
+        SELECT id, ?, ?, ?, ?, quantity FROM inventory WHERE id = ?
+    ''', (from_status, to_status, event_timestamp(), actor, item_id))
+
 # Initialize database
-def init_db():
-    conn = get_db_connection()
+def init_db(db_file=None):
+    conn = get_db_connection(db_file, read_only=False)
     cursor = conn.cursor()
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS inventory (
@@ -142,45 +658,1260 @@ def init_db():
             received_date TEXT
         )
     ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS status_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            from_status TEXT,
+            to_status TEXT NOT NULL,
+            changed_at TEXT NOT NULL,
+            actor TEXT,
+            quantity INTEGER
+        )
+    ''')
+    # The quantity an event moved (e.g. what a receipt brought in); older events leave it NULL.
+    # The journal trigger is recreated below so it records the new column.
+    if "quantity" not in [row[1] for row in cursor.execute("PRAGMA table_info(status_events)")]:
+        cursor.execute("ALTER TABLE status_events ADD COLUMN quantity INTEGER")
+        cursor.execute("DROP TRIGGER IF EXISTS journal_status_events_insert")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_status_events_changed_at ON status_events (changed_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_status_events_item ON status_events (item_id, changed_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_status_events_to_status ON status_events (to_status, item_id)")
+
+    # Stable row identity for sync; rows that predate it share ids with the remote copy
+    inventory_columns = [row[1] for row in cursor.execute("PRAGMA table_info(inventory)")]
+    if "uid" not in inventory_columns:
+        cursor.execute("ALTER TABLE inventory ADD COLUMN uid TEXT")
+    cursor.execute("UPDATE inventory SET uid = 'legacy-' || id WHERE uid IS NULL")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_uid ON inventory (uid)")
+    # Dates are ISO-8601 text, so range filters are index range scans
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_order_date ON inventory (order_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_received_date ON inventory (received_date)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_inventory_status ON inventory (status)")
+
+    # Durable local write journal, filled by triggers in the same transaction as each change
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS change_journal (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            op_id TEXT NOT NULL UNIQUE DEFAULT (lower(hex(randomblob(16)))),
+            table_name TEXT NOT NULL,
+            operation TEXT NOT NULL,
+            item_uid TEXT,
+            before_json TEXT,
+            after_json TEXT,
+            created_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime')),
+            synced_at TEXT
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_change_journal_pending ON change_journal (synced_at, seq)")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS applied_ops (
+            op_id TEXT PRIMARY KEY,
+            applied_at TEXT NOT NULL
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS sync_conflicts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            op_id TEXT NOT NULL,
+            item_uid TEXT,
+            field TEXT,
+            local_value TEXT,
+            remote_value TEXT,
+            detected_at TEXT NOT NULL
+        )
+    ''')
+    journal_active = "NOT EXISTS (SELECT 1 FROM app_meta WHERE key = 'journal_suspended')"
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS journal_inventory_insert AFTER INSERT ON inventory
+        WHEN {journal_active}
+        BEGIN
+            UPDATE inventory SET uid = lower(hex(randomblob(16))) WHERE id = NEW.id AND uid IS NULL;
+            INSERT INTO change_journal (table_name, operation, item_uid, after_json)
+            SELECT 'inventory', 'insert', uid, {journal_json("inventory", INVENTORY_SYNC_FIELDS)}
+            FROM inventory WHERE id = NEW.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS journal_inventory_update AFTER UPDATE ON inventory
+        WHEN OLD.uid IS NOT NULL AND {journal_active}
+        BEGIN
+            INSERT INTO change_journal (table_name, operation, item_uid, before_json, after_json)
+            VALUES ('inventory', 'update', NEW.uid, {journal_json("OLD", INVENTORY_SYNC_FIELDS)}, {journal_json("NEW", INVENTORY_SYNC_FIELDS)});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS journal_inventory_delete AFTER DELETE ON inventory
+        WHEN {journal_active}
+        BEGIN
+            INSERT INTO change_journal (table_name, operation, item_uid, before_json)
+            VALUES ('inventory', 'delete', OLD.uid, {journal_json("OLD", INVENTORY_SYNC_FIELDS)});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS attachments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            file_name TEXT NOT NULL,
+            mime_type TEXT,
+            size_bytes INTEGER NOT NULL,
+            added_by TEXT,
+            added_at TEXT NOT NULL,
+            UNIQUE (item_id, sha256)
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_attachments_sha256 ON attachments (sha256)")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS attachments_inventory_delete AFTER DELETE ON inventory
+        BEGIN
+            DELETE FROM attachments WHERE item_id = OLD.id;
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS journal_attachments_insert AFTER INSERT ON attachments
+        WHEN {journal_active}
+        BEGIN
+            INSERT INTO change_journal (table_name, operation, item_uid, after_json)
+            VALUES ('attachments', 'insert', (SELECT uid FROM inventory WHERE id = NEW.item_id), {journal_json("NEW", ATTACHMENT_SYNC_FIELDS)});
+        END
+    ''')
+    # Removals cascaded from an item delete need no entry; replaying the item delete cascades too
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS journal_attachments_delete AFTER DELETE ON attachments
+        WHEN {journal_active} AND EXISTS (SELECT 1 FROM inventory WHERE id = OLD.item_id)
+        BEGIN
+            INSERT INTO change_journal (table_name, operation, item_uid, before_json)
+            VALUES ('attachments', 'delete', (SELECT uid FROM inventory WHERE id = OLD.item_id), {journal_json("OLD", ATTACHMENT_SYNC_FIELDS)});
+        END
+    ''')
+    # Local-only change feed: one row per changed item, read by every session's inventory view.
+    # Bulk replacements that suspend the journal publish a single 'reload' entry instead.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_changes (
+            version INTEGER PRIMARY KEY AUTOINCREMENT,
+            item_id INTEGER,
+            operation TEXT NOT NULL,
+            changed_at TEXT NOT NULL DEFAULT (datetime('now', 'localtime'))
+        )
+    ''')
+    for operation, row in (("insert", "NEW"), ("update", "NEW"), ("delete", "OLD")):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS changes_inventory_{operation} AFTER {operation.upper()} ON inventory
+            WHEN {journal_active}
+            BEGIN
+                INSERT INTO inventory_changes (item_id, operation) VALUES ({row}.id, '{operation}');
+            END
+        ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS journal_status_events_insert AFTER INSERT ON status_events
+        WHEN {journal_active}
+        BEGIN
+            INSERT INTO change_journal (table_name, operation, item_uid, after_json)
+            VALUES ('status_events', 'insert', (SELECT uid FROM inventory WHERE id = NEW.item_id), {journal_json("NEW", STATUS_EVENT_SYNC_FIELDS)});
+        END
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS app_meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS spend_summary (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            item_count INTEGER NOT NULL DEFAULT 0,
+            quantity INTEGER NOT NULL DEFAULT 0,
+            spend REAL NOT NULL DEFAULT 0.0,
+            PRIMARY KEY (dimension, key)
+        )
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS spend_summary_after_insert AFTER INSERT ON inventory
+        BEGIN
+            {spend_summary_upserts("NEW", 1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS spend_summary_after_delete AFTER DELETE ON inventory
+        BEGIN
+            {spend_summary_upserts("OLD", -1)}
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS spend_summary_after_update
+        AFTER UPDATE OF requested_by, vendor, status, order_date, quantity, cost ON inventory
+        BEGIN
+            {spend_summary_upserts("OLD", -1)}
+            {spend_summary_upserts("NEW", 1)}
+        END
+    ''')
+
+    # Normalized item key: the add path upserts on it and bulk imports match rows on it with set-based
+    # joins. Items that collide on it (databases from before it was unique) are merged first.
+    key_index = cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'index' AND name = 'idx_inventory_item_key'").fetchone()
+    if not key_index or not key_index[0].startswith("CREATE UNIQUE"):
+        merge_item_key_collisions(cursor)
+        cursor.execute("DROP INDEX IF EXISTS idx_inventory_item_key")
+        cursor.execute(f"CREATE UNIQUE INDEX idx_inventory_item_key ON inventory ({ITEM_KEY})")
+
+    summary_built = cursor.execute("SELECT 1 FROM app_meta WHERE key = 'spend_summary_built'").fetchone()
+    dates_normalized = cursor.execute("SELECT 1 FROM app_meta WHERE key = 'dates_normalized'").fetchone()
     conn.commit()
     conn.close()
 
+    # Seed the summary once for databases created before it existed
+    if not summary_built:
+        rebuild_spend_summary(db_file)
+    # Convert free-form dates once for databases created before dates were normalized
+    if not dates_normalized:
+        normalize_inventory_dates(db_file)
+
+# Function to rewrite stored order and received dates as ISO-8601 (YYYY-MM-DD). Values that are
+# not dates are moved into the item's notes rather than dropped.
+def normalize_inventory_dates(db_file=None):
+    conn = get_db_connection(db_file, read_only=False)
+    cursor = conn.cursor()
+    dated = pd.read_sql_query(
+        "SELECT id, order_date, received_date, notes FROM inventory WHERE order_date IS NOT NULL OR received_date IS NOT NULL",
+        conn
+    )
+    original = dated.copy()
+    for column in IMPORT_DATE_COLUMNS:
+        normalize_date_column(dated, column)
+
+    # Blanks are filled before comparing; pandas counts None != None as a difference
+    changed = dated[(dated.astype(object).fillna("") != original.astype(object).fillna("")).any(axis=1)]
+    changed = changed.astype(object).where(changed.notna(), None)
+    cursor.executemany(
+        "UPDATE inventory SET order_date = ?, received_date = ?, notes = ? WHERE id = ?",
+        changed[["order_date", "received_date", "notes", "id"]].itertuples(index=False, name=None)
+    )
+    write_app_meta(cursor, "dates_normalized", "1")
+    conn.commit()
+    conn.close()
+    return len(changed)
+
+# Function to merge items whose catalog number and vendor differ only in case or surrounding
+# spaces, so the normalized item key can be unique. Returns the number of keys that collided.
+def merge_item_key_collisions(cursor):
+    collisions = cursor.execute(f"SELECT {ITEM_KEY} FROM inventory GROUP BY 1, 2 HAVING COUNT(*) > 1").fetchall()
+    for catalog_key, vendor_key in collisions:
+        cursor.execute(f'''
+            SELECT * FROM inventory
+            WHERE ({ITEM_KEY}) = (?, ?)
+            ORDER BY order_date DESC, received_date DESC, id
+        ''', (catalog_key, vendor_key))
+        merge_inventory_rows(cursor, cursor.fetchall())
+    return len(collisions)
+
+# Function to merge a group of inventory rows into the first one
+def merge_inventory_rows(cursor, duplicate_rows):
+    if len(duplicate_rows) < 2:
+        return
+
+    # Merge duplicate records
+    total_quantity = sum(row[6] or 0 for row in duplicate_rows)  # Summing quantity
+    combined_notes = " | ".join(filter(None, dict.fromkeys(row[8] for row in duplicate_rows)))  # Combine notes
+    latest_order_date = max(filter(None, [row[11] for row in duplicate_rows]), default=None)
+    latest_received_date = max(filter(None, [row[12] for row in duplicate_rows]), default=None)
+
+    # Keep the first row and update it with merged values
+    first_row = duplicate_rows[0]
+    cursor.execute('''
+        UPDATE inventory 
+        SET quantity = ?, notes = ?, order_date = ?, received_date = ?
+        WHERE id = ?
+    ''', (total_quantity, combined_notes, latest_order_date, latest_received_date, first_row[0]))
+
+    # Remove other duplicate rows and carry their attachments and status history over to the kept row
+    for row in duplicate_rows[1:]:
+        cursor.execute(f'''
+            INSERT OR IGNORE INTO attachments (item_id, {', '.join(ATTACHMENT_SYNC_FIELDS)})
+            SELECT ?, {', '.join(ATTACHMENT_SYNC_FIELDS)} FROM attachments WHERE item_id = ?
+        ''', (first_row[0], row[0]))
+        cursor.execute('DELETE FROM inventory WHERE id = ?', (row[0],))
+        cursor.execute('UPDATE status_events SET item_id = ? WHERE item_id = ?', (first_row[0], row[0]))
+
+# Function to build a json_object(...) expression over a row's sync fields for the journal triggers
+def journal_json(row, fields):
+    return "json_object(" + ", ".join(f"'{field}', {row}.{field}" for field in fields) + ")"
+
+# Function to generate the trigger body that adds (sign=1) or removes (sign=-1) a row from the spend summary
+def spend_summary_upserts(row, sign):
+    quantity = SPEND_QUANTITY_EXPRESSION.format(row=row)
+    spend = SPEND_EXPRESSION.format(row=row)
+    return "\n".join(f'''
+            INSERT INTO spend_summary (dimension, key, item_count, quantity, spend)
+            VALUES ('{dimension}', {expression.format(row=row)}, {sign}, {sign} * {quantity}, {sign} * {spend})
+            ON CONFLICT(dimension, key) DO UPDATE SET
+                item_count = item_count + excluded.item_count,
+                quantity = quantity + excluded.quantity,
+                spend = spend + excluded.spend;''' for dimension, expression in SPEND_SUMMARY_DIMENSIONS.items())
+
+# Function to read the spend summary rows, rounded so float drift does not register as a difference
+def read_spend_summary(cursor):
+    rows = cursor.execute('''
+        SELECT dimension, key, item_count, quantity, ROUND(spend, 2)
+        FROM spend_summary
+        WHERE item_count != 0
+        ORDER BY dimension, key
+    ''').fetchall()
+    return rows
+
+# Function to recompute the spend summary from scratch; returns True if the incremental copy already matched
+def rebuild_spend_summary(db_file=None):
+    conn = get_db_connection(db_file, read_only=False)
+    cursor = conn.cursor()
+    previous = read_spend_summary(cursor)
+
+    cursor.execute("DELETE FROM spend_summary")
+    for dimension, expression in SPEND_SUMMARY_DIMENSIONS.items():
+        cursor.execute(f'''
+            INSERT INTO spend_summary (dimension, key, item_count, quantity, spend)
+            SELECT '{dimension}', {expression.format(row="inventory")}, COUNT(*),
+                   SUM({SPEND_QUANTITY_EXPRESSION.format(row="inventory")}),
+                   SUM({SPEND_EXPRESSION.format(row="inventory")})
+            FROM inventory
+            GROUP BY 2
+        ''')
+    cursor.execute(
+        "INSERT INTO app_meta (key, value) VALUES ('spend_summary_built', ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (event_timestamp(),)
+    )
+
+    matched = previous == read_spend_summary(cursor)
+    if not matched:
+        publish_reload(cursor)  # Totals moved without an inventory change; reads keyed on the feed must refresh
+    conn.commit()
+    conn.close()
+    return matched
+
+# Function to load one dimension of the spend summary for the dashboard
+def get_spend_summary(dimension, db_file=None):
+    conn = get_db_connection(db_file)
+    summary = pd.read_sql_query('''
+        SELECT key, item_count, quantity, spend
+        FROM spend_summary
+        WHERE dimension = ? AND item_count > 0
+        ORDER BY spend DESC, item_count DESC
+    ''', conn, params=(dimension,))
+    conn.close()
+    return summary
+
+# Function to run routine database maintenance: always PRAGMA optimize, and a full
+# VACUUM + ANALYZE when the last one is older than the interval or free pages pile up.
+# Archived shards are frozen, so they are left exactly as they are.
+def run_db_maintenance(force=False, db_file=None):
+    db_file = db_file or LOCAL_DB_FILE
+    if db_file in READ_ONLY_DB_FILES:
+        return False
+    conn = get_db_connection(db_file, read_only=False)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("PRAGMA optimize")
+        # Synced journal entries are only kept for a while; in local mode nothing is ever synced
+        cursor.execute(
+            "DELETE FROM change_journal WHERE (synced_at IS NOT NULL OR ?) AND created_at < datetime('now', 'localtime', ?)",
+            (SYNC_MODE == "local", f"-{JOURNAL_RETENTION_DAYS} days")
+        )
+        # Views further behind than the retained feed fall back to a full reload
+        cursor.execute(
+            "DELETE FROM inventory_changes WHERE version <= (SELECT MAX(version) FROM inventory_changes) - ?",
+            (CHANGE_FEED_RETENTION,)
+        )
+        conn.commit()
+
+        page_count = cursor.execute("PRAGMA page_count").fetchone()[0]
+        freelist_count = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        last_vacuum = cursor.execute("SELECT value FROM app_meta WHERE key = 'last_vacuum'").fetchone()
+        last_vacuum = float(last_vacuum[0]) if last_vacuum else 0.0
+
+        vacuum_due = (
+            force
+            or time.time() - last_vacuum >= MAINTENANCE_INTERVAL_SECONDS
+            or (page_count and freelist_count / page_count >= MAINTENANCE_FREE_PAGE_RATIO)
+        )
+        if not vacuum_due:
+            return False
+
+        cursor.execute("VACUUM")
+        cursor.execute("ANALYZE")
+        cursor.execute(
+            "INSERT INTO app_meta (key, value) VALUES ('last_vacuum', ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (str(time.time()),)
+        )
+        conn.commit()
+        return True
+    finally:
+        conn.close()
+
+# Function to run maintenance on a fixed cadence for every local shard, away from the request path
+def maintenance_loop(db_files):
+    while True:
+        for db_file in db_files:
+            if not os.path.exists(db_file):
+                continue
+            try:
+                run_db_maintenance(db_file=db_file)
+            except sqlite3.Error:
+                pass  # Database busy or locked; try again on the next cycle
+        try:
+            collect_attachment_garbage(db_files)
+        except (sqlite3.Error, OSError, HttpError, httplib2.HttpLib2Error):
+            pass  # Index busy or Drive unreachable; try again on the next cycle
+        time.sleep(MAINTENANCE_CHECK_SECONDS)
+
+# Function to start the maintenance thread once per server process
+@st.cache_resource
+def start_maintenance_scheduler(db_files):
+    thread = threading.Thread(target=maintenance_loop, args=(db_files,), name="db-maintenance", daemon=True)
+    thread.start()
+    return thread
+
+# Function to read a value from a database's app_meta table
+def read_app_meta(cursor, key):
+    row = cursor.execute("SELECT value FROM app_meta WHERE key = ?", (key,)).fetchone()
+    return row[0] if row else None
+
+# Function to write a value to a database's app_meta table
+def write_app_meta(cursor, key, value):
+    cursor.execute(
+        "INSERT INTO app_meta (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+        (key, value)
+    )
+
+# Function to read the newest change-feed version of a database; 0 when nothing was published
+def latest_change_version(cursor):
+    return cursor.execute("SELECT COALESCE(MAX(version), 0) FROM inventory_changes").fetchone()[0]
+
+# Function to publish a full-reload entry on the change feed, for writes that bypass the per-row
+# triggers; after_version keeps the feed increasing when the old entries were just overwritten
+def publish_reload(cursor, after_version=0):
+    cursor.execute(
+        "INSERT INTO inventory_changes (version, item_id, operation) VALUES (MAX(?, (SELECT COALESCE(MAX(version), 0) FROM inventory_changes)) + 1, NULL, 'reload')",
+        (after_version,)
+    )
+
+# Function to record a sync conflict; the local change wins and the remote value is kept for review
+def record_sync_conflict(cursor, op_id, item_uid, field, local_value, remote_value):
+    cursor.execute('''
+        INSERT INTO sync_conflicts (op_id, item_uid, field, local_value, remote_value, detected_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', (op_id, item_uid, field, None if local_value is None else str(local_value),
+          None if remote_value is None else str(remote_value), event_timestamp()))
+
+# Function to replay one journal entry onto another copy of the database. Entries already listed
+# in applied_ops are skipped, so replaying the same journal twice is harmless.
+def apply_journal_entry(cursor, entry):
+    op_id, table_name, operation, item_uid, before_json, after_json = entry
+    if cursor.execute("SELECT 1 FROM applied_ops WHERE op_id = ?", (op_id,)).fetchone():
+        return
+
+    before = json.loads(before_json) if before_json else {}
+    after = json.loads(after_json) if after_json else {}
+
+    if table_name == "inventory":
+        current = cursor.execute(
+            f"SELECT {', '.join(INVENTORY_SYNC_FIELDS)} FROM inventory WHERE uid = ?", (item_uid,)
+        ).fetchone()
+        current = dict(zip(INVENTORY_SYNC_FIELDS, current)) if current else None
+
+        if operation == "insert" and current is None:
+            # An item added on both sides under different uids is merged as a repeated add would be
+            existing = cursor.execute(
+                f"SELECT uid FROM inventory WHERE ({ITEM_KEY}) = (lower(trim(?)), lower(trim(?)))",
+                (after.get("catalog_number"), after.get("vendor"))
+            ).fetchone()
+            if existing:
+                record_sync_conflict(cursor, op_id, item_uid, "uid", item_uid, existing[0])
+            cursor.execute(item_upsert_sql(INVENTORY_SYNC_FIELDS), [after.get(field) for field in INVENTORY_SYNC_FIELDS]).fetchall()
+        elif operation == "update":
+            changed = [field for field in INVENTORY_SYNC_FIELDS if after.get(field) != before.get(field)]
+            if current is None:
+                if changed:
+                    record_sync_conflict(cursor, op_id, item_uid, None, "updated", "deleted")
+            else:
+                for field in changed:
+                    if current[field] not in (before.get(field), after.get(field)):
+                        record_sync_conflict(cursor, op_id, item_uid, field, after.get(field), current[field])
+                if {"catalog_number", "vendor"} & set(changed):
+                    collision = cursor.execute(
+                        f"SELECT 1 FROM inventory WHERE ({ITEM_KEY}) = (lower(trim(?)), lower(trim(?))) AND uid != ?",
+                        (after.get("catalog_number"), after.get("vendor"), item_uid)
+                    ).fetchone()
+                    if collision:
+                        # The new key belongs to another item here; the rest of the edit still applies
+                        record_sync_conflict(cursor, op_id, item_uid, "catalog_number", after.get("catalog_number"), current["catalog_number"])
+                        changed = [field for field in changed if field not in ("catalog_number", "vendor")]
+                if changed:
+                    cursor.execute(
+                        f"UPDATE inventory SET {', '.join(f'{field} = ?' for field in changed)} WHERE uid = ?",
+                        [after.get(field) for field in changed] + [item_uid]
+                    )
+        elif operation == "delete" and current is not None:
+            cursor.execute("DELETE FROM inventory WHERE uid = ?", (item_uid,))
+
+    elif table_name == "status_events":
+        item = cursor.execute("SELECT id FROM inventory WHERE uid = ?", (item_uid,)).fetchone()
+        if item:
+            cursor.execute('''
+                INSERT INTO status_events (item_id, from_status, to_status, changed_at, actor, quantity)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (item[0], *[after.get(field) for field in STATUS_EVENT_SYNC_FIELDS]))
+
+    elif table_name == "attachments":
+        item = cursor.execute("SELECT id FROM inventory WHERE uid = ?", (item_uid,)).fetchone()
+        if item and operation == "insert":
+            cursor.execute(
+                f"INSERT OR IGNORE INTO attachments (item_id, {', '.join(ATTACHMENT_SYNC_FIELDS)}) VALUES (?, {', '.join('?' for _ in ATTACHMENT_SYNC_FIELDS)})",
+                (item[0], *[after.get(field) for field in ATTACHMENT_SYNC_FIELDS])
+            )
+        elif item and operation == "delete":
+            cursor.execute("DELETE FROM attachments WHERE item_id = ? AND sha256 = ?", (item[0], before.get("sha256")))
+
+    cursor.execute("INSERT INTO applied_ops (op_id, applied_at) VALUES (?, ?)", (op_id, event_timestamp()))
+
+# Function to read the revision a shard's Drive file currently points at
+def get_remote_revision(service, drive_file_id):
+    return service.files().get(fileId=drive_file_id, fields="headRevisionId").execute()["headRevisionId"]
+
+# Function to find the revision an upload replaced: the one before it in the file's revision history
+def get_replaced_revision(service, drive_file_id, revision_id):
+    revisions = []
+    page_token = None
+    while True:
+        page = service.revisions().list(
+            fileId=drive_file_id, fields="nextPageToken,revisions(id)", pageSize=1000, pageToken=page_token
+        ).execute()
+        revisions += [revision["id"] for revision in page.get("revisions", [])]
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            break
+    position = revisions.index(revision_id)
+    return revisions[position - 1] if position else None
+
+# Function to download one revision of a shard through the Drive API
+def download_remote_db(service, drive_file_id, target_path, revision_id):
+    payload_path = target_path + ".download"
+    with open(payload_path, "wb") as payload:
+        request = service.revisions().get_media(fileId=drive_file_id, revisionId=revision_id)
+        downloader = MediaIoBaseDownload(payload, request, chunksize=UPLOAD_CHUNK_SIZE)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk(num_retries=UPLOAD_MAX_RETRIES)
+    restore_db_payload(payload_path, target_path)
+
+# Function to replay pending journal entries onto a remote revision and adopt the result locally.
+# Returns False (and changes nothing) if new local writes arrived while the merge was built.
+def merge_remote_revision(service, db_file, drive_file_id, revision_id, pending, replayed_through):
+    merged_path = db_file + ".merge"
+    download_remote_db(service, drive_file_id, merged_path, revision_id)
+    init_db(merged_path)
+    merged = get_db_connection(merged_path, read_only=False)
+    merged_cursor = merged.cursor()
+    for entry in pending:
+        apply_journal_entry(merged_cursor, entry[1:])
+    merged.commit()
+    merged.close()
+
+    adopted = adopt_merged_db(db_file, merged_path, replayed_through, revision_id)
+    os.remove(merged_path)
+    return adopted
+
+# Function to take in a revision that one of our uploads replaced before we had merged it. Its
+# uploader's journal entries that were never applied here are replayed onto the local copy, where
+# the journal triggers record them again as our own pending changes, so the next upload carries them.
+def recover_replaced_revision(service, db_file, drive_file_id, revision_id):
+    replaced_path = db_file + ".replaced"
+    download_remote_db(service, drive_file_id, replaced_path, revision_id)
+    replaced = get_db_connection(replaced_path, read_only=True)
+    entries = replaced.execute('''
+        SELECT op_id, table_name, operation, item_uid, before_json, after_json
+        FROM change_journal
+        ORDER BY seq
+    ''').fetchall()
+    replaced.close()
+    os.remove(replaced_path)
+
+    conn = get_db_connection(db_file, read_only=False)
+    cursor = conn.cursor()
+    for entry in entries:
+        apply_journal_entry(cursor, entry)
+    conn.commit()
+    conn.close()
+
+# Function to replace the local shard's synced tables with a merged copy, in one local transaction.
+# Returns False (and changes nothing) if new local writes arrived after the merge was built.
+def adopt_merged_db(db_file, merged_path, replayed_through, remote_revision):
+    conn = sqlite3.connect(db_file, isolation_level=None)
+    try:
+        conn.execute("ATTACH DATABASE ? AS merged", (merged_path,))
+        conn.execute("BEGIN IMMEDIATE")
+        newer = conn.execute(
+            "SELECT 1 FROM change_journal WHERE synced_at IS NULL AND seq > ? LIMIT 1", (replayed_through,)
+        ).fetchone()
+        if newer:
+            conn.execute("ROLLBACK")
+            return False
+
+        # Item ids are local: sessions hold them between reruns and writes target them. Items keep
+        # their local id by uid, and items new to this copy get ids past any this copy has used.
+        conn.execute("DROP TABLE IF EXISTS temp.adopted_ids")
+        conn.execute('''
+            CREATE TEMP TABLE adopted_ids AS
+            SELECT m.id AS merged_id,
+                   COALESCE(l.id, (
+                       SELECT COALESCE(MAX(used), 0) FROM (
+                           SELECT MAX(id) AS used FROM main.inventory
+                           UNION ALL SELECT seq FROM main.sqlite_sequence WHERE name = 'inventory'
+                       )
+                   ) + ROW_NUMBER() OVER (PARTITION BY l.id IS NULL ORDER BY m.id)) AS local_id
+            FROM merged.inventory m
+            LEFT JOIN main.inventory l ON l.uid = m.uid
+        ''')
+
+        write_app_meta(conn, "journal_suspended", "1")
+        for table in SYNCED_TABLES:
+            columns = [row[1] for row in conn.execute(f"PRAGMA main.table_info({table})")]
+            conn.execute(f"DELETE FROM main.{table}")
+            item_column = ITEM_ID_COLUMNS.get(table)
+            if item_column:
+                values = ", ".join("a.local_id" if column == item_column else f"t.{column}" for column in columns)
+                conn.execute(f'''
+                    INSERT INTO main.{table} ({', '.join(columns)})
+                    SELECT {values} FROM merged.{table} t JOIN temp.adopted_ids a ON a.merged_id = t.{item_column}
+                ''')
+            else:
+                conn.execute(f"INSERT INTO main.{table} ({', '.join(columns)}) SELECT {', '.join(columns)} FROM merged.{table}")
+        conn.execute("DELETE FROM app_meta WHERE key = 'journal_suspended'")
+        publish_reload(conn)
+        write_app_meta(conn, "remote_revision", remote_revision)
+        conn.execute("COMMIT")
+        return True
+    finally:
+        conn.close()
+
+# Function to reconcile one shard with Google Drive. Unless the remote revision is the one this copy
+# last synced with, pending journal entries are replayed onto it and the merge is adopted locally; an
+# unknown base (first sync of an existing file, lost app_meta) counts as diverged. Then the result is
+# uploaded. Drive cannot make an upload conditional, so the revision is checked again just before
+# uploading and the upload is checked afterwards: if it replaced a revision other than the merged
+# one, that revision's changes are taken in and uploaded again. A restored snapshot is uploaded
+# over its base revision instead of being merged, and is held back for the user if Drive moved on.
+def sync_shard(db_file, drive_file_id, progress_callback=None, max_attempts=3):
+    service = get_drive_service()
+    synced = 0
+
+    for _ in range(max_attempts):
+        conn = get_db_connection(db_file, read_only=False)
+        cursor = conn.cursor()
+        pending = cursor.execute('''
+            SELECT seq, op_id, table_name, operation, item_uid, before_json, after_json
+            FROM change_journal
+            WHERE synced_at IS NULL
+            ORDER BY seq
+        ''').fetchall()
+        base_revision = read_app_meta(cursor, "remote_revision")
+        restore_pending = read_app_meta(cursor, "restore_pending")
+        conn.close()
+
+        replayed_through = pending[-1][0] if pending else 0
+        remote_revision = get_remote_revision(service, drive_file_id)
+
+        if restore_pending:
+            if base_revision != remote_revision:
+                conn = get_db_connection(db_file, read_only=False)
+                write_app_meta(conn, "restore_conflict", remote_revision)
+                conn.commit()
+                conn.close()
+                raise RuntimeError("Google Drive changed after the restored snapshot's base; the restore waits for a decision under Database Maintenance")
+        elif base_revision != remote_revision:
+            if not merge_remote_revision(service, db_file, drive_file_id, remote_revision, pending, replayed_through):
+                continue  # New local writes landed mid-merge; rebuild the merge with them included
+
+        if not pending and not restore_pending:
+            return synced  # Nothing of ours to push
+
+        # Mark our entries as applied in the copy we upload, so a later replay skips them
+        conn = get_db_connection(db_file, read_only=False)
+        conn.executemany(
+            "INSERT OR IGNORE INTO applied_ops (op_id, applied_at) VALUES (?, ?)",
+            [(entry[1], event_timestamp()) for entry in pending]
+        )
+        conn.commit()
+        conn.close()
+
+        payload_path = compress_db_payload(create_db_snapshot(db_file), db_file + ".gz")
+        if get_remote_revision(service, drive_file_id) != remote_revision:
+            continue  # Another upload landed while ours was prepared; merge it first
+        response = run_resumable_upload(
+            build_upload_request(service, payload_path, drive_file_id=drive_file_id),
+            progress_callback=progress_callback
+        )
+
+        conn = get_db_connection(db_file, read_only=False)
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE change_journal SET synced_at = ? WHERE synced_at IS NULL AND seq <= ?",
+            (event_timestamp(), replayed_through)
+        )
+        write_app_meta(cursor, "remote_revision", response["headRevisionId"])
+        cursor.execute("DELETE FROM app_meta WHERE key = 'restore_pending'")
+        conn.commit()
+        conn.close()
+        synced += len(pending)
+
+        replaced = get_replaced_revision(service, drive_file_id, response["headRevisionId"])
+        if replaced == remote_revision:
+            return synced
+        if restore_pending:
+            # Replaying that upload's journal would bring back rows the restore rolled back, so the
+            # restore stands and the replaced revision, still in Drive's history, is logged for review
+            conn = get_db_connection(db_file, read_only=False)
+            record_sync_conflict(conn, "restore", None, "revision", response["headRevisionId"], replaced)
+            conn.commit()
+            conn.close()
+            return synced
+        # Another upload landed between the check and ours and was overwritten; merge it back in
+        recover_replaced_revision(service, db_file, drive_file_id, replaced)
+
+    raise RuntimeError("Google Drive or local writes kept changing during sync; will retry")
+
+# Function to hold per-shard sync coordination shared by all sessions in this process
+@st.cache_resource
+def get_sync_state(db_file, drive_file_id):
+    return {"lock": threading.Lock(), "wake": threading.Event(), "last_sync": None, "last_error": None}
+
+# Function to reconcile a shard in the background, on a timer or when a write wakes it up
+def sync_loop(db_file, drive_file_id, sync_state):
+    failures = 0
+    while True:
+        delay = SYNC_INTERVAL_SECONDS if failures == 0 else backoff_delay(failures, cap=SYNC_INTERVAL_SECONDS)
+        sync_state["wake"].wait(timeout=delay)
+        sync_state["wake"].clear()
+        try:
+            with sync_state["lock"]:
+                sync_shard(db_file, drive_file_id)
+            sync_state["last_sync"] = event_timestamp()
+            sync_state["last_error"] = None
+            failures = 0
+        except Exception as e:
+            # Offline or Drive unavailable: the journal keeps every change until a later attempt succeeds
+            sync_state["last_error"] = str(e)
+            failures = min(failures + 1, UPLOAD_MAX_RETRIES)
+
+# Function to start one background sync worker per shard and process
+@st.cache_resource
+def start_sync_worker(db_file, drive_file_id):
+    sync_state = get_sync_state(db_file, drive_file_id)
+    thread = threading.Thread(target=sync_loop, args=(db_file, drive_file_id, sync_state), name=f"sync-{db_file}", daemon=True)
+    thread.start()
+    return thread
+
+# Function to count local changes that have not reached Google Drive yet
+def count_pending_changes():
+    conn = get_db_connection()
+    pending = conn.execute("SELECT COUNT(*) FROM change_journal WHERE synced_at IS NULL").fetchone()[0]
+    conn.close()
+    return pending
+
+# Function to open the local attachment index: which blobs this machine has seen, when each was
+# last used, and where its Drive copy is. Not synced; the attachments table holds the references.
+def get_attachment_index_connection():
+    os.makedirs(ATTACHMENT_DIR, exist_ok=True)
+    conn = sqlite3.connect(ATTACHMENT_INDEX_FILE, check_same_thread=False)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            size_bytes INTEGER NOT NULL,
+            drive_file_id TEXT,
+            last_used REAL NOT NULL
+        )
+    ''')
+    return conn
+
+# Function to get the local path of a blob; the first two hex digits fan files out into subdirectories
+def attachment_blob_path(sha256):
+    return os.path.join(ATTACHMENT_DIR, sha256[:2], sha256)
+
+# Function to hash a file on disk without reading it into memory at once
+def hash_attachment_file(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as blob:
+        for chunk in iter(lambda: blob.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+# Function to record that a blob is held locally, optionally with its Drive copy
+def touch_attachment_blob(conn, sha256, size_bytes, drive_file_id=None):
+    conn.execute('''
+        INSERT INTO blobs (sha256, size_bytes, drive_file_id, last_used) VALUES (?, ?, ?, ?)
+        ON CONFLICT(sha256) DO UPDATE SET
+            drive_file_id = COALESCE(excluded.drive_file_id, drive_file_id),
+            last_used = excluded.last_used
+    ''', (sha256, size_bytes, drive_file_id, time.time()))
+    conn.commit()
+
+# Function to write a blob into the local store; identical content is stored once. Returns its hash.
+def store_attachment_blob(raw_data):
+    sha256 = hashlib.sha256(raw_data).hexdigest()
+    path = attachment_blob_path(sha256)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(staging_path, "wb") as staging:
+            staging.write(raw_data)
+        os.replace(staging_path, path)
+
+    conn = get_attachment_index_connection()
+    touch_attachment_blob(conn, sha256, len(raw_data))
+    conn.close()
+    return sha256
+
+# Function to find a blob in the Drive attachment folder; blobs are named by their hash
+def find_remote_blob(service, sha256):
+    files = service.files().list(
+        q=f"name = '{sha256}' and '{ATTACHMENT_DRIVE_FOLDER_ID}' in parents and trashed = false",
+        fields="files(id)",
+        pageSize=1
+    ).execute().get("files", [])
+    return files[0]["id"] if files else None
+
+# Function to download a blob from Drive into the local store, checking it against its hash
+def fetch_attachment_blob(sha256):
+    if SYNC_MODE == "local" or not ATTACHMENT_DRIVE_FOLDER_ID:
+        raise FileNotFoundError(f"Attachment {sha256[:12]} is not stored on this machine")
+
+    service = get_drive_service()
+    conn = get_attachment_index_connection()
+    try:
+        known = conn.execute("SELECT drive_file_id FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+        drive_file_id = (known and known[0]) or find_remote_blob(service, sha256)
+        if drive_file_id is None:
+            raise FileNotFoundError(f"Attachment {sha256[:12]} has not been uploaded yet")
+
+        path = attachment_blob_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        staging_path = f"{path}.{os.getpid()}.{threading.get_ident()}.download"
+        with open(staging_path, "wb") as staging:
+            downloader = MediaIoBaseDownload(staging, service.files().get_media(fileId=drive_file_id), chunksize=UPLOAD_CHUNK_SIZE)
+            done = False
+            while not done:
+                _, done = downloader.next_chunk(num_retries=UPLOAD_MAX_RETRIES)
+        if hash_attachment_file(staging_path) != sha256:
+            os.remove(staging_path)
+            raise ValueError(f"Downloaded attachment {sha256[:12]} does not match its hash")
+        os.replace(staging_path, path)
+        touch_attachment_blob(conn, sha256, os.path.getsize(path), drive_file_id)
+    finally:
+        conn.close()
+    evict_attachment_cache()
+
+# Function to read a blob, fetching it into the local cache first when this machine does not hold it
+def read_attachment_blob(sha256):
+    path = attachment_blob_path(sha256)
+    if not os.path.exists(path):
+        fetch_attachment_blob(sha256)
+    with open(path, "rb") as blob:
+        raw_data = blob.read()
+
+    conn = get_attachment_index_connection()
+    touch_attachment_blob(conn, sha256, len(raw_data))
+    conn.close()
+    return raw_data
+
+# Function to keep the local blob cache under its size budget, least recently used first. Only
+# blobs with a Drive copy are evicted, and the index remembers where to fetch them again.
+def evict_attachment_cache(max_bytes=ATTACHMENT_CACHE_MAX_BYTES):
+    conn = get_attachment_index_connection()
+    held = [
+        (sha256, size_bytes, drive_file_id)
+        for sha256, size_bytes, drive_file_id in conn.execute("SELECT sha256, size_bytes, drive_file_id FROM blobs ORDER BY last_used")
+        if os.path.exists(attachment_blob_path(sha256))
+    ]
+    conn.close()
+
+    total = sum(size_bytes for _, size_bytes, _ in held)
+    for sha256, size_bytes, drive_file_id in held:
+        if total <= max_bytes:
+            break
+        if drive_file_id is not None:
+            os.remove(attachment_blob_path(sha256))
+            total -= size_bytes
+
+# Function to upload every local blob that has no Drive copy yet. A blob another client already
+# uploaded is found by name and only recorded, so identical files are stored on Drive once.
+def upload_pending_attachments():
+    conn = get_attachment_index_connection()
+    try:
+        pending = [row[0] for row in conn.execute("SELECT sha256 FROM blobs WHERE drive_file_id IS NULL")]
+        pending = [sha256 for sha256 in pending if os.path.exists(attachment_blob_path(sha256))]
+        if not pending:
+            return 0
+
+        service = get_drive_service()
+        for sha256 in pending:
+            drive_file_id = find_remote_blob(service, sha256)
+            if drive_file_id is None:
+                request = service.files().create(
+                    body={"name": sha256, "parents": [ATTACHMENT_DRIVE_FOLDER_ID]},
+                    media_body=MediaFileUpload(attachment_blob_path(sha256), mimetype="application/octet-stream", chunksize=UPLOAD_CHUNK_SIZE, resumable=True),
+                    fields="id"
+                )
+                drive_file_id = run_resumable_upload(request)["id"]
+            conn.execute("UPDATE blobs SET drive_file_id = ? WHERE sha256 = ?", (drive_file_id, sha256))
+            conn.commit()
+    finally:
+        conn.close()
+    evict_attachment_cache()
+    return len(pending)
+
+# Function to hold the attachment uploader's coordination, shared by all sessions in this process
+@st.cache_resource
+def get_attachment_state():
+    return {"wake": threading.Event(), "last_error": None}
+
+# Function to upload attachments in the background, independently of database syncs
+def attachment_upload_loop(attachment_state):
+    failures = 0
+    while True:
+        delay = SYNC_INTERVAL_SECONDS if failures == 0 else backoff_delay(failures, cap=SYNC_INTERVAL_SECONDS)
+        attachment_state["wake"].wait(timeout=delay)
+        attachment_state["wake"].clear()
+        try:
+            upload_pending_attachments()
+            attachment_state["last_error"] = None
+            failures = 0
+        except Exception as e:
+            # Blobs stay in the local store until a later attempt uploads them
+            attachment_state["last_error"] = str(e)
+            failures = min(failures + 1, UPLOAD_MAX_RETRIES)
+
+# Function to start the attachment uploader once per server process
+@st.cache_resource
+def start_attachment_uploader():
+    thread = threading.Thread(target=attachment_upload_loop, args=(get_attachment_state(),), name="attachment-upload", daemon=True)
+    thread.start()
+    return thread
+
+# Function to read the blob hashes a database's attachments reference
+def read_attachment_references(db_file):
+    conn = get_db_connection(db_file, read_only=True)
+    try:
+        if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attachments'").fetchone():
+            return set()
+        return {row[0] for row in conn.execute("SELECT DISTINCT sha256 FROM attachments")}
+    finally:
+        conn.close()
+
+# Function to delete blobs that no shard references any more, locally and on Drive. The grace
+# period covers references other clients have made but not synced yet. Retained snapshots count
+# as references, since restoring one brings its attachments back. Drive copies are shared by every
+# deployment, so they are only deleted once every configured shard and its snapshots were read here.
+def collect_attachment_garbage(db_files, grace_seconds=ATTACHMENT_GC_GRACE_SECONDS):
+    if not os.path.exists(ATTACHMENT_INDEX_FILE):
+        return 0
+
+    referenced = set()
+    checked_all = {shard["local_db_file"] for shard in LAB_SHARDS.values()} <= set(db_files)
+    for db_file in db_files:
+        if not os.path.exists(db_file):
+            checked_all = False
+            continue
+        for path in [db_file, *list_db_snapshots(db_file)]:
+            try:
+                referenced |= read_attachment_references(path)
+            except sqlite3.Error:
+                checked_all = False  # Busy, or a snapshot being written or removed
+
+    conn = get_attachment_index_connection()
+    try:
+        candidates = [
+            (sha256, drive_file_id)
+            for sha256, drive_file_id in conn.execute("SELECT sha256, drive_file_id FROM blobs WHERE last_used < ?", (time.time() - grace_seconds,))
+            if sha256 not in referenced and (drive_file_id is None or checked_all)
+        ]
+        service = None
+        for sha256, drive_file_id in candidates:
+            if drive_file_id is not None:
+                if SYNC_MODE == "local":
+                    continue  # The Drive copy can only be removed while connected
+                service = service or get_drive_service()
+                try:
+                    service.files().delete(fileId=drive_file_id).execute()
+                except HttpError as e:
+                    if e.resp.status != 404:
+                        raise
+            if os.path.exists(attachment_blob_path(sha256)):
+                os.remove(attachment_blob_path(sha256))
+            conn.execute("DELETE FROM blobs WHERE sha256 = ?", (sha256,))
+            conn.commit()
+    finally:
+        conn.close()
+    return len(candidates)
+
+# Function to download and migrate a shard once per server process rather than on every rerun
+@st.cache_resource(show_spinner=False)
+def prepare_database(db_file, drive_file_id):
+    download_db(db_file, drive_file_id)
+    init_db(db_file)
+    return True
+
 # Start by downloading the database and initializing it
-download_db()
-init_db()
+prepare_database(LOCAL_DB_FILE, GOOGLE_DRIVE_FILE_ID)
+start_maintenance_scheduler(tuple(sorted(shard["local_db_file"] for shard in LAB_SHARDS.values())))
+if SYNC_MODE == "offline_first":
+    for shard in LAB_SHARDS.values():
+        if not shard["read_only"] and os.path.exists(shard["local_db_file"]):
+            start_sync_worker(shard["local_db_file"], shard["drive_file_id"])
+if SYNC_MODE != "local" and ATTACHMENT_DRIVE_FOLDER_ID:
+    start_attachment_uploader()
 
 # Function to retrieve inventory data
-def get_inventory():
-    conn = get_db_connection()
+def get_inventory(db_file=None):
+    conn = get_db_connection(db_file)
     cursor = conn.cursor()
-    cursor.execute("SELECT * FROM inventory")
+    cursor.execute('''
+        SELECT id, requested_by, catalog_number, vendor, name, url, quantity, unit, notes, cost, status, order_date, received_date
+        FROM inventory
+    ''')
     rows = cursor.fetchall()
     conn.close()
     return rows
 
-inventory_df = pd.DataFrame(get_inventory(), columns=[
+INVENTORY_COLUMNS = [
     "ID", "Requested By", "Catalog Number", "Vendor", "Name", "URL",
     "Quantity", "Unit", "Notes", "Cost", "Status", "Order Date", "Received Date"
-])
-inventory_df = inventory_df.drop(columns=["ID"])
+]
+
+# Date columns the inventory table can be filtered on
+DATE_FILTER_FIELDS = {"Order Date": "order_date", "Received Date": "received_date"}
+
+# Text columns a search query is matched against
+SEARCH_COLUMNS = ["Requested By", "Catalog Number", "Vendor", "Name", "URL", "Unit", "Notes", "Status"]
+
+# Keyed fragments that show inventory rows; writes from the results list rerun only these
+INVENTORY_FRAGMENTS = ["inventory_overview", "inventory_search"]
+
+# Function to read inventory rows as displayed, indexed by item id; optionally filtered by a WHERE clause
+def read_inventory_frame(conn, where=None, params=()):
+    query = """
+        SELECT id, requested_by, catalog_number, vendor, name, url, quantity, unit, notes, cost, status, order_date, received_date
+        FROM inventory
+    """
+    if where:
+        query += f" WHERE {where}"
+    frame = pd.DataFrame(conn.execute(query, params).fetchall(), columns=INVENTORY_COLUMNS)
+    return frame.set_index("ID").rename_axis(None)
+
+# Function to read the items ordered or received between two dates (inclusive); the comparison
+# runs in SQL as a range scan over the date index
+def get_inventory_in_date_range(date_field, start, end, db_file=None):
+    if date_field not in DATE_FILTER_FIELDS.values():
+        raise ValueError(f"Not a date field: {date_field}")
+    conn = get_db_connection(db_file)
+    frame = read_inventory_frame(
+        conn,
+        f"{date_field} >= ? AND {date_field} < ?",
+        (start.isoformat(), (pd.Timestamp(end) + pd.Timedelta(days=1)).date().isoformat())
+    )
+    conn.close()
+    return frame
+
+# Function to hold a shard's inventory view, shared by every session in the process: the frame,
+# the change-feed version it reflects, and a long-lived connection used only for polling
+@st.cache_resource
+def get_inventory_view(db_file):
+    return {"lock": threading.Lock(), "conn": None, "inode": None, "data_version": None, "version": None, "frame": None}
+
+# Function to bring a shard's inventory view up to date. When nothing was committed a poll costs
+# one PRAGMA data_version; otherwise only the rows named in the change feed are re-read, unless
+# the feed asks for a reload or no longer reaches back to the view's version.
+def refresh_inventory_view(db_file=None):
+    db_file = db_file or LOCAL_DB_FILE
+    view = get_inventory_view(db_file)
+    with view["lock"]:
+        # A replaced file (fresh download, adopted payload) needs a new connection and a reload
+        inode = os.stat(db_file).st_ino
+        if view["conn"] is None or view["inode"] != inode:
+            if view["conn"] is not None:
+                view["conn"].close()
+            # Read-only and traced like every other connection; the view only ever reads
+            view.update(conn=get_db_connection(db_file, read_only=True), inode=inode, data_version=None, version=None)
+        conn = view["conn"]
+        try:
+            return refresh_view_frame(view, conn)
+        finally:
+            # The connection stays open between polls, so hand its traced statements over now
+            if isinstance(conn, TracingConnection):
+                conn.flush_trace()
+
+# Function to re-read what changed since the view's last refresh; called with the view's lock held
+def refresh_view_frame(view, conn):
+    data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    if data_version == view["data_version"]:
+        return view["frame"]
+    view["data_version"] = data_version
+
+    # Read the feed position first, so a write landing mid-refresh is picked up next poll
+    latest = latest_change_version(conn)
+    if latest == view["version"]:
+        return view["frame"]
+
+    changes = None
+    if view["version"] is not None and latest > view["version"]:
+        oldest = conn.execute("SELECT MIN(version) FROM inventory_changes").fetchone()[0]
+        if oldest <= view["version"] + 1:
+            changes = conn.execute(
+                "SELECT DISTINCT item_id, operation = 'reload' FROM inventory_changes WHERE version > ?",
+                (view["version"],)
+            ).fetchall()
+
+    if changes is None or len(changes) > CHANGE_PATCH_LIMIT or any(reload for _, reload in changes):
+        frame = read_inventory_frame(conn)
+    else:
+        item_ids = sorted({item_id for item_id, _ in changes})
+        patched = read_inventory_frame(conn, f"id IN ({', '.join('?' * len(item_ids))})", item_ids)
+        frame = pd.concat([view["frame"].drop(index=item_ids, errors="ignore"), patched]).sort_index()
+        # A patch with an all-empty column arrives as object dtype; match what a full read infers
+        frame = frame.infer_objects()
+
+    view.update(frame=frame, version=latest)
+    return frame
 
-# Function to add an item to the database
+# Function to get the active shard's current inventory frame
+def load_current_inventory():
+    return refresh_inventory_view(LOCAL_DB_FILE)
+
+# Function to render the whole inventory as CSV; called lazily when the download is clicked
+def export_inventory_csv(db_file):
+    return pd.DataFrame(get_inventory(db_file), columns=INVENTORY_COLUMNS).drop(columns=["ID"]).to_csv(index=False)
+
+inventory_df = load_current_inventory()
+
+# Function to read a shard's change-feed version; every committed inventory change moves it
+def get_change_version(db_file=None):
+    conn = get_db_connection(db_file, read_only=True)
+    version = latest_change_version(conn)
+    conn.close()
+    return version
+
+# Function to hold the latest result of each keyed cross-lab read per shard, with the
+# change-feed version it reflects
+@st.cache_resource
+def get_fan_out_cache():
+    return {"lock": threading.Lock(), "results": {}}
+
+# Function to run a read against every lab shard in parallel; returns {lab: result}. Shards are
+# downloaded and migrated once per process through prepare_database, and archived shards are read
+# through query_only connections. With a key, a shard is read again only when its change feed has
+# moved since the cached result.
+def fan_out_read(read_fn, key=None):
+    for shard in LAB_SHARDS.values():
+        prepare_database(shard["local_db_file"], shard["drive_file_id"])
+    available = {lab: shard for lab, shard in LAB_SHARDS.items() if os.path.exists(shard["local_db_file"])}
+
+    cache = get_fan_out_cache()
+    results = {}
+    versions = {}
+    if key is not None:
+        # Versions are read first, so a write landing mid-read is picked up on the next call
+        versions = {lab: get_change_version(shard["local_db_file"]) for lab, shard in available.items()}
+        with cache["lock"]:
+            for lab, shard in available.items():
+                cached = cache["results"].get((shard["local_db_file"], key))
+                if cached and cached[0] == versions[lab]:
+                    results[lab] = cached[1]
+
+    stale = {lab: shard for lab, shard in available.items() if lab not in results}
+    with ThreadPoolExecutor(max_workers=max(1, len(stale))) as executor:
+        futures = {lab: executor.submit(read_fn, shard["local_db_file"]) for lab, shard in stale.items()}
+    for lab, future in futures.items():
+        results[lab] = future.result()
+        if key is not None:
+            with cache["lock"]:
+                cache["results"][(stale[lab]["local_db_file"], key)] = (versions[lab], results[lab])
+    return {lab: results[lab] for lab in available}
+
+# Function to read the inventory of every lab into one frame with a Lab column; each shard's view
+# already refreshes incrementally from its change feed
+def get_inventory_across_labs():
+    frames = [frame.assign(Lab=lab) for lab, frame in fan_out_read(refresh_inventory_view).items()]
+    return pd.concat(frames, ignore_index=True)
+
+# Function to combine one spend summary dimension across every lab
+def get_spend_summary_across_labs(dimension):
+    summaries = fan_out_read(lambda db_file: get_spend_summary(dimension, db_file), key=("spend_summary", dimension))
+    combined = pd.concat(summaries.values(), ignore_index=True)
+    combined = combined.groupby("key", as_index=False)[["item_count", "quantity", "spend"]].sum()
+    return combined.sort_values(["spend", "item_count"], ascending=False, ignore_index=True)
+
+# Function to build an INSERT over the given columns that merges into the item with the same
+# normalized key per ADD_MERGE_RULES. RETURNING yields the written row's id, status and uid; the
+# merge is skipped when it would change nothing, in which case it yields no row.
+def item_upsert_sql(columns):
+    merged = {
+        field: ADD_MERGE_EXPRESSIONS[rule].format(field=field)
+        for field, rule in ADD_MERGE_RULES.items() if rule != "keep" and field in columns
+    }
+    if "status" in merged:
+        # Moving an item back to Requested starts a new order cycle
+        for field in ("order_date", "received_date"):
+            merged[field] = f"CASE WHEN {merged['status']} = 'Requested' AND inventory.status IS NOT 'Requested' THEN NULL ELSE inventory.{field} END"
+    on_conflict = f"ON CONFLICT ({ITEM_KEY}) DO NOTHING"
+    if merged:
+        on_conflict = f'''ON CONFLICT ({ITEM_KEY}) DO UPDATE SET
+            {', '.join(f"{field} = {expression}" for field, expression in merged.items())}
+        WHERE {' OR '.join(f"inventory.{field} IS NOT {expression}" for field, expression in merged.items())}'''
+    return f'''
+        INSERT INTO inventory ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})
+        {on_conflict}
+        RETURNING id, status, uid
+    '''
+
+# Function to add an item, or merge it into the existing item with the same catalog number and
+# vendor, in one transaction. Returns 'insert', 'update' or 'unchanged'.
 def add_inventory_item(requested_by, catalog_number, vendor, name, url, quantity, unit, notes, cost, status):
+    # A new row keeps the uid given here, a merged one keeps its own, so RETURNING tells them apart
+    item = {
+        "uid": os.urandom(16).hex(), "requested_by": requested_by, "catalog_number": catalog_number,
+        "vendor": vendor, "name": name, "url": url, "quantity": quantity, "unit": unit, "notes": notes,
+        "cost": cost, "status": status
+    }
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        INSERT INTO inventory (requested_by, catalog_number, vendor, name, url, quantity, unit, notes, cost, status)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (requested_by, catalog_number, vendor, name, url, quantity, unit, notes, cost, status))
-    conn.commit()
-    conn.close()
+    try:
+        # Log the status transition of a matching item before the merge overwrites it. This first
+        # write takes the lock, and a differing status guarantees the merge below updates the row.
+        if ADD_MERGE_RULES.get("status") == "replace":
+            cursor.execute(f'''
+                INSERT INTO status_events (item_id, from_status, to_status, changed_at, actor, quantity)
+                SELECT id, status, ?, ?, ?, ?
+                FROM inventory
+                WHERE ({ITEM_KEY}) = (lower(trim(?)), lower(trim(?))) AND status IS NOT ?
+            ''', (status, event_timestamp(), requested_by, quantity, catalog_number, vendor, status))
+        written = cursor.execute(item_upsert_sql(list(item)), list(item.values())).fetchone()
+        if written is None:
+            conn.rollback()
+            return "unchanged"
+        item_id, new_status, uid = written
+        inserted = uid == item["uid"]
+        if inserted:
+            record_status_event(cursor, item_id, None, new_status, requested_by)
+        conn.commit()
+    finally:
+        conn.close()
     upload_db()  # Upload the updated database after addition
+    return "insert" if inserted else "update"
 
 # Function to delete an item from the database
 def delete_inventory_item(catalog_number, vendor):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM inventory WHERE catalog_number = ? AND vendor = ?", (catalog_number, vendor))
+    cursor.execute(f"DELETE FROM inventory WHERE ({ITEM_KEY}) = (lower(trim(?)), lower(trim(?)))", (catalog_number, vendor))
     conn.commit()
     conn.close()
     upload_db()  # Upload the updated database after addition
@@ -189,26 +1920,96 @@ def delete_inventory_item(catalog_number, vendor):
 def get_item_by_catalog_and_vendor(catalog_number, vendor):
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute('''
-        SELECT * FROM inventory 
-        WHERE catalog_number = ? AND vendor = ?
+    cursor.execute(f'''
+        SELECT * FROM inventory
+        WHERE ({ITEM_KEY}) = (lower(trim(?)), lower(trim(?)))
     ''', (catalog_number, vendor))
     item = cursor.fetchone()
     conn.close()
     return item
 
-# Function to edit an existing item
-def edit_inventory_item(item_id, requested_by, catalog_number, vendor, name, url, quantity, unit, notes, cost, status):
+# Function to compare a stored field with an edited value; blanks, NaN and numeric types are
+# normalized so re-saving an unchanged form does not register as an edit
+def field_changed(stored, edited):
+    def normalize(value):
+        if value is None or (not isinstance(value, str) and pd.isna(value)) or value == "":
+            return None
+        if isinstance(value, numbers.Number):
+            return float(value)
+        return value
+    return normalize(stored) != normalize(edited)
+
+# Function to edit an existing item by id, writing only the fields that actually changed.
+# Returns the changed fields; when there are none nothing is written and nothing is synced.
+def edit_inventory_item(item_id, changes, actor=None):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        fields = list(dict.fromkeys([*changes, "order_date", "received_date"]))
+        current = cursor.execute(f"SELECT {', '.join(fields)} FROM inventory WHERE id = ?", (item_id,)).fetchone()
+        if current is None:
+            return {}
+        current = dict(zip(fields, current))
+        dirty = {field: value for field, value in changes.items() if field_changed(current[field], value)}
+
+        # Moving an item back to Requested starts a new order cycle; ordering and receiving it
+        # stamp the day they happened, as receive_items does, unless the caller sets the date
+        if dirty.get("status") == "Requested":
+            dirty.update({field: None for field in ("order_date", "received_date") if current[field] is not None})
+        elif dirty.get("status") in STATUS_DATE_FIELDS and STATUS_DATE_FIELDS[dirty["status"]] not in changes:
+            dirty[STATUS_DATE_FIELDS[dirty["status"]]] = datetime.now().strftime("%Y-%m-%d")
+        if not dirty:
+            return {}
+
+        cursor.execute(
+            f"UPDATE inventory SET {', '.join(f'{field} = ?' for field in dirty)} WHERE id = ?",
+            [*dirty.values(), item_id]
+        )
+        if "status" in dirty:
+            record_status_event(cursor, item_id, current["status"], dirty["status"], actor or changes.get("requested_by"))
+        conn.commit()
+    finally:
+        conn.close()
+    upload_db()  # Upload the updated database after the edit
+    return dirty
+
+# Function to attach a file to an item. The blob goes to the attachment store and only a reference
+# to it into the database; attaching the same file to an item twice changes nothing.
+def attach_file(item_id, file_name, raw_data, kind, added_by=None):
+    sha256 = store_attachment_blob(raw_data)
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute('''
-        UPDATE inventory 
-        SET requested_by = ?, catalog_number = ?, vendor = ?, name = ?, url = ?, quantity = ?, unit = ?, notes = ?, cost = ?, status = ?
-        WHERE id = ?
-    ''', (requested_by, catalog_number, vendor, name, url, quantity, unit, notes, cost, status, item_id))
+        INSERT OR IGNORE INTO attachments (item_id, sha256, kind, file_name, mime_type, size_bytes, added_by, added_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (item_id, sha256, kind, file_name, mimetypes.guess_type(file_name)[0], len(raw_data), added_by, event_timestamp()))
+    added = cursor.rowcount > 0
     conn.commit()
     conn.close()
-    upload_db()  # Upload the updated database after addition
+    if added:
+        get_attachment_state()["wake"].set()
+        upload_db()  # Upload the updated database after attaching
+    return added
+
+# Function to list an item's attachments, newest first
+def get_item_attachments(item_id):
+    conn = get_db_connection()
+    attachments = pd.read_sql_query('''
+        SELECT sha256, kind, file_name, mime_type, size_bytes, added_by, added_at
+        FROM attachments
+        WHERE item_id = ?
+        ORDER BY added_at DESC, id DESC
+    ''', conn, params=(item_id,))
+    conn.close()
+    return attachments
+
+# Function to remove an attachment from an item; the blob is collected once nothing references it
+def remove_attachment(item_id, sha256):
+    conn = get_db_connection()
+    conn.execute("DELETE FROM attachments WHERE item_id = ? AND sha256 = ?", (item_id, sha256))
+    conn.commit()
+    conn.close()
+    upload_db()  # Upload the updated database after removal
 
 # Function to detect file encoding
 def detect_encoding(uploaded_file):
@@ -218,153 +2019,812 @@ def detect_encoding(uploaded_file):
     uploaded_file.seek(0)
     return encoding
 
-# Function to import CSV data into the database
-def import_csv_to_db(uploaded_file):
-    try:
-        df = pd.read_csv(uploaded_file, encoding='ISO-8859-1')
+# Function to fill blank product details in one parsed file from history, the cache and vendor resolvers
+def fill_product_details(df):
+    blank = df[list(PRODUCT_FIELDS)].isna() | df[list(PRODUCT_FIELDS)].astype(str).apply(lambda column: column.str.strip() == "")
+    needs_lookup = blank.any(axis=1)
+    if needs_lookup.any():
+        products = resolve_products(zip(df.loc[needs_lookup, "vendor"], df.loc[needs_lookup, "catalog_number"]))
+        for field in PRODUCT_FIELDS:
+            looked_up = pd.Series([
+                (products.get(product_lookup_key(vendor, catalog_number)) or {}).get(field)
+                for vendor, catalog_number in zip(df["vendor"], df["catalog_number"])
+            ], index=df.index, dtype=object)
+            df[field] = df[field].astype(object).mask(blank[field] & looked_up.notna(), looked_up)
+    return df
+
+# Function to parse uploaded CSV/XLSX files in worker processes and merge them into one
+# deduplicated staging set; later files win when the same item appears more than once.
+# Returns the staged rows, the rows that failed validation, and per-file errors.
+def stage_import_files(uploaded_files, max_workers=IMPORT_WORKERS):
+    files = [(uploaded_file.name, uploaded_file.getvalue()) for uploaded_file in uploaded_files]
+    if len(files) == 1:
+        results = [parse_import_file(*files[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=min(len(files), max_workers)) as executor:
+            results = list(executor.map(parse_import_file, *zip(*files)))
+
+    errors = {file_name: error for file_name, _, _, error in results if error}
+    rejects = pd.concat([rejected for _, _, rejected, _ in results if rejected is not None] or [pd.DataFrame()], ignore_index=True)
+    frames = [fill_product_details(df) for _, df, _, _ in results if df is not None and not df.empty]
+    if not frames:
+        return None, rejects, errors
+
+    staged = pd.concat(frames, ignore_index=True)
+    staged = staged.drop_duplicates(subset=["catalog_number", "vendor"], keep="last").reset_index(drop=True)
+    return staged, rejects, errors
+
+# Function to report rows that failed validation, with a download of the rejects file
+def show_import_rejects(rejects):
+    if rejects is None or rejects.empty:
+        return
+    st.warning(f"{len(rejects)} row(s) were not imported because they failed validation.")
+    st.download_button(
+        "Download Rejected Rows",
+        rejects.to_csv(index=False).encode("utf-8"),
+        file_name="import_rejects.csv",
+        mime="text/csv",
+        on_click="ignore"
+    )
+
+# Function to bulk-load parsed rows into a temporary staging table; it copies the inventory
+# column types so comparisons against existing rows use the same affinities
+def load_import_staging(cursor, df):
+    columns = list(IMPORT_DEFAULTS)
+    cursor.execute("DROP TABLE IF EXISTS temp.import_staging")
+    cursor.execute(f"CREATE TEMP TABLE import_staging AS SELECT {', '.join(columns)} FROM inventory LIMIT 0")
+    staged = df[columns].astype(object)
+    staged = staged.where(staged.notna(), None)
+    cursor.executemany(
+        f"INSERT INTO import_staging ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        staged.itertuples(index=False, name=None)
+    )
+
+# Function to classify every staged row with set-based joins on the normalized key:
+# 'insert' (new item), 'update' (a non-blank field differs), 'unchanged', or 'skipped'
+# when append mode leaves existing items alone
+def plan_import(cursor, mode):
+    # The unary + drops the staging columns' TEXT affinity, which would otherwise keep
+    # SQLite from using idx_inventory_item_key and turn each lookup into a table scan
+    changed = " OR ".join(f"(s.{field} IS NOT NULL AND s.{field} IS NOT i.{field})" for field in IMPORT_UPDATE_FIELDS)
+    cursor.execute("DROP TABLE IF EXISTS temp.import_plan")
+    cursor.execute(f'''
+        CREATE TEMP TABLE import_plan AS
+        SELECT s.rowid AS staging_id, i.id AS item_id,
+               CASE WHEN i.id IS NULL THEN 'insert'
+                    WHEN ? = 'append' THEN 'skipped'
+                    WHEN {changed} THEN 'update'
+                    ELSE 'unchanged' END AS action
+        FROM import_staging s
+        LEFT JOIN inventory i ON i.id = (
+            SELECT MIN(id) FROM inventory
+            WHERE lower(trim(catalog_number)) = +s.catalog_number AND lower(trim(vendor)) = +s.vendor
+        )
+    ''', (mode,))
+    return dict(cursor.execute("SELECT action, COUNT(*) FROM import_plan GROUP BY action").fetchall())
+
+# Function to list the planned inserts and updates, with the fields each update changes
+def read_import_plan(cursor):
+    rows = cursor.execute(f'''
+        SELECT p.action, s.catalog_number, s.vendor, COALESCE(s.name, i.name),
+               {', '.join(f"s.{field}, i.{field}" for field in IMPORT_UPDATE_FIELDS)}
+        FROM import_plan p
+        JOIN import_staging s ON s.rowid = p.staging_id
+        LEFT JOIN inventory i ON i.id = p.item_id
+        WHERE p.action IN ('insert', 'update')
+        ORDER BY p.action, s.catalog_number, s.vendor
+    ''').fetchall()
+
+    preview = []
+    for action, catalog_number, vendor, name, *values in rows:
+        changes = []
+        if action == "update":
+            for field, new_value, old_value in zip(IMPORT_UPDATE_FIELDS, values[::2], values[1::2]):
+                if new_value is not None and new_value != old_value:
+                    changes.append(f"{field}: {old_value} \u2192 {new_value}")
+        preview.append((action.capitalize(), catalog_number, vendor, name, "; ".join(changes)))
+    return pd.DataFrame(preview, columns=["Action", "Catalog Number", "Vendor", "Name", "Changes"])
+
+# Function to apply the planned inserts and updates with one INSERT ... ON CONFLICT DO UPDATE on
+# the item key. Blank cells keep the existing value; new rows fall back to IMPORT_DEFAULTS.
+def apply_import_plan(cursor, actor="CSV import"):
+    timestamp = event_timestamp()
+
+    # Log status transitions on updated rows before they are overwritten
+    cursor.execute('''
+        INSERT INTO status_events (item_id, from_status, to_status, changed_at, actor, quantity)
+        SELECT i.id, i.status, s.status, ?, ?, COALESCE(s.quantity, i.quantity)
+        FROM import_plan p
+        JOIN import_staging s ON s.rowid = p.staging_id
+        JOIN inventory i ON i.id = p.item_id
+        WHERE p.action = 'update' AND s.status IS NOT NULL AND s.status IS NOT i.status
+    ''', (timestamp, actor))
+
+    last_id = cursor.execute("SELECT COALESCE(MAX(id), 0) FROM inventory").fetchone()[0]
+
+    # Rows conflict on the same normalized key the plan matched them by; new rows get their uid
+    # from the insert trigger, and updated rows keep theirs
+    columns = list(IMPORT_DEFAULTS)
+    values = [
+        f"COALESCE(i.{column}, s.{column})" if column not in IMPORT_UPDATE_FIELDS
+        else f"COALESCE(s.{column}, i.{column}, ?)"
+        for column in columns
+    ]
+    defaults = [IMPORT_DEFAULTS[column] for column in columns if column in IMPORT_UPDATE_FIELDS]
+    cursor.execute(f'''
+        INSERT INTO inventory ({', '.join(columns)})
+        SELECT {', '.join(values)}
+        FROM import_plan p
+        JOIN import_staging s ON s.rowid = p.staging_id
+        LEFT JOIN inventory i ON i.id = p.item_id
+        WHERE p.action IN ('insert', 'update')
+        ORDER BY p.staging_id
+        ON CONFLICT ({ITEM_KEY}) DO UPDATE SET
+            {', '.join(f"{field} = excluded.{field}" for field in IMPORT_UPDATE_FIELDS)}
+    ''', defaults)
 
-        # Standardizing column names
-        df.columns = df.columns.str.strip().str.replace(" ", "_").str.lower()
+    cursor.execute('''
+        INSERT INTO status_events (item_id, from_status, to_status, changed_at, actor, quantity)
+        SELECT id, NULL, status, ?, ?, quantity
+        FROM inventory
+        WHERE id > ?
+    ''', (timestamp, actor, last_id))
 
-        conn = get_db_connection()
-        cursor = conn.cursor()
+# Function to stage parsed rows and either preview the import (dry run) or apply it in one transaction.
+# mode is 'append' (only add new items) or 'upsert' (also update existing items that changed).
+def run_import(df, mode="append", dry_run=False):
+    conn = get_db_connection()
+    cursor = conn.cursor()
 
-        required_columns = {"catalog_number", "vendor", "name"}
-        if not required_columns.issubset(set(df.columns)):
-            st.error(f"Missing required columns: {required_columns - set(df.columns)}")
-            return
+    # The write lock is taken before planning, so no other writer can change the rows the plan
+    # was built from before it is applied
+    try:
+        if not dry_run:
+            cursor.execute("BEGIN IMMEDIATE")
+        load_import_staging(cursor, df)
+        counts = plan_import(cursor, mode)
+        preview = read_import_plan(cursor) if dry_run else None
+        if not dry_run and (counts.get("insert") or counts.get("update")):
+            apply_import_plan(cursor)
+        conn.commit()
+    finally:
+        conn.close()
+    return counts, preview
 
-        # Normalize data for comparison
-        df["catalog_number"] = df["catalog_number"].astype(str).str.strip().str.lower()
-        df["vendor"] = df["vendor"].astype(str).str.strip().str.lower()
+# Function to apply a staged import, sync once, and report the outcome
+def commit_import(df, mode, file_count):
+    counts, _ = run_import(df, mode)
+    if counts.get("insert") or counts.get("update"):
+        upload_db()  # Upload the updated database once for the whole batch
 
-        # Retrieve existing items from database
-        existing_items = pd.read_sql_query('SELECT catalog_number, vendor FROM inventory', conn)
-        existing_items["catalog_number"] = existing_items["catalog_number"].astype(str).str.strip().str.lower()
-        existing_items["vendor"] = existing_items["vendor"].astype(str).str.strip().str.lower()
+    if mode == "upsert":
+        st.success(f"Imported {file_count} file(s): {counts.get('insert', 0)} new, {counts.get('update', 0)} updated, {counts.get('unchanged', 0)} unchanged.")
+    else:
+        st.success(f"Imported {file_count} file(s): {counts.get('insert', 0)} new records, {counts.get('skipped', 0)} duplicates skipped.")
 
-        df.reset_index(drop=True, inplace=True)
-        existing_items.reset_index(drop=True, inplace=True)
+# Function to import CSV/XLSX data into the database in one transaction with one sync
+def import_files_to_db(uploaded_files, mode="append"):
+    try:
+        df, rejects, errors = stage_import_files(uploaded_files)
+        st.session_state['import_rejects'] = rejects
+        for file_name, error in errors.items():
+            st.error(f"{file_name}: {error}")
+        if df is None:
+            show_import_rejects(rejects)
+            return
 
-        new_entries_count = 0
-        skipped_entries_count = 0
+        commit_import(df, mode, len(uploaded_files))
+        st.rerun()
 
-        for _, row in df.iterrows():
-            catalog_number = row["catalog_number"].strip().lower()
-            vendor = row["vendor"].strip().lower()
+    except Exception as e:
+        st.error(f"Error importing files: {e}")
 
-            is_duplicate = (
-                (existing_items["catalog_number"] == catalog_number) &
-                (existing_items["vendor"] == vendor)
-            ).any()
+# Function to import a single CSV file into the database
+def import_csv_to_db(uploaded_file):
+    import_files_to_db([uploaded_file])
+
+# Function to canonicalize a catalog number: case, punctuation and spacing are ignored
+def canonical_catalog_number(catalog_number):
+    return re.sub(r"[^0-9a-z]", "", str(catalog_number or "").lower())
+
+# Function to canonicalize a vendor name: drop punctuation and company suffixes, then apply aliases
+def canonical_vendor(vendor):
+    words = re.findall(r"[0-9a-z]+", str(vendor or "").lower())
+    while len(words) > 1 and words[-1] in VENDOR_SUFFIXES:
+        words.pop()
+    key = "".join(words)
+    return VENDOR_ALIASES.get(key, key)
+
+# Function to score how likely two canonicalized records are the same product (0 to 1)
+def near_duplicate_score(catalog_a, vendor_a, catalog_b, vendor_b):
+    catalog_score = 1.0 if catalog_a == catalog_b else SequenceMatcher(None, catalog_a, catalog_b).ratio()
+    vendor_score = 1.0 if vendor_a == vendor_b else SequenceMatcher(None, vendor_a, vendor_b).ratio()
+    return catalog_score, 0.7 * catalog_score + 0.3 * vendor_score
+
+# Function to find candidate near-duplicate pairs without comparing every pair of rows.
+# Candidates come from blocking (rows sharing a canonical catalog number) plus a sorted
+# neighborhood pass over the catalog key and its reverse, so typos at either end are caught.
+def find_near_duplicate_candidates(window=NEAR_DUPLICATE_WINDOW, threshold=NEAR_DUPLICATE_THRESHOLD):
+    conn = get_db_connection()
+    rows = conn.execute("SELECT id, catalog_number, vendor, name FROM inventory").fetchall()
+    conn.close()
 
-            if is_duplicate:
-                skipped_entries_count += 1
-                continue
+    records = [
+        (row[0], canonical_catalog_number(row[1]), canonical_vendor(row[2]), row)
+        for row in rows
+    ]
+    records = [record for record in records if record[1]]
+
+    candidate_pairs = set()
+
+    blocks = {}
+    for record in records:
+        blocks.setdefault(record[1], []).append(record)
+    for block in blocks.values():
+        for i, first in enumerate(block):
+            for second in block[i + 1:]:
+                candidate_pairs.add((first, second))
+
+    for sort_key in (lambda r: (r[1], r[2]), lambda r: (r[1][::-1], r[2])):
+        ordered = sorted(records, key=sort_key)
+        for i, first in enumerate(ordered):
+            for second in ordered[i + 1:i + window]:
+                candidate_pairs.add((first, second) if first[0] < second[0] else (second, first))
+
+    candidates = []
+    for first, second in candidate_pairs:
+        if first[0] == second[0]:
+            continue
+        catalog_score, score = near_duplicate_score(first[1], first[2], second[1], second[2])
+        if catalog_score < NEAR_DUPLICATE_MIN_CATALOG_SCORE or score < threshold:
+            continue
+        candidates.append({
+            "Merge": False,
+            "Score": round(score, 3),
+            "ID A": first[0], "Catalog Number A": first[3][1], "Vendor A": first[3][2], "Name A": first[3][3],
+            "ID B": second[0], "Catalog Number B": second[3][1], "Vendor B": second[3][2], "Name B": second[3][3],
+        })
+
+    candidates_df = pd.DataFrame(candidates, columns=[
+        "Merge", "Score", "ID A", "Catalog Number A", "Vendor A", "Name A",
+        "ID B", "Catalog Number B", "Vendor B", "Name B"
+    ])
+    return candidates_df.sort_values("Score", ascending=False, ignore_index=True)
+
+# Function to group confirmed pairs into connected sets of item ids (union-find)
+def group_confirmed_pairs(pairs):
+    parent = {}
+
+    def find(item_id):
+        parent.setdefault(item_id, item_id)
+        while parent[item_id] != item_id:
+            parent[item_id] = parent[parent[item_id]]
+            item_id = parent[item_id]
+        return item_id
+
+    for first, second in pairs:
+        parent[find(first)] = find(second)
+
+    groups = {}
+    for item_id in list(parent):
+        groups.setdefault(find(item_id), []).append(item_id)
+    return [sorted(group) for group in groups.values() if len(group) > 1]
+
+# Function to merge reviewed near-duplicate groups using the same rules as item key collisions
+def merge_near_duplicate_groups(groups):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    for group in groups:
+        placeholders = ", ".join("?" for _ in group)
+        cursor.execute(f'''
+            SELECT * FROM inventory
+            WHERE id IN ({placeholders})
+            ORDER BY order_date DESC, received_date DESC, id
+        ''', group)
+        merge_inventory_rows(cursor, cursor.fetchall())
+    conn.commit()
+    conn.close()
+    upload_db()  # Upload the updated database after merging
 
-            cursor.execute('''
-                INSERT INTO inventory (requested_by, catalog_number, vendor, name, url, quantity, unit, notes, cost, status, order_date, received_date)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                row.get("requested_by", "Unknown"),
-                catalog_number,
-                vendor,
-                row.get("name", "Unknown Item"),
-                row.get("url", ""),
-                row.get("quantity", 1),
-                row.get("unit", ""),
-                row.get("notes", ""),
-                row.get("cost", 0.0),
-                row.get("status", "Requested"),
-                row.get("order_date", None),
-                row.get("received_date", None)
-            ))
-
-            new_entries_count += 1
 
-        conn.commit()
-        conn.close()
+# Function to compute order-to-receipt lead times for items received in a date range
+def get_lead_times(start_date, end_date):
+    conn = get_db_connection()
+    lead_times = pd.read_sql_query('''
+        SELECT r.item_id, i.catalog_number, i.vendor, i.name,
+               o.changed_at AS ordered_at, r.changed_at AS received_at,
+               julianday(r.changed_at) - julianday(o.changed_at) AS lead_days
+        FROM status_events r
+        JOIN status_events o ON o.id = (
+            SELECT id FROM status_events
+            WHERE item_id = r.item_id AND to_status = 'Ordered' AND changed_at <= r.changed_at
+            ORDER BY changed_at DESC, id DESC
+            LIMIT 1
+        )
+        LEFT JOIN inventory i ON i.id = r.item_id
+        WHERE r.to_status = 'Received' AND r.changed_at >= ? AND r.changed_at < ?
+        ORDER BY r.changed_at
+    ''', conn, params=(start_date, end_date))
+    conn.close()
+    return lead_times
 
-        st.success(f"CSV imported: {new_entries_count} new records, {skipped_entries_count} duplicates skipped.")
-        st.rerun()
+# Function to list items currently on order with how long they have been waiting. Items ordered
+# without a recorded event (before events were kept, or synced in that way) count from order_date.
+def get_open_order_age():
+    conn = get_db_connection()
+    open_orders = pd.read_sql_query('''
+        SELECT i.id AS item_id, i.catalog_number, i.vendor, i.name, i.requested_by,
+               COALESCE(MAX(e.changed_at), i.order_date) AS ordered_at,
+               julianday('now', 'localtime') - julianday(COALESCE(MAX(e.changed_at), i.order_date)) AS age_days
+        FROM inventory i
+        LEFT JOIN status_events e ON e.item_id = i.id AND e.to_status = 'Ordered'
+        WHERE i.status = 'Ordered'
+        GROUP BY i.id
+        ORDER BY age_days DESC
+    ''', conn)
+    conn.close()
+    return open_orders
 
-    except Exception as e:
-        st.error(f"Error importing CSV: {e}")
+# Function to count status transitions per week in a date range
+def get_weekly_throughput(start_date, end_date):
+    conn = get_db_connection()
+    throughput = pd.read_sql_query('''
+        SELECT strftime('%Y-W%W', changed_at) AS week, to_status, COUNT(*) AS events
+        FROM status_events
+        WHERE changed_at >= ? AND changed_at < ?
+        GROUP BY week, to_status
+        ORDER BY week
+    ''', conn, params=(start_date, end_date))
+    conn.close()
+    return throughput.pivot_table(index="week", columns="to_status", values="events", aggfunc="sum", fill_value=0)
+
+# Function to forecast consumption for every (vendor, catalog_number) from its receipt history.
+# Units received before the latest receipt were used up between the first and latest receipt,
+# which gives a daily rate; the latest receipt runs out after its quantity / rate days. Each
+# receipt counts the quantity recorded on its event; events from before that was recorded fall
+# back to the item's quantity. Cached until the change feed moves.
+@st.cache_data(max_entries=8, show_spinner=False)
+def forecast_consumption(db_file, change_version):
+    conn = get_db_connection(db_file)
+    events = pd.read_sql_query('''
+        SELECT e.item_id, e.to_status, e.changed_at,
+               lower(trim(i.vendor)) AS vendor_key, lower(trim(i.catalog_number)) AS catalog_key,
+               COALESCE(e.quantity, i.quantity, 1) AS quantity
+        FROM status_events e
+        JOIN inventory i ON i.id = e.item_id
+        WHERE e.to_status IN ('Ordered', 'Received')
+        UNION ALL
+        -- Rows received before status events existed only have their received_date. The index is
+        -- named because mostly-NULL statistics make the planner prefer a full table scan.
+        SELECT i.id, 'Received', i.received_date,
+               lower(trim(i.vendor)), lower(trim(i.catalog_number)), COALESCE(i.quantity, 1)
+        FROM inventory i INDEXED BY idx_inventory_received_date
+        WHERE i.received_date IS NOT NULL
+          AND NOT EXISTS (SELECT 1 FROM status_events e WHERE e.item_id = i.id AND e.to_status = 'Received')
+    ''', conn)
+    items = pd.read_sql_query('''
+        SELECT id, name, catalog_number, vendor, status,
+               lower(trim(vendor)) AS vendor_key, lower(trim(catalog_number)) AS catalog_key
+        FROM inventory
+        ORDER BY id
+    ''', conn)
+    conn.close()
 
-# Function to handle duplicates by merging them
-def purge_and_merge_duplicates():
+    keys = ["vendor_key", "catalog_key"]
+    events["changed_at"] = pd.to_datetime(events["changed_at"], errors="coerce")
+    events = events.dropna(subset=["changed_at"]).sort_values("changed_at")
+    receipts = events[events["to_status"] == "Received"]
+    orders = events[events["to_status"] == "Ordered"]
+
+    # Per-vendor median lead time: each receipt paired with the latest earlier order of the same item
+    lead_pairs = pd.merge_asof(
+        receipts[["item_id", "vendor_key", "changed_at"]],
+        orders[["item_id", "changed_at"]].rename(columns={"changed_at": "ordered_at"}),
+        left_on="changed_at", right_on="ordered_at", by="item_id", direction="backward"
+    ).dropna(subset=["ordered_at"])
+    vendor_lead_days = ((lead_pairs["changed_at"] - lead_pairs["ordered_at"]).dt.total_seconds() / 86400).groupby(lead_pairs["vendor_key"]).median()
+
+    history = receipts.groupby(keys).agg(
+        receipts=("changed_at", "size"),
+        first_received=("changed_at", "first"),
+        last_received=("changed_at", "last"),
+        total_quantity=("quantity", "sum"),
+        last_quantity=("quantity", "last"),
+    )
+    span_days = (history["last_received"] - history["first_received"]).dt.total_seconds() / 86400
+    history["daily_rate"] = (history["total_quantity"] - history["last_quantity"]) / span_days
+    history = history[
+        (history["receipts"] >= FORECAST_MIN_RECEIPTS) & (span_days >= FORECAST_MIN_SPAN_DAYS) & (history["daily_rate"] > 0)
+    ].copy()
+
+    history["depletes_on"] = history["last_received"] + pd.to_timedelta(history["last_quantity"] / history["daily_rate"], unit="D")
+    lead_days = vendor_lead_days.reindex(history.index.get_level_values("vendor_key")).fillna(FORECAST_DEFAULT_LEAD_DAYS)
+    history["reorder_by"] = history["depletes_on"] - pd.to_timedelta(lead_days.to_numpy(), unit="D")
+
+    # Show the newest row of each product, and skip products that already have an open request or order
+    latest = items.groupby(keys).tail(1).set_index(keys)[["id", "name", "catalog_number", "vendor"]]
+    open_keys = items[items["status"].isin(["Requested", "Ordered"])].set_index(keys).index
+    forecast = history.join(latest, how="inner")
+    forecast["on_order"] = forecast.index.isin(open_keys)
+    return forecast.reset_index().sort_values("reorder_by")
+
+# Function to list products expected to need reordering within the horizon, for bulk requests
+def get_reorder_suggestions(horizon_days=FORECAST_HORIZON_DAYS):
+    forecast = forecast_consumption(LOCAL_DB_FILE, get_change_version())
+    due = forecast[~forecast["on_order"] & (forecast["reorder_by"] <= pd.Timestamp.now() + pd.Timedelta(days=horizon_days))]
+    return pd.DataFrame({
+        "Reorder": False,
+        "ID": due["id"],
+        "Name": due["name"],
+        "Catalog Number": due["catalog_number"],
+        "Vendor": due["vendor"],
+        "Units/Day": due["daily_rate"].round(2),
+        "Depletes On": due["depletes_on"].dt.date,
+        "Reorder By": due["reorder_by"].dt.date,
+    })
+
+# Function to set several items back to Requested in one transaction, with one sync
+def request_reorders(item_ids, actor="Reorder forecast"):
+    item_ids = [int(item_id) for item_id in item_ids]
+    placeholders = ", ".join("?" * len(item_ids))
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # Identify duplicates based on catalog number and vendor
-    query = '''
-        SELECT catalog_number, vendor, COUNT(*) as count
+    cursor.execute(f'''
+        INSERT INTO status_events (item_id, from_status, to_status, changed_at, actor, quantity)
+        SELECT id, status, 'Requested', ?, ?, quantity
         FROM inventory
-        GROUP BY catalog_number, vendor
-        HAVING COUNT(*) > 1
-    '''
-    duplicates = cursor.execute(query).fetchall()
-
-    if not duplicates:
-        st.success("No duplicates found in the database.")
-        conn.close()
-        return
-
-    for catalog_number, vendor, count in duplicates:
-        # Fetch all duplicate rows
-        cursor.execute('''
-            SELECT * FROM inventory 
-            WHERE catalog_number = ? AND vendor = ?
-            ORDER BY order_date DESC, received_date DESC
-        ''', (catalog_number, vendor))
-        
-        duplicate_rows = cursor.fetchall()
-
-        if duplicate_rows:
-            # Merge duplicate records
-            total_quantity = sum(row[6] for row in duplicate_rows)  # Summing quantity
-            combined_notes = " | ".join(filter(None, {row[8] for row in duplicate_rows}))  # Combine notes
-            latest_order_date = max(filter(None, [row[10] for row in duplicate_rows])) if any(row[10] for row in duplicate_rows) else None
-            latest_received_date = max(filter(None, [row[11] for row in duplicate_rows])) if any(row[11] for row in duplicate_rows) else None
-
-            # Keep the first row and update it with merged values
-            first_row = duplicate_rows[0]
-            cursor.execute('''
-                UPDATE inventory 
-                SET quantity = ?, notes = ?, order_date = ?, received_date = ?
-                WHERE id = ?
-            ''', (total_quantity, combined_notes, latest_order_date, latest_received_date, first_row[0]))
+        WHERE id IN ({placeholders}) AND status != 'Requested'
+    ''', [event_timestamp(), actor] + item_ids)
 
-            # Remove other duplicate rows
-            for row in duplicate_rows[1:]:
-                cursor.execute('DELETE FROM inventory WHERE id = ?', (row[0],))
+    # Same reset as a single reorder: a new request has no order or received date yet
+    cursor.execute(f'''
+        UPDATE inventory
+        SET status = 'Requested', order_date = NULL, received_date = NULL
+        WHERE id IN ({placeholders})
+    ''', item_ids)
 
     conn.commit()
     conn.close()
-    st.success(f"Duplicates purged and merged successfully.")
-    upload_db()  # Upload the updated database after addition
-
+    upload_db()  # Upload the updated database once for the whole batch
+
+# Function to parse a pasted or scanned packing list. Each line is a catalog number, optionally
+# followed by a vendor and/or a quantity, separated by tabs, commas or semicolons. Repeated lines
+# (one scan per unit) add up; a single line without a quantity receives the ordered quantity.
+def parse_receipt_lines(text):
+    lines = []
+    for line in text.splitlines():
+        fields = [field.strip() for field in re.split(r"[\t,;]", line) if field.strip()]
+        if not fields:
+            continue
+        quantity = int(fields.pop()) if len(fields) > 1 and fields[-1].isdigit() else None
+        lines.append((fields[0], fields[1] if len(fields) > 1 else None, quantity))
+
+    receipt = pd.DataFrame(lines, columns=["catalog_number", "vendor", "quantity"])
+    receipt["catalog_key"] = receipt["catalog_number"].str.lower()
+    receipt["vendor_key"] = receipt["vendor"].str.lower()
+    receipt["counted"] = receipt["quantity"].fillna(1)
+    receipt = receipt.groupby(["catalog_key", "vendor_key"], dropna=False, sort=False).agg(
+        catalog_number=("catalog_number", "first"),
+        vendor=("vendor", "first"),
+        given=("quantity", "count"),
+        scans=("counted", "size"),
+        quantity=("counted", "sum"),
+    ).reset_index()
+    receipt["quantity"] = receipt["quantity"].where((receipt["given"] > 0) | (receipt["scans"] > 1)).astype("Int64")
+    return receipt.drop(columns=["given", "scans"])
+
+# Function to resolve a parsed receipt against the inventory in one indexed query. Each line gets
+# the open order it receives, preferring Ordered over Requested items, or is reported as
+# ambiguous, already received or not found.
+def resolve_receipt(receipt):
+    lines = [
+        [catalog_key, None if pd.isna(vendor_key) else vendor_key]
+        for catalog_key, vendor_key in zip(receipt["catalog_key"], receipt["vendor_key"])
+    ]
+    conn = get_db_connection()
+    candidates = pd.read_sql_query('''
+        WITH receipt_lines AS (
+            SELECT key AS line, json_extract(value, '$[0]') AS catalog_key, json_extract(value, '$[1]') AS vendor_key
+            FROM json_each(?)
+        )
+        SELECT r.line, i.id, i.name, i.vendor, i.status, i.vendor || ' #' || i.id || ' (' || i.status || ')' AS label
+        FROM receipt_lines r
+        JOIN inventory i
+          ON lower(trim(i.catalog_number)) = +r.catalog_key
+         AND (r.vendor_key IS NULL OR lower(trim(i.vendor)) = +r.vendor_key)
+        ORDER BY r.line, i.id
+    ''', conn, params=(json.dumps(lines),))
+    conn.close()
 
-# Function to update item status
-def update_inventory_item(catalog_number, vendor, new_name, new_status, new_quantity, new_requested_by, new_notes):
+    candidates["open"] = candidates["status"] != "Received"
+    candidates["ordered"] = candidates["status"] == "Ordered"
+    counts = candidates.groupby("line").agg(matches=("id", "size"), open_count=("open", "sum"), ordered_count=("ordered", "sum"))
+    candidates = candidates.join(counts, on="line")
+
+    # A line receives its only Ordered item, or else its only open item
+    single_ordered = candidates["ordered"] & (candidates["ordered_count"] == 1)
+    single_open = candidates["open"] & (candidates["open_count"] == 1) & (candidates["ordered_count"] != 1)
+    chosen = candidates[single_ordered | single_open].set_index("line")[["id", "name", "vendor"]]
+    ambiguous = candidates[candidates["open"] & (candidates["open_count"] > 1) & (candidates["ordered_count"] != 1)]
+
+    resolution = receipt.join(counts).join(chosen, rsuffix="_matched").join(ambiguous.groupby("line")["label"].agg(", ".join))
+    resolution["Result"] = "Not found"
+    resolution.loc[resolution["matches"] > 0, "Result"] = "Already received"
+    resolution.loc[resolution["label"].notna(), "Result"] = "Ambiguous"
+    resolution.loc[resolution["id"].notna(), "Result"] = "Matched"
+    resolution = pd.DataFrame({
+        "Result": resolution["Result"],
+        "Catalog Number": resolution["catalog_number"],
+        "Vendor": resolution["vendor_matched"].fillna(resolution["vendor"]),
+        "Quantity": resolution["quantity"],
+        "ID": resolution["id"].astype("Int64"),
+        "Name": resolution["name"],
+        "Candidates": resolution["label"].fillna(""),
+    })
+    return resolution
+
+# Function to receive several items in one transaction, with one sync. A quantity replaces the
+# ordered quantity with what actually arrived; None keeps it.
+def receive_items(received, actor="Receiving"):
+    payload = json.dumps([[int(item_id), None if pd.isna(quantity) else int(quantity)] for item_id, quantity in received])
+    receipt = '''
+        WITH receipt AS (
+            SELECT json_extract(value, '$[0]') AS id, json_extract(value, '$[1]') AS quantity
+            FROM json_each(?)
+        )
+    '''
     conn = get_db_connection()
     cursor = conn.cursor()
 
-    # Reset order and received dates when status is set to Requested
-    order_date = None if new_status == "Requested" else None
-    received_date = None
+    cursor.execute(receipt + '''
+        INSERT INTO status_events (item_id, from_status, to_status, changed_at, actor, quantity)
+        SELECT id, status, 'Received', ?, ?, COALESCE((SELECT quantity FROM receipt WHERE receipt.id = inventory.id), quantity)
+        FROM inventory
+        WHERE id IN (SELECT id FROM receipt) AND status != 'Received'
+    ''', (payload, event_timestamp(), actor))
 
-    cursor.execute('''
-        UPDATE inventory 
-        SET name = ?, status = ?, quantity = ?, requested_by = ?, notes = ?, 
-            order_date = ?, 
-            received_date = ?
-        WHERE catalog_number = ? AND vendor = ?
-    ''', (new_name, new_status, new_quantity, new_requested_by, new_notes, order_date, received_date, catalog_number, vendor))
+    cursor.execute(receipt + '''
+        UPDATE inventory
+        SET status = 'Received',
+            received_date = ?,
+            quantity = COALESCE((SELECT quantity FROM receipt WHERE receipt.id = inventory.id), quantity)
+        WHERE id IN (SELECT id FROM receipt)
+    ''', (payload, datetime.now().strftime("%Y-%m-%d")))
 
     conn.commit()
     conn.close()
-    upload_db()  # Upload the updated database after addition
+    upload_db()  # Upload the updated database once for the whole delivery
+
+# Function to register a product metadata resolver for a vendor
+def register_product_resolver(vendor, resolver):
+    PRODUCT_RESOLVERS[canonical_vendor(vendor)] = resolver
+
+# Function to build the normalized cache key for a product
+def product_lookup_key(vendor, catalog_number):
+    return canonical_vendor(vendor), canonical_catalog_number(catalog_number)
+
+# Function to open the on-disk product cache
+def get_product_cache_connection():
+    conn = sqlite3.connect(PRODUCT_CACHE_FILE, check_same_thread=False)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS product_cache (
+            vendor_key TEXT NOT NULL,
+            catalog_key TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (vendor_key, catalog_key)
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_product_cache_last_used ON product_cache (last_used)")
+    return conn
+
+# Function to hold the in-process LRU layer, shared across reruns and sessions
+@st.cache_resource
+def get_product_memory_cache():
+    return {"entries": OrderedDict(), "lock": threading.Lock()}
+
+# Function to read a cached product, memory first and then disk; expired entries count as misses
+def read_product_cache(key, memory_cache):
+    now = time.time()
+    with memory_cache["lock"]:
+        entry = memory_cache["entries"].get(key)
+        if entry and now - entry[0] < PRODUCT_CACHE_TTL_SECONDS:
+            memory_cache["entries"].move_to_end(key)
+            return entry[1]
+
+    conn = get_product_cache_connection()
+    row = conn.execute(
+        "SELECT payload, fetched_at FROM product_cache WHERE vendor_key = ? AND catalog_key = ?", key
+    ).fetchone()
+    if row and now - row[1] < PRODUCT_CACHE_TTL_SECONDS:
+        conn.execute(
+            "UPDATE product_cache SET last_used = ? WHERE vendor_key = ? AND catalog_key = ?", (now, *key)
+        )
+        conn.commit()
+        conn.close()
+        product = json.loads(row[0])
+        remember_product(key, product, row[1], memory_cache)
+        return product
+    conn.close()
+    return None
+
+# Function to put a product into the in-process LRU
+def remember_product(key, product, fetched_at, memory_cache):
+    with memory_cache["lock"]:
+        memory_cache["entries"][key] = (fetched_at, product)
+        memory_cache["entries"].move_to_end(key)
+        while len(memory_cache["entries"]) > PRODUCT_MEMORY_CACHE_SIZE:
+            memory_cache["entries"].popitem(last=False)
+
+# Function to store resolved products on disk and evict the least recently used overflow
+def write_product_cache(products, memory_cache):
+    if not products:
+        return
+    now = time.time()
+    conn = get_product_cache_connection()
+    conn.executemany('''
+        INSERT INTO product_cache (vendor_key, catalog_key, payload, fetched_at, last_used)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(vendor_key, catalog_key) DO UPDATE SET
+            payload = excluded.payload, fetched_at = excluded.fetched_at, last_used = excluded.last_used
+    ''', [(*key, json.dumps(product), now, now) for key, product in products.items()])
+    conn.execute('''
+        DELETE FROM product_cache WHERE rowid IN (
+            SELECT rowid FROM product_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?
+        )
+    ''', (PRODUCT_CACHE_MAX_ENTRIES,))
+    conn.commit()
+    conn.close()
+    for key, product in products.items():
+        remember_product(key, product, now, memory_cache)
+
+# Function to find the most recent matching products in our own order history. Canonical keys
+# ignore punctuation, which no index can serve, so lookups scan the shared inventory view, which
+# is kept current from the change feed, and the keys are computed column-wise.
+def lookup_products_in_history(keys):
+    keys = set(keys)
+    if not keys:
+        return {}
+    history = load_current_inventory().sort_index(ascending=False)[["Vendor", "Catalog Number", "Name", "URL", "Unit", "Cost"]]
+    history = history.rename(columns={"Catalog Number": "catalog_number"}).rename(columns=str.lower)
+
+    history["catalog_key"] = history["catalog_number"].fillna("").astype(str).str.lower().str.replace(r"[^0-9a-z]", "", regex=True)
+    history = history[history["catalog_key"].isin({catalog_key for _, catalog_key in keys})]
+    history["vendor_key"] = history["vendor"].map(canonical_vendor)
+    history = history.drop_duplicates(["vendor_key", "catalog_key"])  # Newest first, so the latest order wins
+    history = history.astype(object).where(history.notna(), None)
+
+    products = {}
+    for vendor_key, catalog_key, name, url, unit, cost in history[["vendor_key", "catalog_key", "name", "url", "unit", "cost"]].itertuples(index=False):
+        if (vendor_key, catalog_key) in keys:
+            products[(vendor_key, catalog_key)] = {"name": name, "url": url, "unit": unit, "cost": cost, "source": "history"}
+    return products
+
+# Function to resolve a product through its vendor's resolver, if one is registered
+def resolve_product_from_vendor(key, catalog_number):
+    resolver = PRODUCT_RESOLVERS.get(key[0])
+    if resolver is None:
+        return None
+    try:
+        product = resolver(catalog_number)
+    except Exception:
+        return None  # A failing vendor resolver should never block adding an item
+    if not product:
+        return None
+    return {**{field: product.get(field) for field in PRODUCT_FIELDS}, "source": key[0]}
+
+# Function to resolve many products at once. Our own history is always read live; only what it
+# lacks goes to the product cache, and cache misses are resolved by the vendors concurrently.
+def resolve_products(vendor_catalog_pairs, max_workers=PRODUCT_LOOKUP_WORKERS):
+    requested = {}
+    for vendor, catalog_number in vendor_catalog_pairs:
+        key = product_lookup_key(vendor, catalog_number)
+        if key[1]:
+            requested.setdefault(key, catalog_number)
+    results = lookup_products_in_history(requested)
+
+    memory_cache = get_product_memory_cache()
+    misses = {}
+    for key, catalog_number in requested.items():
+        if key in results:
+            continue
+        cached = read_product_cache(key, memory_cache)
+        # Entries from history were cached by older versions; they may be stale, so they count as misses
+        if cached is not None and cached.get("source") != "history":
+            results[key] = cached
+        else:
+            misses[key] = catalog_number
+
+    if misses:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            resolved = dict(zip(misses, executor.map(lambda item: resolve_product_from_vendor(*item), misses.items())))
+        found = {key: product for key, product in resolved.items() if product}
+        write_product_cache(found, memory_cache)
+        results.update(found)
+
+    return results
+
+# Function to resolve a single product
+def resolve_product(vendor, catalog_number):
+    return resolve_products([(vendor, catalog_number)]).get(product_lookup_key(vendor, catalog_number))
+
+# Function to prefill the add form from a product lookup (sidebar callback)
+def prefill_from_lookup():
+    catalog_number = st.session_state.get('lookup_catalog_number', '').strip()
+    vendor = st.session_state.get('lookup_vendor', '').strip()
+    if not catalog_number or not vendor:
+        return
+
+    st.session_state['catalog_number'] = catalog_number
+    st.session_state['vendor'] = vendor
+    product = resolve_product(vendor, catalog_number)
+    if product:
+        st.session_state['name'] = product.get("name") or ""
+        st.session_state['url'] = product.get("url") or ""
+        st.session_state['unit'] = product.get("unit") or ""
+        st.session_state['cost'] = float(product.get("cost") or 0.0)
+    st.session_state['lookup_result'] = product
+
+# Function to change an item's status from the search results (button callback)
+def change_item_status(item_id, row, new_status):
+    edit_inventory_item(item_id, {"status": new_status}, actor=st.session_state.get("requested_by"))
+    st.session_state['search_notice'] = f"Item '{row['Name']}' marked as {new_status}."
+    st.rerun(INVENTORY_FRAGMENTS)
+
+# Function to reorder an item from the search results and load it into the sidebar form (button callback)
+def reorder_item(item_id, row):
+    existing_item = get_item_by_catalog_and_vendor(row["Catalog Number"], row["Vendor"])
+
+    if existing_item:
+        # Update the item directly in the database
+        edit_inventory_item(
+            item_id,
+            {"status": "Requested", "quantity": st.session_state['quantity']},  # Use the quantity from session state
+            actor=st.session_state.get("requested_by")
+        )
+
+        # Populate session state to update the sidebar with current values
+        st.session_state['catalog_number'] = row["Catalog Number"]
+        st.session_state['vendor'] = row["Vendor"]
+        st.session_state['name'] = row["Name"]
+        st.session_state['url'] = row["URL"]
+        st.session_state['quantity'] = int(row["Quantity"]) if pd.notnull(row["Quantity"]) else 1
+        st.session_state['unit'] = row["Unit"]
+        st.session_state['notes'] = row["Notes"]
+        st.session_state['cost'] = float(row["Cost"]) if pd.notnull(row["Cost"]) else 0.0
+        st.session_state['status'] = 'Requested'
+        st.session_state['requested_by'] = row["Requested By"]
+
+        st.session_state['search_notice'] = f"Reordered item: {row['Name']} (Catalog: {row['Catalog Number']})"
+    else:
+        st.session_state['search_notice'] = f"Item not found in inventory: {row['Name']} (Catalog: {row['Catalog Number']})"
+    st.rerun(INVENTORY_FRAGMENTS + ["inventory_sidebar"])
+
+# Function to open an item from the search results in the sidebar edit form (button callback)
+def start_editing_item(item_id, row):
+    st.session_state['edit_mode'] = True
+    st.session_state['edit_item_id'] = item_id
+    st.session_state['catalog_number'] = row["Catalog Number"]
+    st.session_state['vendor'] = row["Vendor"]
+    st.session_state['name'] = row["Name"]
+    st.session_state['quantity'] = int(row["Quantity"])
+    st.session_state['cost'] = float(row["Cost"]) if pd.notnull(row["Cost"]) else None
+    st.session_state['status'] = row["Status"]
+    st.session_state['requested_by'] = row["Requested By"]
+    st.session_state['unit'] = row["Unit"] if pd.notnull(row["Unit"]) else ""
+    st.session_state['notes'] = row["Notes"] if pd.notnull(row["Notes"]) else ""
+    st.session_state['url'] = row["URL"] if pd.notnull(row["URL"]) else ""
+
+    st.session_state['search_notice'] = f"Editing item: {row['Name']} (Catalog: {row['Catalog Number']})"
+    st.rerun(["inventory_search", "inventory_sidebar"])
+
+# Function to delete an item from the search results (button callback)
+def remove_item(row):
+    delete_inventory_item(row["Catalog Number"], row["Vendor"])
+    st.session_state['search_notice'] = f"Deleted item: {row['Name']} (Catalog: {row['Catalog Number']})"
+    st.rerun(INVENTORY_FRAGMENTS)
 
 # Function to download CSV template
 def download_csv_template():
@@ -389,6 +2849,11 @@ def download_csv_template():
     buffer.seek(0)
     return buffer
 
+# Function to build the CSV template once; it never changes
+@st.cache_data(show_spinner=False)
+def csv_template_bytes():
+    return download_csv_template().getvalue()
+
 # Streamlit UI
 
 # Initialize session state variables if not already set
@@ -410,22 +2875,65 @@ for key, default in {
 
 st.title("Lab Inventory Management")
 
+if len(LAB_SHARDS) > 1:
+    st.sidebar.selectbox("Lab", list(LAB_SHARDS), key="active_lab")
+
+if SYNC_MODE == "offline_first" and not ACTIVE_SHARD_READ_ONLY:
+    sync_state = get_sync_state(LOCAL_DB_FILE, GOOGLE_DRIVE_FILE_ID)
+    pending_changes = count_pending_changes()
+    sync_caption = f"{pending_changes} change(s) waiting to sync" if pending_changes else "All changes synced"
+    if sync_state["last_sync"]:
+        sync_caption += f" · last sync {sync_state['last_sync']}"
+    st.sidebar.caption(sync_caption)
+    if sync_state["last_error"]:
+        st.sidebar.caption(f"Working offline: {sync_state['last_error']}")
+    if pending_changes and st.sidebar.button("Sync now"):
+        sync_state["wake"].set()
+if ACTIVE_SHARD_READ_ONLY:
+    st.info(f"{ACTIVE_LAB} is archived and read-only.")
+
+show_all_labs = len(LAB_SHARDS) > 1 and st.toggle("Show all labs", key="show_all_labs")
+
+
+# Inventory table with status counters; changing the filter reruns only this fragment
+@st.fragment(key="inventory_overview", run_every=CHANGE_POLL_SECONDS)
+def inventory_overview():
+    table_df = get_inventory_across_labs() if show_all_labs else load_current_inventory()
+
+    status_counts = table_df["Status"].value_counts()
+    for column, status in zip(st.columns(len(STATUS_OPTIONS)), STATUS_OPTIONS):
+        column.metric(status, int(status_counts.get(status, 0)))
+
+    # Status filter
+    status_filter = st.selectbox(
+        "Filter by status:",
+        ["All"] + table_df["Status"].unique().tolist(),
+        index=0
+    )
+
+    # Date filter; the range is pushed down to SQL rather than filtered here
+    date_filter = st.selectbox("Filter by date:", ["Any date"] + list(DATE_FILTER_FIELDS), index=0)
+    if date_filter != "Any date":
+        today = datetime.now().date()
+        date_range = st.date_input("Between", value=(today.replace(day=1), today))
+        if len(date_range) == 2:
+            read_range = lambda db_file: get_inventory_in_date_range(DATE_FILTER_FIELDS[date_filter], *date_range, db_file)
+            if show_all_labs:
+                range_key = ("date_range", DATE_FILTER_FIELDS[date_filter], *date_range)
+                table_df = pd.concat([frame.assign(Lab=lab) for lab, frame in fan_out_read(read_range, range_key).items()], ignore_index=True)
+            else:
+                table_df = read_range(LOCAL_DB_FILE)
+
+    # Filter inventory based on selected status
+    if status_filter != "All":
+        filtered_inventory_df = table_df[table_df["Status"] == status_filter]
+    else:
+        filtered_inventory_df = table_df
 
-# Status filter
-status_filter = st.selectbox(
-    "Filter by status:",
-    ["All"] + inventory_df["Status"].unique().tolist(),
-    index=0
-)
-
-# Filter inventory based on selected status
-if status_filter != "All":
-    filtered_inventory_df = inventory_df[inventory_df["Status"] == status_filter]
-else:
-    filtered_inventory_df = inventory_df
+    st.subheader(f"Inventory - {status_filter}")
+    st.dataframe(filtered_inventory_df)
 
-st.subheader(f"Inventory - {status_filter}")
-st.dataframe(filtered_inventory_df)
+inventory_overview()
 
 # Add bulk status update feature
 #st.markdown("### Bulk Status Update")
@@ -467,140 +2975,332 @@ st.dataframe(filtered_inventory_df)
 
 
 
-# Search functionality
-search_query = st.text_input("Search inventory (by name, catalog number, or vendor):")
-if search_query:
-    filtered_df = inventory_df[inventory_df.apply(lambda row: search_query.lower() in row.to_string().lower(), axis=1)]
-
-    if not filtered_df.empty:
-        st.subheader("Search Results")
-        st.dataframe(filtered_df)
-
-        for index, row in filtered_df.iterrows():
-            unique_key = f"action_{row['Catalog Number']}_{index}"
-
-            col1, col2, col3 = st.columns([1, 1, 1])
-            with col1:
-                if st.button(f"Reorder", key=f"reorder_{unique_key}"):
-                    existing_item = get_item_by_catalog_and_vendor(row["Catalog Number"], row["Vendor"])
-            
-                    if existing_item:
-                        # Update the item directly in the database
-                        update_inventory_item(
-                            row["Catalog Number"],
-                            row["Vendor"],
-                            row["Name"],
-                            "Requested",
-                            st.session_state['quantity'],  # Use the value from session state
-                            row["Requested By"],
-                            row["Notes"]
-                        )
-            
-                        # Populate session state to update the sidebar with current values
-                        st.session_state['catalog_number'] = row["Catalog Number"]
-                        st.session_state['vendor'] = row["Vendor"]
-                        st.session_state['name'] = row["Name"]
-                        st.session_state['url'] = row["URL"]
-                        st.session_state['quantity'] = int(row["Quantity"]) if pd.notnull(row["Quantity"]) else 1
-                        st.session_state['unit'] = row["Unit"]
-                        st.session_state['notes'] = row["Notes"]
-                        st.session_state['cost'] = float(row["Cost"]) if pd.notnull(row["Cost"]) else 0.0
-                        st.session_state['status'] = 'Requested'
-                        st.session_state['requested_by'] = row["Requested By"]
-            
-                        st.success(f"Reordered item: {row['Name']} (Catalog: {row['Catalog Number']})")
-                    else:
-                        st.warning(f"Item not found in inventory: {row['Name']} (Catalog: {row['Catalog Number']})")
-            
-                    st.rerun()
-
-            with col2:
-                if st.button(f"Edit", key=f"edit_{unique_key}"):
-                    st.session_state['edit_mode'] = True
-                    st.session_state['edit_catalog_number'] = row["Catalog Number"]
-                    st.session_state['edit_vendor'] = row["Vendor"]
-                    st.session_state['catalog_number'] = row["Catalog Number"]
-                    st.session_state['vendor'] = row["Vendor"]
-                    st.session_state['name'] = row["Name"]
-                    st.session_state['quantity'] = int(row["Quantity"])
-                    st.session_state['cost'] = float(row["Cost"]) if pd.notnull(row["Cost"]) else 0.0
-                    st.session_state['status'] = row["Status"]
-                    st.session_state['requested_by'] = row["Requested By"]
-                    st.session_state['unit'] = row["Unit"] if pd.notnull(row["Unit"]) else ""
-                    st.session_state['notes'] = row["Notes"] if pd.notnull(row["Notes"]) else ""
-                    st.session_state['url'] = row["URL"] if pd.notnull(row["URL"]) else ""
-
-                    st.success(f"Editing item: {row['Name']} (Catalog: {row['Catalog Number']})")
-                    st.rerun()
-
-                if st.button(f"Mark Ordered", key=f"mark_ordered_{unique_key}"):
-                    update_inventory_item(
-                        row["Catalog Number"],
-                        row["Vendor"],
-                        row["Name"],
-                        "Ordered",  # Change status to Ordered
-                        row["Quantity"],
-                        row["Requested By"],
-                        row["Notes"]
-                    )
-                    st.success(f"Item '{row['Name']}' marked as Ordered.")
-                    st.rerun()
-
-            with col3:
-                if st.button(f"Delete", key=f"delete_{unique_key}"):
-                    delete_inventory_item(row["Catalog Number"], row["Vendor"])
-                    st.success(f"Deleted item: {row['Name']} (Catalog: {row['Catalog Number']})")
-                    st.rerun()
-
-                if st.button(f"Mark Received", key=f"mark_received_{unique_key}"):
-                    update_inventory_item(
-                        row["Catalog Number"],
-                        row["Vendor"],
-                        row["Name"],
-                        "Received",  # Change status to Received
-                        row["Quantity"],
-                        row["Requested By"],
-                        row["Notes"]
-                    )
-                    st.success(f"Item '{row['Name']}' marked as Received.")
-                    st.rerun()
+# Function to get the search results for a query, reusing this session's last results while
+# neither the query nor the active shard's change-feed version has moved
+def get_search_results(search_query):
+    version = get_change_version()
+    cached = st.session_state.get('search_results')
+    if cached and (cached["db_file"], cached["version"], cached["query"]) == (LOCAL_DB_FILE, version, search_query):
+        return cached["frame"]
 
-            st.markdown("---")
-    else:
-        st.warning("No matching items found.")
+    inventory_df = load_current_inventory()
+    matches = pd.Series(False, index=inventory_df.index)
+    for column in SEARCH_COLUMNS:
+        matches |= inventory_df[column].fillna("").astype(str).str.contains(search_query, case=False, regex=False)
+    filtered_df = inventory_df[matches]
+    st.session_state['search_results'] = {"db_file": LOCAL_DB_FILE, "version": version, "query": search_query, "frame": filtered_df}
+    return filtered_df
+
+# Search functionality; typing reruns only this fragment
+@st.fragment(key="inventory_search")
+def inventory_search():
+    # Confirmation left by a results-list callback; callbacks cannot draw during a fragment rerun
+    if 'search_notice' in st.session_state:
+        st.toast(st.session_state.pop('search_notice'))
+
+    search_query = st.text_input("Search inventory (by name, catalog number, or vendor):", key="search_query")
+    if search_query:
+        filtered_df = get_search_results(search_query)
+
+        if not filtered_df.empty:
+            st.subheader("Search Results")
+            st.dataframe(filtered_df)
+
+            for index, row in filtered_df.iterrows():
+                unique_key = f"action_{row['Catalog Number']}_{index}"
+
+                col1, col2, col3 = st.columns([1, 1, 1])
+                with col1:
+                    st.button(f"Reorder", key=f"reorder_{unique_key}", disabled=ACTIVE_SHARD_READ_ONLY,
+                              on_click=reorder_item, args=(index, row.to_dict()))
+
+                with col2:
+                    st.button(f"Edit", key=f"edit_{unique_key}", on_click=start_editing_item, args=(index, row.to_dict()))
+
+                    st.button(f"Mark Ordered", key=f"mark_ordered_{unique_key}", disabled=ACTIVE_SHARD_READ_ONLY,
+                              on_click=change_item_status, args=(index, row.to_dict(), "Ordered"))
+
+                with col3:
+                    st.button(f"Delete", key=f"delete_{unique_key}", disabled=ACTIVE_SHARD_READ_ONLY,
+                              on_click=remove_item, args=(row.to_dict(),))
+
+                    st.button(f"Mark Received", key=f"mark_received_{unique_key}", disabled=ACTIVE_SHARD_READ_ONLY,
+                              on_click=change_item_status, args=(index, row.to_dict(), "Received"))
+
+                st.markdown("---")
+        else:
+            st.warning("No matching items found.")
+
+inventory_search()
+
+# Poll for changes behind the search results. A poll reads only the change-feed version; the
+# page reruns, and the search with it, only when the results on screen are out of date.
+@st.fragment(key="inventory_search_poll", run_every=CHANGE_POLL_SECONDS)
+def inventory_search_poll():
+    shown = st.session_state.get('search_results')
+    if st.session_state.get('search_query') and shown and shown["version"] != get_change_version(shown["db_file"]):
+        st.rerun()
+
+inventory_search_poll()
+
+# Receiving: paste or scan a packing list, check it against open orders, then receive it at once
+@st.fragment
+def receive_delivery():
+    with st.expander("Receive a delivery"):
+        if 'receipt_notice' in st.session_state:
+            st.toast(st.session_state.pop('receipt_notice'))
+
+        receipt_text = st.text_area(
+            "Packing list: one catalog number per line, optionally followed by vendor and quantity",
+            key="receipt_text",
+            placeholder="A6141, Sigma, 2\n12321D\n88817\tThermo",
+        )
+        if not receipt_text.strip():
+            return
+
+        resolution = resolve_receipt(parse_receipt_lines(receipt_text))
+        counts = resolution["Result"].value_counts()
+        st.write(", ".join(f"{counts[result]} {result.lower()}" for result in ["Matched", "Ambiguous", "Already received", "Not found"] if result in counts))
+        if counts.get("Ambiguous"):
+            st.caption("Add a vendor to ambiguous lines to pick the right order.")
+        st.dataframe(resolution, hide_index=True)
+
+        matched = resolution[resolution["Result"] == "Matched"]
+        if st.button(f"Receive {len(matched)} Item(s)", disabled=ACTIVE_SHARD_READ_ONLY or matched.empty):
+            receive_items(zip(matched["ID"], matched["Quantity"]))
+            st.session_state['receipt_notice'] = f"Received {len(matched)} item(s)."
+            st.rerun()
+
+receive_delivery()
 
 
 
 
 
-# Import CSV
-uploaded_file = st.file_uploader("Upload CSV File", type=['csv'])
-if uploaded_file is not None:
-    import_csv_to_db(uploaded_file)
+# Import CSV/XLSX; picking files reruns only this fragment, and each upload is imported once
+@st.fragment
+def csv_import():
+    update_existing = st.toggle("Update existing items (preview changes before applying)", disabled=ACTIVE_SHARD_READ_ONLY)
+    uploaded_files = st.file_uploader("Upload CSV/XLSX Files", type=['csv', 'xlsx'], accept_multiple_files=True, disabled=ACTIVE_SHARD_READ_ONLY)
+    upload_ids = tuple(uploaded_file.file_id for uploaded_file in uploaded_files)
+    if not uploaded_files:
+        return
+
+    if not update_existing:
+        if st.session_state.get('imported_file_ids') != upload_ids:
+            st.session_state['imported_file_ids'] = upload_ids
+            import_files_to_db(uploaded_files)
+        show_import_rejects(st.session_state.get('import_rejects'))
+        return
+
+    # Upsert mode: parse once per set of files, show the dry-run diff, apply on request
+    if st.session_state.get('staged_import', (None,))[0] != upload_ids:
+        st.session_state['staged_import'] = (upload_ids, *stage_import_files(uploaded_files))
+    _, staged_df, rejects, errors = st.session_state['staged_import']
+    for file_name, error in errors.items():
+        st.error(f"{file_name}: {error}")
+    show_import_rejects(rejects)
+    if staged_df is None:
+        return
+
+    counts, preview = run_import(staged_df, "upsert", dry_run=True)
+    st.write(f"{counts.get('insert', 0)} new, {counts.get('update', 0)} updated, {counts.get('unchanged', 0)} unchanged")
+    if not preview.empty:
+        st.dataframe(preview, hide_index=True)
+    if st.button("Apply Import", disabled=not (counts.get('insert') or counts.get('update'))):
+        commit_import(staged_df, "upsert", len(uploaded_files))
+        st.rerun()
+
+csv_import()
 
 st.divider()
 st.header("Export/Import")
 
 st.download_button(
     label="Download Template",
-    data=download_csv_template().getvalue(),
+    data=csv_template_bytes(),
     file_name="inventory_template.csv",
-    mime="text/csv"
+    mime="text/csv",
+    on_click="ignore"
 )
 
-st.download_button("Download Inventory", inventory_df.to_csv(index=False), file_name="inventory.csv", mime="text/csv")
+# The CSV is generated only when the button is clicked, not on every rerun
+st.download_button("Download Inventory", lambda: export_inventory_csv(LOCAL_DB_FILE), file_name="inventory.csv", mime="text/csv", on_click="ignore")
+
+st.divider()
+st.header("Spend Summary")
+
+spend_tabs = st.tabs(["By Vendor", "By Requester", "By Status", "By Month"])
+for tab, dimension in zip(spend_tabs, ["vendor", "requested_by", "status", "month"]):
+    with tab:
+        summary = get_spend_summary_across_labs(dimension) if show_all_labs else get_spend_summary(dimension)
+        if dimension == "month":
+            summary = summary.sort_values("key", ascending=False)
+        st.dataframe(
+            summary.rename(columns={"key": dimension.replace("_", " ").title(), "item_count": "Items", "quantity": "Quantity", "spend": "Spend ($)"}),
+            hide_index=True
+        )
+
+if st.button("Rebuild Spend Summary"):
+    if rebuild_spend_summary():
+        st.success("Spend summary rebuilt; incremental totals were already correct.")
+    else:
+        st.warning("Spend summary rebuilt; incremental totals had drifted and have been corrected.")
+    upload_db()
+
+st.divider()
+st.header("Order History")
+
+with st.expander("Lead times, open orders and weekly throughput"):
+    history_end = datetime.now().date()
+    history_start = st.date_input("History since", value=history_end.replace(day=1))
+    # Use an exclusive upper bound one day past today so today's events are included
+    history_range = (history_start.isoformat(), (pd.Timestamp(history_end) + pd.Timedelta(days=1)).date().isoformat())
+
+    lead_times = get_lead_times(*history_range)
+    if not lead_times.empty:
+        st.metric("Median lead time (days)", f"{lead_times['lead_days'].median():.1f}")
+        st.dataframe(lead_times)
+    else:
+        st.caption("No items received in this period.")
+
+    st.subheader("Open Orders")
+    st.dataframe(get_open_order_age())
+
+    st.subheader("Weekly Throughput")
+    st.dataframe(get_weekly_throughput(*history_range))
+
+with st.expander("Due for reorder"):
+    st.caption(f"Products expected to run out within {FORECAST_HORIZON_DAYS} days (after vendor lead time), based on past receipts.")
+    reorder_suggestions = get_reorder_suggestions()
+    if reorder_suggestions.empty:
+        st.caption("Nothing is due for reorder.")
+    else:
+        reviewed_reorders = st.data_editor(
+            reorder_suggestions,
+            hide_index=True,
+            disabled=[column for column in reorder_suggestions.columns if column != "Reorder"],
+            key="reorder_review"
+        )
+        if st.button("Request Selected Items", disabled=ACTIVE_SHARD_READ_ONLY):
+            selected_ids = reviewed_reorders.loc[reviewed_reorders["Reorder"], "ID"].tolist()
+            if selected_ids:
+                request_reorders(selected_ids)
+                st.success(f"Requested {len(selected_ids)} item(s).")
+                st.rerun()
+            else:
+                st.warning("No items selected.")
 
 st.divider()
 st.header("Manage Duplicates")
 
-if st.button("Purge and Merge Duplicates"):
-    purge_and_merge_duplicates()
+if st.button("Find Near Duplicates"):
+    st.session_state['near_duplicate_candidates'] = find_near_duplicate_candidates()
 
+near_duplicate_candidates = st.session_state.get('near_duplicate_candidates')
+if near_duplicate_candidates is not None:
+    if near_duplicate_candidates.empty:
+        st.success("No near duplicates found.")
+    else:
+        st.caption("Tick the pairs that are the same product, then merge them.")
+        reviewed = st.data_editor(
+            near_duplicate_candidates,
+            hide_index=True,
+            disabled=[column for column in near_duplicate_candidates.columns if column != "Merge"],
+            key="near_duplicate_review"
+        )
+        if st.button("Merge Selected Near Duplicates", disabled=ACTIVE_SHARD_READ_ONLY):
+            confirmed = reviewed[reviewed["Merge"]]
+            groups = group_confirmed_pairs(zip(confirmed["ID A"], confirmed["ID B"]))
+            if groups:
+                merge_near_duplicate_groups(groups)
+                st.success(f"Merged {len(groups)} group(s) of near duplicates.")
+            del st.session_state['near_duplicate_candidates']
+            st.rerun()
+
+st.divider()
+st.header("Database Maintenance")
+
+snapshots = list_db_snapshots()
+if snapshots:
+    snapshot_to_restore = st.selectbox(
+        "Restore from snapshot",
+        snapshots,
+        format_func=lambda path: datetime.strptime(os.path.basename(path)[-25:-3], "%Y%m%d-%H%M%S-%f").strftime("%Y-%m-%d %H:%M:%S")
+    )
+    if st.button("Restore Snapshot", disabled=ACTIVE_SHARD_READ_ONLY):
+        restore_db_snapshot(snapshot_to_restore)
+        st.success("Database restored from snapshot.")
+        upload_db()
+        st.rerun()
+
+restore_pending, restore_conflict = read_restore_state()
+if restore_conflict:
+    st.warning(
+        "Google Drive has changes made after this copy last synced, so the restored snapshot has not been uploaded. "
+        "Uploading it anyway overwrites those changes; discarding it replaces the restored data with the Google Drive copy."
+    )
+    col1, col2 = st.columns(2)
+    if col1.button("Upload Restored Snapshot Anyway", disabled=ACTIVE_SHARD_READ_ONLY):
+        resolve_restore_conflict(keep=True)
+        upload_db()
+        st.rerun()
+    if col2.button("Discard Restore", disabled=ACTIVE_SHARD_READ_ONLY):
+        resolve_restore_conflict(keep=False)
+        upload_db()
+        st.rerun()
+elif restore_pending and SYNC_MODE != "local":
+    st.caption("The restored snapshot replaces the Google Drive copy at the next sync.")
+
+if st.button("Compact and Optimize Database", disabled=ACTIVE_SHARD_READ_ONLY):
+    try:
+        run_db_maintenance(force=True)
+        st.success("Database compacted and statistics refreshed.")
+        upload_db()
+    except sqlite3.Error as e:
+        st.error(f"Database maintenance failed: {e}")
+
+
+# Function to show an item's attachments in the sidebar; files are fetched only when downloaded
+def item_attachments(item_id):
+    st.subheader("Attachments")
+    if 'attachment_notice' in st.session_state:
+        st.toast(st.session_state.pop('attachment_notice'))
+
+    attachments = get_item_attachments(item_id)
+    if attachments.empty:
+        st.caption("No quotes, invoices or SDS files attached yet.")
+
+    for attachment in attachments.itertuples():
+        col1, col2 = st.columns([3, 1])
+        with col1:
+            st.download_button(
+                f"{attachment.kind}: {attachment.file_name} ({attachment.size_bytes / 1024:.1f} KB)",
+                lambda sha256=attachment.sha256: read_attachment_blob(sha256),
+                file_name=attachment.file_name,
+                mime=attachment.mime_type or "application/octet-stream",
+                key=f"attachment_{attachment.sha256}",
+                on_click="ignore"
+            )
+        with col2:
+            if st.button("Remove", key=f"remove_attachment_{attachment.sha256}", disabled=ACTIVE_SHARD_READ_ONLY):
+                remove_attachment(item_id, attachment.sha256)
+                st.rerun()
 
-# Sidebar form for adding new inventory item or editing existing items
-# Sidebar form for adding new inventory item or editing existing items
-if st.session_state.get('edit_mode', False):
-    with st.sidebar:
+    kind = st.selectbox("Attachment Type", ATTACHMENT_KINDS, key="attachment_kind")
+    uploaded_file = st.file_uploader("Attach a File", key=f"attachment_upload_{item_id}", disabled=ACTIVE_SHARD_READ_ONLY)
+    if uploaded_file is not None and st.button("Attach File", disabled=ACTIVE_SHARD_READ_ONLY):
+        if attach_file(item_id, uploaded_file.name, uploaded_file.getvalue(), kind, st.session_state.get("requested_by")):
+            st.session_state['attachment_notice'] = f"Attached {uploaded_file.name}."
+        else:
+            st.session_state['attachment_notice'] = f"{uploaded_file.name} is already attached to this item."
+        st.rerun()
+
+# Sidebar form for adding new inventory item or editing existing items.
+# Runs as a fragment so product lookups do not rerun the rest of the page.
+@st.fragment(key="inventory_sidebar")
+def inventory_sidebar():
+    if st.session_state.get('edit_mode', False):
         st.header("Edit Inventory Item")
         with st.form("edit_inventory"):
             requested_by = st.selectbox(
@@ -621,25 +3321,39 @@ if st.session_state.get('edit_mode', False):
             status = st.selectbox("Status", ["Requested", "Ordered", "Received"], 
                                   index=["Requested", "Ordered", "Received"].index(st.session_state['status']))
 
-            submit_button = st.form_submit_button("Save Changes")
+            submit_button = st.form_submit_button("Save Changes", disabled=ACTIVE_SHARD_READ_ONLY)
 
             if submit_button:
-                update_inventory_item(
-                    st.session_state["edit_catalog_number"],
-                    st.session_state["edit_vendor"],
-                    name,  # Include the edited name field
-                    status,
-                    quantity,
-                    requested_by,
-                    notes
-                )
-                st.success(f"Item '{name}' updated successfully!")
+                try:
+                    changed = edit_inventory_item(st.session_state["edit_item_id"], {
+                        "requested_by": requested_by, "catalog_number": catalog_number, "vendor": vendor,
+                        "name": name, "url": url, "quantity": quantity, "unit": unit, "notes": notes,
+                        "cost": cost, "status": status
+                    })
+                except sqlite3.IntegrityError:
+                    st.error(f"Another item already has catalog number {catalog_number} from {vendor}.")
+                    st.stop()
+                if changed:
+                    st.success(f"Item '{name}' updated successfully!")
+                else:
+                    st.info("No changes to save.")
                 st.session_state['edit_mode'] = False  # Exit edit mode after save
                 st.rerun()
 
-else:
-    with st.sidebar:
+        item_attachments(st.session_state["edit_item_id"])
+
+    else:
         st.header("Add New Inventory Item")
+        st.caption("Enter a catalog number and vendor to prefill details from past orders.")
+        st.text_input("Look up catalog number", key="lookup_catalog_number", on_change=prefill_from_lookup)
+        st.text_input("Look up vendor", key="lookup_vendor", on_change=prefill_from_lookup)
+        if 'lookup_result' in st.session_state:
+            lookup_result = st.session_state['lookup_result']
+            if lookup_result:
+                st.caption(f"Prefilled from {lookup_result['source']}.")
+            else:
+                st.caption("No previous order found for this product.")
+
         with st.form("add_inventory"):
             requested_by = st.selectbox(
                 "Requested By",
@@ -659,27 +3373,19 @@ else:
             status = st.selectbox("Status", ["Requested", "Ordered", "Received"], 
                                   index=["Requested", "Ordered", "Received"].index(st.session_state.get('status', 'Requested')))
 
-            submit_button = st.form_submit_button("Add Item")
+            submit_button = st.form_submit_button("Add Item", disabled=ACTIVE_SHARD_READ_ONLY)
 
             if submit_button:
-                # Check if item already exists
-                existing_item = get_item_by_catalog_and_vendor(catalog_number, vendor)
-                
-                if existing_item:
-                    # Update existing item
-                    update_inventory_item(
-                        catalog_number,
-                        vendor,
-                        name,
-                        status,
-                        quantity,
-                        requested_by,
-                        notes
-                    )
+                # Adds the item, or merges it into the existing item with the same catalog number and vendor
+                action = add_inventory_item(requested_by, catalog_number, vendor, name, url, quantity, unit, notes, cost, status)
+                if action == "insert":
+                    st.success(f"Item '{name}' added successfully!")
+                elif action == "update":
                     st.success(f"Updated existing item: {name} (Catalog: {catalog_number})")
                 else:
-                    # Add new item if not found
-                    add_inventory_item(requested_by, catalog_number, vendor, name, url, quantity, unit, notes, cost, status)
-                    st.success(f"Item '{name}' added successfully!")
+                    st.info(f"'{name}' is already in the inventory with these details.")
 
                 st.rerun()
+
+with st.sidebar:
+    inventory_sidebar()
@@ -0,0 +1,142 @@
+import io
+import chardet
+import numpy as np
+import pandas as pd
+
+# Parsing for the bulk import lives in its own module so a process pool can pickle it;
+# functions defined in the Streamlit script itself cannot be sent to worker processes.
+
+REQUIRED_IMPORT_COLUMNS = {"catalog_number", "vendor", "name"}
+STATUS_OPTIONS = ["Requested", "Ordered", "Received"]
+EXCEL_EXTENSIONS = (".xlsx", ".xlsm")
+
+# Optional columns are added as blanks when a file lacks them, so merged files line up column
+# for column; defaults are applied only when a row is inserted, never over existing values
+IMPORT_OPTIONAL_COLUMNS = [
+    "requested_by", "url", "quantity", "unit", "notes", "cost", "status", "order_date", "received_date"
+]
+
+# Dates are stored as ISO-8601 (YYYY-MM-DD) text, so they sort and compare correctly and the
+# date indexes can serve range queries
+IMPORT_DATE_COLUMNS = ["order_date", "received_date"]
+
+# Function to convert date values to ISO-8601 strings. ISO input takes a fast vectorized path; the
+# rest is parsed one value at a time. Returns the converted values (None where blank or unreadable)
+# and a mask of the non-blank values that could not be read as dates.
+def normalize_dates(values):
+    values = pd.Series(values, dtype=object)
+    blank = values.isna() | (values.astype(str).str.strip() == "")
+    text = values.where(~blank).astype(str).str.strip()
+    parsed = pd.to_datetime(text, format="ISO8601", errors="coerce")
+    retry = ~blank & parsed.isna()
+    if retry.any():
+        parsed[retry] = pd.to_datetime(text[retry], format="mixed", errors="coerce")
+    iso = parsed.dt.strftime("%Y-%m-%d").astype(object).where(parsed.notna(), None)
+    return iso, ~blank & parsed.isna()
+
+# Function to normalize one date column of a frame in place. Unreadable values are appended to the
+# row's notes instead of being stored as if they were dates. Returns the mask of those rows.
+def normalize_date_column(df, column):
+    iso, invalid = normalize_dates(df[column])
+    if invalid.any():
+        kept = f"{column.replace('_', ' ').capitalize()}: " + df.loc[invalid, column].astype(str)
+        notes = df.loc[invalid, "notes"].astype(object)
+        has_notes = notes.notna() & (notes.astype(str).str.strip() != "")
+        df["notes"] = df["notes"].astype(object)
+        df.loc[invalid, "notes"] = kept.where(~has_notes, notes.astype(str).str.rstrip() + " | " + kept)
+    df[column] = iso.values
+    return invalid
+
+# Function to convert a column to numbers, accepting currency symbols and thousands separators.
+# Returns the numbers (NaN where blank or unreadable) and a mask of the unreadable values.
+def coerce_numbers(values):
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float), pd.Series(False, index=values.index)
+    text = values.astype(str).str.replace(r"[$€£,\s]", "", regex=True)
+    blank = values.isna() | (text == "")
+    numbers = pd.to_numeric(text.where(~blank), errors="coerce")
+    return numbers, ~blank & numbers.isna()
+
+# Function to validate and coerce the parsed rows column by column. Returns the valid rows and a
+# rejects frame with each failing row's number in the file, its reasons and its original values.
+def validate_import_rows(df, raw):
+    quantity, quantity_invalid = coerce_numbers(df["quantity"])
+    cost, cost_invalid = coerce_numbers(df["cost"])
+    status = df["status"].astype(str).str.strip().str.capitalize()
+    status_blank = df["status"].isna() | (status == "")
+
+    checks = {
+        "catalog number is blank": df["catalog_number"] == "",
+        "vendor is blank": df["vendor"] == "",
+        "quantity is not a number": quantity_invalid,
+        "quantity is not a whole number": quantity % 1 > 0,
+        "quantity must be at least 1": quantity < 1,
+        "cost is not a number": cost_invalid,
+        "cost cannot be negative": cost < 0,
+        f"status must be one of {', '.join(STATUS_OPTIONS)}": ~status_blank & ~status.isin(STATUS_OPTIONS),
+    }
+    failed = pd.DataFrame(checks).to_numpy()
+    rejected = failed.any(axis=1)
+
+    # Reasons are joined only for the failing rows
+    reasons = pd.Series("", index=df.index[rejected])
+    for reason, column in zip(checks, failed[rejected].T):
+        reasons += np.where(column, f"; {reason}", "")
+    rejects = raw[rejected].drop(columns="source_row")
+    rejects.insert(0, "reason", reasons.str.removeprefix("; "))
+    rejects.insert(0, "row", raw.loc[rejected, "source_row"])
+
+    df["quantity"] = quantity
+    df["cost"] = cost
+    df["status"] = status.where(~status_blank, None)
+    valid = df[~rejected].drop(columns="source_row").reset_index(drop=True)
+    valid["quantity"] = valid["quantity"].astype("Int64")
+    return valid, rejects.reset_index(drop=True)
+
+# Function to read one uploaded CSV or XLSX export into a DataFrame
+def read_import_file(file_name, raw_data):
+    if file_name.lower().endswith(EXCEL_EXTENSIONS):
+        return pd.read_excel(io.BytesIO(raw_data))
+
+    encoding = chardet.detect(raw_data)['encoding'] or 'ISO-8859-1'
+    try:
+        return pd.read_csv(io.BytesIO(raw_data), encoding=encoding, skip_blank_lines=False)
+    except UnicodeDecodeError:
+        return pd.read_csv(io.BytesIO(raw_data), encoding="ISO-8859-1", skip_blank_lines=False)
+
+# Function to parse, validate and normalize one import file; runs in a worker process.
+# Returns (file name, valid rows, rejected rows, error).
+def parse_import_file(file_name, raw_data):
+    try:
+        df = read_import_file(file_name, raw_data)
+    except Exception as e:
+        return file_name, None, None, f"could not be read: {e}"
+
+    # Standardizing column names
+    df.columns = df.columns.astype(str).str.strip().str.replace(" ", "_").str.lower()
+
+    missing_columns = REQUIRED_IMPORT_COLUMNS - set(df.columns)
+    if missing_columns:
+        return file_name, None, None, f"missing required columns: {missing_columns}"
+
+    # Spreadsheets often carry trailing blank rows; rows are numbered as in the file, after the header
+    columns = list(df.columns)
+    df["source_row"] = np.arange(len(df)) + 2
+    df = df.dropna(how="all", subset=columns).reset_index(drop=True)
+    raw = df.copy()
+
+    # Normalize data for comparison
+    for column in ("catalog_number", "vendor"):
+        df[column] = df[column].astype(str).str.strip().str.lower().where(df[column].notna(), "")
+    for column in IMPORT_OPTIONAL_COLUMNS:
+        if column not in df.columns:
+            df[column] = None
+        elif pd.api.types.is_datetime64_any_dtype(df[column]):
+            # Excel cells come back as timestamps; store them as the app's date strings
+            df[column] = df[column].dt.strftime("%Y-%m-%d")
+    for column in IMPORT_DATE_COLUMNS:
+        normalize_date_column(df, column)
+    df, rejects = validate_import_rows(df, raw)
+    df["source_file"] = file_name
+    rejects.insert(0, "source_file", file_name)
+    return file_name, df, rejects, None
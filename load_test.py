@@ -0,0 +1,595 @@
+"""Concurrent-session load test for the lab orders app.
+
+Simulates N lab members using the app at once. Each virtual user is a Streamlit
+AppTest session driven through a realistic mix of search, add, status change and
+CSV import. All sessions share one process, like a real Streamlit server, so they
+share its caches, background sync workers and SQLite file. Google Drive is replaced
+by a local stand-in that speaks the Drive v3 HTTP API, including resumable uploads.
+
+Usage:
+    python load_test.py --users 8 --duration 60 --sync-mode offline_first
+    python load_test.py --users 4 --seed-rows 5000 --json results.json --fail-p95-ms 2000
+    python load_test.py --users 2 --seed-rows 20000 --check-query-plans
+
+Reports p50/p95/p99 rerun latency per action, SQLite lock waits, Drive traffic
+and throughput. Exits non-zero when --fail-p95-ms is exceeded, when a rerun raises or
+does not finish (a script compilation error included), or with --check-query-plans
+when a statement scans the inventory table without an index.
+"""
+import argparse
+import gzip
+import json
+import os
+import random
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+from urllib.parse import urlparse, parse_qs
+
+import gdown
+import httplib2
+import pandas as pd
+import googleapiclient.discovery
+from google.oauth2.service_account import Credentials
+import streamlit as st
+from streamlit import config
+from streamlit.components.v2.component_manager import BidiComponentManager
+from streamlit.runtime import Runtime
+from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+from streamlit.runtime.dataframe_source_manager import DataframeSourceManager
+from streamlit.runtime.media_file_manager import MediaFileManager
+from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+from streamlit.runtime.pages_manager import PagesManager
+from streamlit.runtime.scriptrunner import ScriptRunnerEvent
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.runtime.secrets import Secrets
+from streamlit.testing.v1 import AppTest
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+from streamlit.testing.v1.util import build_mock_config_get_option
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_FILE = os.path.join(APP_DIR, "alon_lab_orders.py")
+DRIVE_FILE_ID = "load-test-inventory"
+
+# Share of each action in a virtual user's script
+ACTION_WEIGHTS = {"search": 0.55, "status": 0.25, "add": 0.15, "import": 0.05}
+SEARCH_TERMS = ["sigma", "thermo", "vwr", "dish", "antibody", "buffer", "kit", "tube", "lt-"]
+VENDORS = ["sigma-aldrich", "thermofisher", "vwr", "fisher scientific", "bio-rad", "abcam"]
+IMPORT_ROWS = 50
+BUSY_POLL_SECONDS = 0.002
+RERUN_TIMEOUT_SECONDS = 120
+
+# Words that can follow "inventory" in a FROM clause without being its alias
+SQL_KEYWORDS = {"where", "set", "join", "left", "inner", "cross", "on", "using", "group", "order", "limit", "values", "union", "as", "indexed", "not"}
+
+# Placeholder service account; the Drive stand-in never checks it
+FAKE_SERVICE_ACCOUNT = {
+    "type": "service_account", "project_id": "load-test", "private_key_id": "x", "private_key": "x",
+    "client_email": "load-test@example.com", "client_id": "x", "auth_uri": "x", "token_uri": "x",
+    "auth_provider_x509_cert_url": "x", "client_x509_cert_url": "x",
+}
+
+# Shared counters; every update happens under stats_lock
+stats_lock = threading.Lock()
+stats = {"latencies": [], "lock_waits": [], "errors": [], "full_scans": [], "drive": {"downloads": 0, "uploads": 0, "bytes_up": 0, "bytes_down": 0}}
+
+
+# Function to record one timed rerun
+def record_latency(user, action, seconds):
+    with stats_lock:
+        stats["latencies"].append((user, action, seconds))
+
+# Function to record how long a statement waited for the SQLite write lock
+def record_lock_wait(seconds):
+    with stats_lock:
+        stats["lock_waits"].append(seconds)
+
+# Function to record a failed action with a short description
+def record_error(user, action, message):
+    with stats_lock:
+        stats["errors"].append((user, action, message))
+
+
+# SQLite lock waits. Connections are opened with a zero busy timeout and the wrapper retries
+# "database is locked" itself, up to the caller's timeout, so every wait can be timed.
+def wait_for_lock(statement, timeout):
+    started = None
+    while True:
+        try:
+            result = statement()
+        except sqlite3.OperationalError as e:
+            if "locked" not in str(e):
+                raise
+            now = time.perf_counter()
+            started = started or now
+            if now - started >= timeout:
+                record_lock_wait(now - started)
+                raise
+            time.sleep(BUSY_POLL_SECONDS)
+            continue
+        if started is not None:
+            record_lock_wait(time.perf_counter() - started)
+        return result
+
+
+class LockTimingCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        return wait_for_lock(lambda: super(LockTimingCursor, self).execute(sql, parameters), self.connection.busy_timeout)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Parameters may be a one-shot iterator, so materialize them before any retry
+        rows = list(seq_of_parameters)
+        return wait_for_lock(lambda: super(LockTimingCursor, self).executemany(sql, rows), self.connection.busy_timeout)
+
+
+class LockTimingConnection(sqlite3.Connection):
+    def __init__(self, *args, timeout=5.0, **kwargs):
+        super().__init__(*args, timeout=0, **kwargs)
+        self.busy_timeout = timeout
+
+    def cursor(self, factory=LockTimingCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        return wait_for_lock(super().commit, self.busy_timeout)
+
+
+# Function to make every sqlite3.connect in this process use the lock-timing connection
+def install_lock_timing():
+    connect = sqlite3.connect
+
+    def timed_connect(*args, **kwargs):
+        kwargs.setdefault("factory", LockTimingConnection)
+        return connect(*args, **kwargs)
+
+    sqlite3.connect = timed_connect
+
+
+# Function to build an httplib2-compatible stand-in for the Drive v3 API backed by a local
+# directory. It serves metadata, revision lists and media downloads and accepts resumable uploads;
+# every upload adds a revision, and each revision's content stays downloadable.
+def make_drive_stand_in(store_dir, latency_seconds=0.0):
+    state = {"revisions": {}, "sessions": {}, "lock": threading.Lock()}
+
+    def payload_path(file_id, revision_id=None):
+        return os.path.join(store_dir, file_id if revision_id is None else f"{file_id}@{revision_id}")
+
+    # The seeded file is its first revision
+    def revisions(file_id):
+        if file_id not in state["revisions"]:
+            shutil.copyfile(payload_path(file_id), payload_path(file_id, "1"))
+            state["revisions"][file_id] = ["1"]
+        return state["revisions"][file_id]
+
+    def respond(status, content=b"", **headers):
+        headers = {key.replace("_", "-"): str(value) for key, value in headers.items()}
+        return httplib2.Response({"status": status, **headers}), content
+
+    def request(uri, method="GET", body=None, headers=None, **kwargs):
+        time.sleep(latency_seconds)
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        url = urlparse(uri)
+        query = parse_qs(url.query)
+        # /drive/v3/files/{id}, /drive/v3/files/{id}/revisions[/{revision}] or /upload-session/{id}
+        parts = url.path.rstrip("/").split("/")
+        file_id = parts[-1]
+        revision_id = None
+        if "revisions" in parts:
+            file_id = parts[parts.index("revisions") - 1]
+            revision_id = parts[-1] if parts[-1] != "revisions" else None
+
+        with state["lock"]:
+            # Chunk of an open resumable upload session
+            if url.path.startswith("/upload-session/"):
+                session = state["sessions"][file_id]
+                # Chunks of file-backed uploads arrive as stream slices, like httplib2 receives them
+                if hasattr(body, "read"):
+                    body = body.read()
+                if isinstance(body, str):
+                    body = body.encode()
+                session["data"] += body or b""
+                total = headers.get("content-range", "").rsplit("/", 1)[-1]
+                if total != "*" and len(session["data"]) >= int(total):
+                    history = revisions(session["file_id"])
+                    history.append(str(len(history) + 1))
+                    for path in (payload_path(session["file_id"]), payload_path(session["file_id"], history[-1])):
+                        with open(path, "wb") as payload:
+                            payload.write(session["data"])
+                    del state["sessions"][file_id]
+                    stats["drive"]["uploads"] += 1
+                    stats["drive"]["bytes_up"] += len(session["data"])
+                    return respond(200, json.dumps({"id": session["file_id"], "headRevisionId": history[-1]}).encode())
+                return respond(308, range=f"bytes=0-{len(session['data']) - 1}")
+
+            # Start of a resumable upload (files.update with uploadType=resumable)
+            if query.get("uploadType") == ["resumable"]:
+                session_id = f"{file_id}-{len(state['sessions'])}-{time.perf_counter_ns()}"
+                state["sessions"][session_id] = {"file_id": file_id, "data": b""}
+                return respond(200, location=f"https://www.googleapis.com/upload-session/{session_id}")
+
+            if not os.path.exists(payload_path(file_id)):
+                return respond(404, b'{"error": {"code": 404, "message": "File not found"}}')
+
+            history = revisions(file_id)
+            if "revisions" in parts and revision_id is None:
+                return respond(200, json.dumps({"revisions": [{"id": revision} for revision in history]}).encode())
+            if revision_id is not None and revision_id not in history:
+                return respond(404, b'{"error": {"code": 404, "message": "Revision not found"}}')
+
+            # Media download of the head or of one revision, honouring the Range header MediaIoBaseDownload sends
+            if query.get("alt") == ["media"]:
+                with open(payload_path(file_id, revision_id), "rb") as payload:
+                    data = payload.read()
+                first, last = 0, len(data) - 1
+                if "range" in headers:
+                    first, last = (int(part) for part in headers["range"].split("=")[1].split("-"))
+                    last = min(last, len(data) - 1)
+                stats["drive"]["bytes_down"] += last - first + 1
+                if first == 0:
+                    stats["drive"]["downloads"] += 1
+                return respond(206, data[first:last + 1], content_range=f"bytes {first}-{last}/{len(data)}")
+
+            # Metadata (files.get with fields=headRevisionId)
+            return respond(200, json.dumps({"id": file_id, "headRevisionId": history[-1]}).encode())
+
+    return SimpleNamespace(request=request, close=lambda: None, store_dir=store_dir)
+
+
+# Function to route the app's Drive access (API client and gdown) to the local stand-in
+def install_drive_stand_in(drive_http):
+    build = googleapiclient.discovery.build
+    googleapiclient.discovery.build = lambda service_name, version, *args, **kwargs: build(
+        service_name, version, http=drive_http, static_discovery=True
+    )
+    Credentials.from_service_account_info = classmethod(lambda cls, info, **kwargs: None)
+
+    def cached_download(url, path, **kwargs):
+        file_id = parse_qs(urlparse(url).query)["id"][0]
+        shutil.copyfile(os.path.join(drive_http.store_dir, file_id), path)
+        with stats_lock:
+            stats["drive"]["downloads"] += 1
+        return path
+
+    gdown.cached_download = cached_download
+
+
+# Function to create the working directory: a seeded copy of the database plus its Drive copy
+def prepare_workdir(workdir, source_db, seed_rows, rng):
+    os.makedirs(os.path.join(workdir, "drive"), exist_ok=True)
+    db_file = os.path.join(workdir, "inventory.db")
+    if source_db and os.path.exists(source_db):
+        shutil.copyfile(source_db, db_file)
+
+    conn = sqlite3.connect(db_file)
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS inventory (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            requested_by TEXT NOT NULL,
+            catalog_number TEXT NOT NULL,
+            vendor TEXT NOT NULL,
+            name TEXT NOT NULL,
+            url TEXT,
+            quantity INTEGER DEFAULT 1,
+            unit TEXT,
+            notes TEXT,
+            cost REAL,
+            status TEXT DEFAULT 'Requested',
+            order_date TEXT,
+            received_date TEXT
+        )
+    ''')
+    conn.executemany(
+        "INSERT INTO inventory (requested_by, catalog_number, vendor, name, quantity, cost, status) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [
+            ("Load Test", f"seed-{n}", rng.choice(VENDORS), f"Seeded {rng.choice(SEARCH_TERMS[:-1])} item {n}",
+             rng.randint(1, 10), round(rng.uniform(5, 500), 2), rng.choice(["Requested", "Ordered", "Received"]))
+            for n in range(seed_rows)
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+    with open(db_file, "rb") as source, gzip.open(os.path.join(workdir, "drive", DRIVE_FILE_ID), "wb") as payload:
+        shutil.copyfileobj(source, payload)
+    return db_file
+
+
+# AppTest installs and tears down process-wide state (runtime, secrets, config) around every
+# run, so two sessions can never run at once and st.cache_data starts empty on each rerun.
+# Here one runtime is installed for the whole test, as a real server shares one across
+# sessions, and each session's runs skip the global setup. Sessions also share one script
+# cache, as on a server: the script is compiled once, and never by two threads at once.
+# A run that does not finish cleanly (a compile error, or stopping without completing)
+# raises, so it counts as an error wherever it happens.
+class ConcurrentAppTest(AppTest):
+    script_cache = ScriptCache()
+
+    def _run(self, widget_state=None, timeout=None):
+        pages_manager = PagesManager(self._script_path, self.script_cache, setup_watcher=False)
+        pages_manager.set_current_page_script_hash(self._finished_page_script_hash)
+        script_runner = LocalScriptRunner(
+            self._script_path,
+            self._session_state,
+            pages_manager,
+            args=self.args,
+            kwargs=self.kwargs,
+            fragment_storage=self._fragment_storage,
+        )
+        script_runner._script_cache = self.script_cache  # The runner compiles with its own cache otherwise
+        self._register_uploaded_files(script_runner)
+        self._tree = script_runner.run(
+            widget_state, self.query_params, timeout or self.default_timeout,
+            self._page_hash or self._finished_page_script_hash
+        )
+        self._finished_page_script_hash = pages_manager.current_page_script_hash
+        self._tree._runner = self
+
+        for event, data in zip(script_runner.events, script_runner.event_data):
+            if event == ScriptRunnerEvent.SCRIPT_STOPPED_WITH_COMPILE_ERROR:
+                raise RuntimeError(f"Script compilation error: {data['exception']}")
+        finished = {ScriptRunnerEvent.SCRIPT_STOPPED_WITH_SUCCESS, ScriptRunnerEvent.FRAGMENT_STOPPED_WITH_SUCCESS}
+        if not finished.intersection(script_runner.events):
+            raise RuntimeError("Script run stopped without finishing")
+        return self
+
+# Function to install the runtime, secrets and config every session shares
+def install_shared_runtime(sync_mode):
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.dataframe_source_mgr = DataframeSourceManager()
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    runtime.bidi_component_registry = BidiComponentManager()
+    runtime.bidi_component_registry.discover_and_register_components(start_file_watching=False)
+    Runtime._instance = runtime
+
+    secrets = {
+        "sync_mode": sync_mode,
+        "lab_shards": {"Alon Lab": {"drive_file_id": DRIVE_FILE_ID, "local_db_file": "inventory.db"}},
+    }
+    if sync_mode != "local":
+        secrets["google_drive"] = FAKE_SERVICE_ACCOUNT
+    st.secrets = Secrets()
+    st.secrets._secrets = secrets
+
+    config.get_option = build_mock_config_get_option({"global.appTest": True})
+
+# Function to open a new virtual user's session
+def open_session():
+    return ConcurrentAppTest(APP_FILE, default_timeout=RERUN_TIMEOUT_SECONDS)
+
+# Function to run one rerun and time it; script exceptions count as errors, and runs that did
+# not finish raise to the caller, which counts them
+def timed_run(at, user, action, interaction=None):
+    started = time.perf_counter()
+    try:
+        (interaction or at).run()
+    finally:
+        record_latency(user, action, time.perf_counter() - started)
+    if at.exception:
+        record_error(user, action, at.exception[0].value)
+        return False
+    return True
+
+# Function to find a widget by its label. After a fragment-only rerun AppTest holds just that
+# fragment's elements, while a browser keeps the rest of the page; a full rerun (untimed)
+# brings the page back in that case.
+def widget(at, kind, label, sidebar=False):
+    for attempt in range(2):
+        widgets = getattr(at.sidebar if sidebar else at, kind)
+        found = next((w for w in widgets if w.label.startswith(label)), None)
+        if found is not None or attempt:
+            break
+        at.run()
+    if found is None:
+        raise LookupError(f"no {kind} labelled {label!r}")
+    return found
+
+# Function to type a search term
+def search(at, user, rng):
+    return timed_run(at, user, "search", widget(at, "text_input", "Search inventory").set_value(rng.choice(SEARCH_TERMS)))
+
+# Function to search and then mark one of the results Ordered or Received
+def change_status(at, user, rng):
+    if not search(at, user, rng):
+        return
+    buttons = [b for b in at.button if b.key and b.key.startswith(("mark_ordered_", "mark_received_")) and not b.disabled]
+    if buttons:
+        timed_run(at, user, "status", rng.choice(buttons).click())
+
+# Function to add a new item through the sidebar form
+def add_item(at, user, rng, sequence):
+    widget(at, "text_input", "Catalog Number", sidebar=True).set_value(f"LT-{user}-{sequence}")
+    widget(at, "text_input", "Vendor", sidebar=True).set_value(rng.choice(VENDORS))
+    widget(at, "text_input", "Item Name", sidebar=True).set_value(f"Load test {rng.choice(SEARCH_TERMS[:-1])} {user}-{sequence}")
+    timed_run(at, user, "add", widget(at, "button", "Add Item", sidebar=True).click())
+
+# Function to upload a CSV mixing new items with items other users already added
+def import_csv(at, user, rng, sequence):
+    rows = pd.DataFrame({
+        "Catalog Number": [f"LT-IMPORT-{user}-{sequence}-{n}" if rng.random() < 0.7 else f"seed-{n}" for n in range(IMPORT_ROWS)],
+        "Vendor": [rng.choice(VENDORS) for _ in range(IMPORT_ROWS)],
+        "Name": [f"Imported {rng.choice(SEARCH_TERMS[:-1])} {n}" for n in range(IMPORT_ROWS)],
+        "Quantity": [rng.randint(1, 5) for _ in range(IMPORT_ROWS)],
+    })
+    uploader = widget(at, "file_uploader", "Upload CSV")
+    timed_run(at, user, "import", uploader.set_value((f"import-{user}-{sequence}.csv", rows.to_csv(index=False).encode(), "text/csv")))
+
+# Function to run one virtual user until told to stop, pausing between actions like a person would
+def virtual_user(user, think_seconds, seed, start_barrier, stop):
+    rng = random.Random(seed)
+    try:
+        at = open_session()
+        start_barrier.wait()
+        timed_run(at, user, "open")
+        sequence = 0
+        while not stop.is_set():
+            sequence += 1
+            action = rng.choices(list(ACTION_WEIGHTS), weights=list(ACTION_WEIGHTS.values()))[0]
+            try:
+                if action == "search":
+                    search(at, user, rng)
+                elif action == "status":
+                    change_status(at, user, rng)
+                elif action == "add":
+                    add_item(at, user, rng, sequence)
+                else:
+                    import_csv(at, user, rng, sequence)
+            except Exception as e:
+                record_error(user, action, f"{type(e).__name__}: {e}")
+            stop.wait(rng.expovariate(1 / think_seconds) if think_seconds else 0)
+    except Exception as e:
+        record_error(user, "session", f"{type(e).__name__}: {e}")
+
+
+# Function to list traced statements that read the inventory table with a full table scan, with how
+# often each ran. Statements that filter rows should be served by an index; reading the whole table
+# on purpose (no WHERE clause) is not counted.
+def find_full_scans(trace_file, offset):
+    scans = {}
+    with open(trace_file) as trace:
+        trace.seek(offset)
+        for line in trace:
+            record = json.loads(line)
+            if not re.search(r"\bwhere\b", record["sql"], re.IGNORECASE):
+                continue
+            aliases = {"inventory"} | {
+                alias for alias in re.findall(r"\binventory\s+(?:as\s+)?(\w+)", record["sql"], re.IGNORECASE)
+                if alias.lower() not in SQL_KEYWORDS
+            }
+            if any(detail in {f"SCAN {alias}" for alias in aliases} for detail in record["plan"] or []):
+                scans[record["sql"]] = scans.get(record["sql"], 0) + 1
+    return [{"sql": sql, "count": count} for sql, count in sorted(scans.items(), key=lambda scan: -scan[1])]
+
+# Function to summarize the run: latency percentiles per action, lock waits, Drive traffic, throughput
+def summarize(elapsed, args):
+    latencies = pd.DataFrame(stats["latencies"], columns=["user", "action", "seconds"])
+    rows = []
+    for action, group in list(latencies.groupby("action")) + [("all", latencies[latencies["action"] != "open"])]:
+        quantiles = (group["seconds"].quantile([0.5, 0.95, 0.99]) * 1000).round(1)
+        rows.append({
+            "action": action, "reruns": len(group),
+            "p50_ms": quantiles[0.5], "p95_ms": quantiles[0.95], "p99_ms": quantiles[0.99],
+            "max_ms": round(group["seconds"].max() * 1000, 1),
+        })
+
+    lock_waits = pd.Series(stats["lock_waits"], dtype=float)
+    return {
+        "users": args.users,
+        "sync_mode": args.sync_mode,
+        "duration_s": round(elapsed, 2),
+        "latency": rows,
+        "throughput_reruns_per_s": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "lock_waits": {
+            "count": int(lock_waits.size),
+            "total_s": round(float(lock_waits.sum()), 3),
+            "p95_ms": round(float(lock_waits.quantile(0.95)) * 1000, 1) if lock_waits.size else 0.0,
+            "max_ms": round(float(lock_waits.max()) * 1000, 1) if lock_waits.size else 0.0,
+        },
+        "drive": dict(stats["drive"]),
+        "errors": [{"user": user, "action": action, "message": str(message)} for user, action, message in stats["errors"]],
+        "full_scans": stats["full_scans"],
+    }
+
+# Function to print the summary as a short table
+def print_summary(summary):
+    print(f"\n{summary['users']} users, sync mode {summary['sync_mode']}, {summary['duration_s']}s")
+    print(pd.DataFrame(summary["latency"]).to_string(index=False))
+    print(f"\nthroughput: {summary['throughput_reruns_per_s']} reruns/s")
+    waits = summary["lock_waits"]
+    print(f"sqlite lock waits: {waits['count']} waits, {waits['total_s']}s total, p95 {waits['p95_ms']} ms, max {waits['max_ms']} ms")
+    drive = summary["drive"]
+    print(f"drive: {drive['uploads']} uploads ({drive['bytes_up']} bytes), {drive['downloads']} downloads ({drive['bytes_down']} bytes)")
+    print(f"errors: {len(summary['errors'])}")
+    for error in summary["errors"][:5]:
+        print(f"  user {error['user']} {error['action']}: {error['message']}")
+    if summary["full_scans"]:
+        print(f"full scans of inventory: {len(summary['full_scans'])} statement(s)")
+        for scan in summary["full_scans"]:
+            print(f"  {scan['count']}x {scan['sql'][:200]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate concurrent lab members using the app.")
+    parser.add_argument("--users", type=int, default=4, help="number of concurrent sessions")
+    parser.add_argument("--duration", type=float, default=30, help="seconds each user keeps working")
+    parser.add_argument("--think-time", type=float, default=0.5, help="mean pause between actions, in seconds")
+    parser.add_argument("--sync-mode", choices=["local", "online", "offline_first"], default="offline_first")
+    parser.add_argument("--db", default=os.path.join(APP_DIR, "inventory.db"), help="database to seed from")
+    parser.add_argument("--seed-rows", type=int, default=1000, help="synthetic items added to the seed database")
+    parser.add_argument("--drive-latency", type=float, default=0.05, help="seconds added to each Drive request")
+    parser.add_argument("--workdir", help="working directory (default: a new temporary directory)")
+    parser.add_argument("--seed", type=int, default=0, help="random seed for the user scripts")
+    parser.add_argument("--json", help="write the summary to this file")
+    parser.add_argument("--fail-p95-ms", type=float, help="exit with status 1 if the overall p95 exceeds this")
+    parser.add_argument(
+        "--check-query-plans", action="store_true",
+        help="trace the app's SQL and exit with status 1 if a statement scans the inventory table without an index "
+             "(traced connections replace the lock-timing ones, so the app's lock waits go unmeasured)"
+    )
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="lab-orders-load-")
+    prepare_workdir(workdir, args.db, args.seed_rows, rng)
+    print(f"working directory: {workdir}")
+
+    # The app resolves its database, snapshots and caches relative to the working directory
+    os.chdir(workdir)
+    sys.path.insert(0, APP_DIR)
+    install_lock_timing()
+    install_shared_runtime(args.sync_mode)
+    install_drive_stand_in(make_drive_stand_in(os.path.join(workdir, "drive"), args.drive_latency))
+
+    # One untimed session runs the startup work (migrations, caches) first, so only the statements
+    # the users' actions run are checked
+    trace_file = os.path.join(workdir, "sql_trace.jsonl")
+    trace_offset = 0
+    if args.check_query_plans:
+        os.environ["LAB_ORDERS_SQL_TRACE"] = trace_file
+        open_session().run()
+        trace_offset = os.path.getsize(trace_file) if os.path.exists(trace_file) else 0
+
+    # Users open their sessions first, then all start working at the same moment
+    start_barrier = threading.Barrier(args.users + 1)
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=virtual_user, args=(user, args.think_time, args.seed + user, start_barrier, stop), daemon=True)
+        for user in range(args.users)
+    ]
+    for thread in threads:
+        thread.start()
+    start_barrier.wait()
+    started = time.perf_counter()
+    stop.wait(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    if args.check_query_plans:
+        stats["full_scans"] = find_full_scans(trace_file, trace_offset)
+    summary = summarize(elapsed, args)
+    print_summary(summary)
+    if args.json:
+        with open(args.json, "w") as output:
+            json.dump(summary, output, indent=2, default=float)
+
+    overall_p95 = next(row["p95_ms"] for row in summary["latency"] if row["action"] == "all")
+    if summary["errors"] or summary["full_scans"] or (args.fail_p95_ms is not None and overall_p95 > args.fail_p95_ms):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+import gzip
+import os
+import shutil
+import sqlite3
+import sys
+
+import googleapiclient.discovery
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from load_test import make_drive_stand_in
+
+DRIVE_FILE_ID = "test-inventory"
+
+
+# The app is a Streamlit script: importing it runs the page once in bare mode, in local sync mode
+# against an empty database in a scratch directory. After that its functions can be called directly.
+@pytest.fixture(scope="session")
+def app(tmp_path_factory):
+    os.environ["LAB_ORDERS_SYNC_MODE"] = "local"
+    os.chdir(tmp_path_factory.mktemp("app"))
+    import alon_lab_orders
+    return alon_lab_orders
+
+
+# A fresh database, used by every call that does not name one
+@pytest.fixture
+def db_file(app, tmp_path, monkeypatch):
+    path = str(tmp_path / "inventory.db")
+    app.init_db(path)
+    monkeypatch.setattr(app, "LOCAL_DB_FILE", path)
+    return path
+
+
+# Google Drive replaced by the load test's local stand-in, which keeps every uploaded revision
+@pytest.fixture
+def drive(app, tmp_path, monkeypatch):
+    store_dir = tmp_path / "drive"
+    store_dir.mkdir()
+    service = googleapiclient.discovery.build("drive", "v3", http=make_drive_stand_in(str(store_dir)), static_discovery=True)
+    monkeypatch.setattr(app, "get_drive_service", lambda: service)
+
+    class Drive:
+        file_id = DRIVE_FILE_ID
+
+        # Function to make a database the remote copy, as if its own changes had been synced before
+        def publish(self, db_path):
+            conn = sqlite3.connect(db_path)
+            conn.execute("INSERT OR IGNORE INTO applied_ops (op_id, applied_at) SELECT op_id, created_at FROM change_journal")
+            conn.execute("UPDATE change_journal SET synced_at = created_at")
+            conn.commit()
+            conn.close()
+            with open(db_path, "rb") as source, gzip.open(store_dir / DRIVE_FILE_ID, "wb") as payload:
+                shutil.copyfileobj(source, payload)
+
+        # Function to list the catalog numbers in the current remote copy
+        def catalog_numbers(self):
+            remote_path = tmp_path / "remote.db"
+            with gzip.open(store_dir / DRIVE_FILE_ID, "rb") as payload, open(remote_path, "wb") as target:
+                shutil.copyfileobj(payload, target)
+            return catalog_numbers(remote_path)
+
+        # Function to list the ids of every revision uploaded so far
+        def revisions(self):
+            return [revision["id"] for revision in service.revisions().list(fileId=DRIVE_FILE_ID).execute()["revisions"]]
+
+    return Drive()
+
+
+# Function to add an item straight through SQLite; the journal and feed triggers still fire
+def add_item(db_path, catalog_number, vendor="Sigma", status="Requested", quantity=1):
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT INTO inventory (requested_by, catalog_number, vendor, name, quantity, status) VALUES (?, ?, ?, ?, ?, ?)",
+        ("Test", catalog_number, vendor, f"Item {catalog_number}", quantity, status)
+    )
+    conn.commit()
+    conn.close()
+
+
+# Function to list the catalog numbers in a database
+def catalog_numbers(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT catalog_number FROM inventory ORDER BY catalog_number").fetchall()
+    conn.close()
+    return [row[0] for row in rows]
@@ -0,0 +1,54 @@
+import sqlite3
+
+from conftest import add_item
+
+
+# Function to take an item through one order cycle, received on the given day
+def receive_on(app, monkeypatch, item_id, day, quantity):
+    monkeypatch.setattr(app, "event_timestamp", lambda: f"{day} 09:00:00")
+    app.edit_inventory_item(item_id, {"status": "Requested"}, actor="Test")
+    app.receive_items([(item_id, quantity)])
+
+
+def test_forecast_counts_each_receipt_at_the_quantity_received(app, db_file, monkeypatch):
+    add_item(db_file, "F-1")
+    receive_on(app, monkeypatch, 1, "2026-01-01", 10)
+    receive_on(app, monkeypatch, 1, "2026-01-11", 20)
+    receive_on(app, monkeypatch, 1, "2026-01-21", 5)
+
+    # 30 units used up over 20 days, whatever the item's quantity says now
+    forecast = app.forecast_consumption(db_file, app.get_change_version(db_file))
+    assert forecast["daily_rate"].tolist() == [1.5]
+
+    app.edit_inventory_item(1, {"quantity": 100}, actor="Test")
+    forecast = app.forecast_consumption(db_file, app.get_change_version(db_file))
+    assert forecast["daily_rate"].tolist() == [1.5]
+
+
+def test_events_recorded_before_quantities_fall_back_to_the_item_quantity(app, db_file, monkeypatch):
+    add_item(db_file, "F-2", quantity=4)
+    receive_on(app, monkeypatch, 1, "2026-01-01", None)
+    receive_on(app, monkeypatch, 1, "2026-01-09", None)
+    conn = sqlite3.connect(db_file)
+    conn.execute("UPDATE status_events SET quantity = NULL")
+    conn.commit()
+    conn.close()
+
+    app.forecast_consumption.clear()
+    forecast = app.forecast_consumption(db_file, app.get_change_version(db_file))
+    assert forecast["daily_rate"].tolist() == [0.5]
+
+
+def test_open_orders_without_an_ordered_event_count_from_the_order_date(app, db_file, monkeypatch):
+    add_item(db_file, "O-1", status="Ordered")
+    conn = sqlite3.connect(db_file)
+    conn.execute("UPDATE inventory SET order_date = '2026-01-01'")
+    conn.commit()
+    conn.close()
+    add_item(db_file, "O-2")
+    monkeypatch.setattr(app, "event_timestamp", lambda: "2026-02-01 09:00:00")
+    app.edit_inventory_item(2, {"status": "Ordered"}, actor="Test")
+
+    open_orders = app.get_open_order_age()
+    assert open_orders["catalog_number"].tolist() == ["O-1", "O-2"]
+    assert open_orders["ordered_at"].tolist() == ["2026-01-01", "2026-02-01 09:00:00"]
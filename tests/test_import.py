@@ -0,0 +1,156 @@
+import sqlite3
+from datetime import date
+
+import pytest
+
+from conftest import add_item
+
+
+# Function to parse a CSV the way an upload is parsed
+def parse_csv(app, text):
+    _, df, rejects, error = app.parse_import_file("items.csv", text.encode("utf-8"))
+    assert error is None
+    return df, rejects
+
+
+# Function to read one item's fields by catalog number
+def read_item(db_path, catalog_number, *fields):
+    conn = sqlite3.connect(db_path)
+    row = conn.execute(
+        f"SELECT {', '.join(fields)} FROM inventory WHERE lower(trim(catalog_number)) = lower(?)", (catalog_number,)
+    ).fetchone()
+    conn.close()
+    return row
+
+
+def test_append_adds_new_items_and_skips_existing_ones(app, db_file):
+    add_item(db_file, "C-1", quantity=2)
+    df, _ = parse_csv(app, "catalog_number,vendor,name,quantity\n c-1 ,SIGMA,Renamed,5\nC-2,Sigma,New,3\n")
+
+    counts, _ = app.run_import(df, mode="append")
+
+    assert counts == {"insert": 1, "skipped": 1}
+    assert read_item(db_file, "C-1", "name", "quantity") == ("Item C-1", 2)
+    assert read_item(db_file, "C-2", "name", "quantity", "status") == ("New", 3, "Requested")
+
+
+def test_upsert_updates_changed_fields_and_keeps_blank_ones(app, db_file):
+    add_item(db_file, "C-1", quantity=2)
+    add_item(db_file, "C-3")
+    uid = read_item(db_file, "C-1", "uid")
+    df, _ = parse_csv(app, "catalog_number,vendor,name,quantity\nC-1,Sigma,,5\nC-2,Sigma,New,\nC-3,Sigma,Item C-3,\n")
+
+    counts, _ = app.run_import(df, mode="upsert")
+
+    assert counts == {"insert": 1, "update": 1, "unchanged": 1}
+    assert read_item(db_file, "C-1", "name", "quantity", "uid") == ("Item C-1", 5, *uid)
+    assert read_item(db_file, "C-2", "quantity") == (1,)
+
+
+def test_dry_run_previews_without_writing(app, db_file):
+    add_item(db_file, "C-1", quantity=2)
+    df, _ = parse_csv(app, "catalog_number,vendor,name,quantity\nC-1,Sigma,,5\nC-2,Sigma,New,\n")
+
+    counts, preview = app.run_import(df, mode="upsert", dry_run=True)
+
+    assert counts == {"insert": 1, "update": 1}
+    assert preview["Changes"].tolist() == ["", "quantity: 2 → 5"]
+    assert read_item(db_file, "C-2", "name") is None
+
+
+def test_import_holds_the_write_lock_from_planning_to_applying(app, db_file, monkeypatch):
+    df, _ = parse_csv(app, "catalog_number,vendor,name\nC-1,Sigma,Imported\n")
+    plan_import = app.plan_import
+    blocked = []
+
+    def plan_then_race(cursor, mode):
+        counts = plan_import(cursor, mode)
+        with pytest.raises(sqlite3.OperationalError, match="locked"):
+            conn = sqlite3.connect(db_file, timeout=0)
+            try:
+                conn.execute("INSERT INTO inventory (requested_by, catalog_number, vendor, name) VALUES ('Test', 'C-1', 'Sigma', 'Raced')")
+            finally:
+                conn.close()
+        blocked.append(True)
+        return counts
+
+    monkeypatch.setattr(app, "plan_import", plan_then_race)
+    assert app.run_import(df, mode="append")[0] == {"insert": 1}
+    assert blocked
+    assert read_item(db_file, "C-1", "name") == ("Imported",)
+
+
+def test_planned_insert_of_an_item_added_since_merges_into_it(app, db_file):
+    df, _ = parse_csv(app, "catalog_number,vendor,name,quantity\nC-1,Sigma,Imported,4\n")
+    conn = app.get_db_connection(db_file)
+    cursor = conn.cursor()
+    app.load_import_staging(cursor, df)
+    assert app.plan_import(cursor, "upsert") == {"insert": 1}
+    cursor.execute("INSERT INTO inventory (requested_by, catalog_number, vendor, name) VALUES ('Test', 'C-1 ', 'sigma', 'Added')")
+
+    app.apply_import_plan(cursor)
+    conn.commit()
+    conn.close()
+
+    assert read_item(db_file, "C-1", "COUNT(*)", "name", "quantity") == (1, "Imported", 4)
+
+
+def test_invalid_rows_are_rejected_with_their_row_numbers_and_reasons(app):
+    df, rejects = parse_csv(app, (
+        "Catalog Number,Vendor,Name,Quantity,Cost,Status\n"
+        "V-1,Sigma,Good,2,\"$1,200.50\",ordered\n"
+        ",Sigma,No Catalog,1,,\n"
+        "\n"
+        "V-3,Sigma,Bad Numbers,1.5,-3,\n"
+        "V-4,,Bad Status,x,,Lost\n"
+    ))
+
+    assert df[["catalog_number", "quantity", "cost", "status"]].to_dict("records") == [
+        {"catalog_number": "v-1", "quantity": 2, "cost": 1200.5, "status": "Ordered"}
+    ]
+    assert rejects["row"].tolist() == [3, 5, 6]
+    assert rejects["reason"].tolist() == [
+        "catalog number is blank",
+        "quantity is not a whole number; cost cannot be negative",
+        "vendor is blank; quantity is not a number; status must be one of Requested, Ordered, Received",
+    ]
+    # Rejected rows keep the values as they were in the file
+    assert rejects.loc[2, ["catalog_number", "quantity", "status"]].tolist() == ["V-4", "x", "Lost"]
+
+
+def test_files_missing_required_columns_are_refused(app):
+    _, df, rejects, error = app.parse_import_file("items.csv", b"catalog_number,vendor\nV-1,Sigma\n")
+    assert df is None and rejects is None
+    assert error == "missing required columns: {'name'}"
+
+
+def test_import_dates_are_stored_as_iso_and_unreadable_ones_kept_in_notes(app):
+    df, rejects = parse_csv(app, (
+        "catalog_number,vendor,name,order_date,received_date,notes\n"
+        "T-1,Sigma,Iso,2026-03-04,,\n"
+        "T-2,Sigma,Us,03/04/2026,\"March 9, 2026\",\n"
+        "T-3,Sigma,Unreadable,next week,,Urgent\n"
+    ))
+
+    assert rejects.empty
+    dates = df[["order_date", "received_date", "notes"]].astype(object)
+    assert dates.where(dates.notna(), None).to_dict("records") == [
+        {"order_date": "2026-03-04", "received_date": None, "notes": None},
+        {"order_date": "2026-03-04", "received_date": "2026-03-09", "notes": None},
+        {"order_date": None, "received_date": None, "notes": "Urgent | Order date: next week"},
+    ]
+
+
+def test_stored_dates_are_normalized_once(app, db_file):
+    conn = sqlite3.connect(db_file)
+    conn.executemany(
+        "INSERT INTO inventory (requested_by, catalog_number, vendor, name, order_date, received_date, notes) VALUES ('Test', ?, 'Sigma', 'Item', ?, ?, ?)",
+        [("N-1", "2026-01-02", None, None), ("N-2", "1/2/2026", "Jan 5 2026", None), ("N-3", "soon", None, "")]
+    )
+    conn.commit()
+    conn.close()
+
+    assert app.normalize_inventory_dates(db_file) == 2
+    assert read_item(db_file, "N-2", "order_date", "received_date") == ("2026-01-02", "2026-01-05")
+    assert read_item(db_file, "N-3", "order_date", "notes") == (None, "Order date: soon")
+    assert app.get_inventory_in_date_range("order_date", date(2026, 1, 1), date(2026, 1, 2), db_file).index.size == 2
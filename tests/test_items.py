@@ -0,0 +1,84 @@
+import sqlite3
+
+import pytest
+
+from conftest import add_item
+
+
+# Function to list an item's status events as (from, to, actor, quantity)
+def status_events(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT from_status, to_status, actor, quantity FROM status_events ORDER BY id").fetchall()
+    conn.close()
+    return rows
+
+
+# Function to add an item through the app with the sidebar form's defaults
+def add(app, catalog_number, vendor="Sigma", quantity=1, status="Requested", requested_by="Tester"):
+    return app.add_inventory_item(requested_by, catalog_number, vendor, "Reagent", "", quantity, "", "", 0.0, status)
+
+
+def test_add_inserts_then_merges_into_the_same_item(app, db_file):
+    assert add(app, "A-1") == "insert"
+    assert add(app, " a-1 ", vendor="SIGMA", quantity=3, status="Ordered") == "update"
+    assert add(app, "A-1", quantity=3, status="Ordered") == "unchanged"
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT catalog_number, quantity, status FROM inventory").fetchall() == [("A-1", 3, "Ordered")]
+    conn.close()
+    assert status_events(db_file) == [(None, "Requested", "Tester", 1), ("Requested", "Ordered", "Tester", 3)]
+
+
+def test_merge_without_a_status_change_records_no_event(app, db_file):
+    add(app, "A-1")
+    assert add(app, "A-1", quantity=5) == "update"
+    assert status_events(db_file) == [(None, "Requested", "Tester", 1)]
+
+
+def test_init_db_merges_key_collisions_before_making_the_key_unique(app, db_file):
+    conn = sqlite3.connect(db_file)
+    conn.execute("DROP INDEX idx_inventory_item_key")
+    conn.execute(f"CREATE INDEX idx_inventory_item_key ON inventory ({app.ITEM_KEY})")
+    conn.commit()
+    conn.close()
+    add_item(db_file, "D-1", quantity=2)
+    add_item(db_file, " d-1", vendor="sigma ", quantity=3)
+    add_item(db_file, "D-2")
+
+    app.init_db(db_file)
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT catalog_number, quantity FROM inventory ORDER BY id").fetchall() == [("D-1", 5), ("D-2", 1)]
+    assert conn.execute("SELECT sql FROM sqlite_master WHERE name = 'idx_inventory_item_key'").fetchone()[0].startswith("CREATE UNIQUE")
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO inventory (requested_by, catalog_number, vendor, name) VALUES ('Test', 'D-2 ', 'SIGMA', 'Again')")
+    conn.close()
+
+
+def test_status_edits_stamp_their_dates_and_a_reorder_clears_them(app, db_file):
+    add_item(db_file, "E-1")
+    today = app.datetime.now().strftime("%Y-%m-%d")
+
+    assert app.edit_inventory_item(1, {"status": "Ordered"}, actor="Buyer") == {"status": "Ordered", "order_date": today}
+    assert app.edit_inventory_item(1, {"status": "Received"}, actor="Buyer") == {"status": "Received", "received_date": today}
+    assert app.edit_inventory_item(1, {"status": "Requested"}, actor="Buyer") == {
+        "status": "Requested", "order_date": None, "received_date": None
+    }
+    assert app.edit_inventory_item(1, {"status": "Ordered", "order_date": "2026-01-05"}) == {
+        "status": "Ordered", "order_date": "2026-01-05"
+    }
+    assert [event[:3] for event in status_events(db_file)] == [
+        ("Requested", "Ordered", "Buyer"), ("Ordered", "Received", "Buyer"), ("Received", "Requested", "Buyer"),
+        ("Requested", "Ordered", None),
+    ]
+
+
+def test_adding_an_existing_item_with_blank_fields_keeps_its_url_unit_and_cost(app, db_file):
+    app.add_inventory_item("Tester", "K-1", "Sigma", "Reagent", "https://example.com/k-1", 1, "500 mL", "", 42.0, "Received")
+    assert app.add_inventory_item("Tester", "K-1", "Sigma", "Reagent", "", 2, "", "Again", 0.0, "Requested") == "update"
+
+    conn = sqlite3.connect(db_file)
+    assert conn.execute("SELECT url, unit, cost, quantity, notes, status FROM inventory").fetchall() == [
+        ("https://example.com/k-1", "500 mL", 42.0, 2, "Again", "Requested")
+    ]
+    conn.close()
@@ -0,0 +1,62 @@
+import json
+import sqlite3
+
+import pytest
+
+from conftest import add_item
+
+
+# A product cache of its own for each test, with no vendor resolvers registered
+@pytest.fixture
+def product_cache(app, db_file, tmp_path, monkeypatch):
+    memory_cache = app.get_product_memory_cache.__wrapped__()
+    monkeypatch.setattr(app, "PRODUCT_CACHE_FILE", str(tmp_path / "product_cache.db"))
+    monkeypatch.setattr(app, "PRODUCT_RESOLVERS", {})
+    monkeypatch.setattr(app, "get_product_memory_cache", lambda: memory_cache)
+
+
+# Function to list the keys stored in the on-disk product cache
+def cached_keys(app):
+    conn = app.get_product_cache_connection()
+    rows = conn.execute("SELECT vendor_key, catalog_key FROM product_cache ORDER BY 1, 2").fetchall()
+    conn.close()
+    return rows
+
+
+def test_history_hits_are_read_live_and_never_cached(app, db_file, product_cache):
+    add_item(db_file, "P-1")
+    assert app.resolve_product("Sigma", "P-1")["name"] == "Item P-1"
+
+    conn = sqlite3.connect(db_file)
+    conn.execute("UPDATE inventory SET name = 'Renamed' WHERE catalog_number = 'P-1'")
+    conn.commit()
+    conn.close()
+
+    assert app.resolve_product("Sigma", "P-1") == {"name": "Renamed", "url": None, "unit": None, "cost": 0.0, "source": "history"}
+    assert cached_keys(app) == []
+
+
+def test_vendor_results_are_cached(app, db_file, product_cache):
+    calls = []
+
+    def resolver(catalog_number):
+        calls.append(catalog_number)
+        return {"name": "From Vendor", "url": "https://vendor.example/p-2", "unit": "1 mL", "cost": 12.5}
+
+    app.register_product_resolver("Sigma", resolver)
+    assert app.resolve_product("Sigma", "P-2")["source"] == "sigmaaldrich"
+    assert app.resolve_product("Sigma", "P-2")["name"] == "From Vendor"
+    assert calls == ["P-2"]
+    assert cached_keys(app) == [("sigmaaldrich", "p2")]
+
+
+def test_history_entries_cached_by_older_versions_are_ignored(app, db_file, product_cache):
+    conn = app.get_product_cache_connection()
+    conn.execute(
+        "INSERT INTO product_cache VALUES ('sigmaaldrich', 'p3', ?, strftime('%s', 'now'), strftime('%s', 'now'))",
+        (json.dumps({"name": "Deleted Item", "source": "history"}),)
+    )
+    conn.commit()
+    conn.close()
+
+    assert app.resolve_product("Sigma", "P-3") is None
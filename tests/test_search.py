@@ -0,0 +1,26 @@
+import json
+
+from conftest import add_item
+from load_test import find_full_scans
+
+
+def test_search_after_a_change_reads_only_the_changed_rows(app, db_file, tmp_path, monkeypatch):
+    for number in range(20):
+        add_item(db_file, f"S-{number}")
+    trace_file = tmp_path / "trace.jsonl"
+    trace_file.touch()
+    monkeypatch.setattr(app, "SQL_TRACE_FILE", str(trace_file))
+    app.get_search_results("S-1")
+
+    # Everything from here on should be served by the change feed and the primary key
+    offset = trace_file.stat().st_size
+    app.edit_inventory_item(app.load_current_inventory().index[0], {"quantity": 3})
+    results = app.get_search_results("S-0")
+
+    assert results["Quantity"].tolist() == [3]
+    with open(trace_file) as trace:
+        trace.seek(offset)
+        statements = [json.loads(line)["sql"] for line in trace]
+    assert "PRAGMA data_version" in statements
+    assert any(sql.endswith("WHERE id IN (?)") for sql in statements)
+    assert find_full_scans(str(trace_file), offset) == []
@@ -0,0 +1,148 @@
+import os
+import sqlite3
+import time
+
+import pytest
+
+from conftest import add_item
+
+
+# Function to configure two lab shards, the second one archived
+@pytest.fixture
+def shards(app, tmp_path, monkeypatch):
+    active = str(tmp_path / "active.db")
+    archive = str(tmp_path / "archive.db")
+    for path in (active, archive):
+        app.init_db(path)
+    monkeypatch.setattr(app, "LAB_SHARDS", {
+        "Active": {"drive_file_id": "active", "local_db_file": active, "read_only": False},
+        "Archive": {"drive_file_id": "archive", "local_db_file": archive, "read_only": True},
+    })
+    monkeypatch.setattr(app, "READ_ONLY_DB_FILES", {archive})
+    return active, archive
+
+
+def test_keyed_fan_out_reads_only_shards_whose_feed_moved(app, shards):
+    active, archive = shards
+    reads = []
+
+    def read_items(db_file):
+        reads.append(db_file)
+        conn = app.get_db_connection(db_file)
+        count = conn.execute("SELECT COUNT(*) FROM inventory").fetchone()[0]
+        conn.close()
+        return count
+
+    assert app.fan_out_read(read_items, key="count") == {"Active": 0, "Archive": 0}
+    assert app.fan_out_read(read_items, key="count") == {"Active": 0, "Archive": 0}
+    assert sorted(reads) == sorted([active, archive])
+
+    add_item(active, "A-1")
+    assert app.fan_out_read(read_items, key="count") == {"Active": 1, "Archive": 0}
+    assert sorted(reads) == sorted([active, archive, active])
+
+
+def test_archived_shards_are_read_through_query_only_connections(app, shards):
+    _, archive = shards
+
+    def write_through(db_file):
+        conn = app.get_db_connection(db_file)
+        try:
+            conn.execute("DELETE FROM inventory")
+            return "written"
+        except sqlite3.OperationalError:
+            return "refused"
+        finally:
+            conn.close()
+
+    assert app.fan_out_read(write_through)["Archive"] == "refused"
+    app.refresh_inventory_view(archive)
+    with pytest.raises(sqlite3.OperationalError):
+        app.get_inventory_view(archive)["conn"].execute("DELETE FROM inventory")
+
+
+# Function to store a blob as if it was added long ago, optionally with a Drive copy
+def stored_blob(app, raw_data, drive_file_id=None):
+    sha256 = app.store_attachment_blob(raw_data)
+    conn = app.get_attachment_index_connection()
+    conn.execute("UPDATE blobs SET drive_file_id = ?, last_used = ? WHERE sha256 = ?", (drive_file_id, time.time() - 30 * 86400, sha256))
+    conn.commit()
+    conn.close()
+    return sha256
+
+
+# Function to reference a blob from a shard's attachments
+def attach(db_path, sha256):
+    add_item(db_path, f"A-{sha256[:8]}")
+    conn = sqlite3.connect(db_path)
+    conn.execute(
+        "INSERT INTO attachments (item_id, sha256, kind, file_name, size_bytes, added_at) SELECT MAX(id), ?, 'quote', 'quote.pdf', 1, '2026-01-01' FROM inventory",
+        (sha256,)
+    )
+    conn.commit()
+    conn.close()
+
+
+# Drive with only the files().delete() call garbage collection makes
+class DeletingDrive:
+    def __init__(self):
+        self.deleted = []
+
+    def files(self):
+        return self
+
+    def delete(self, fileId):
+        self.deleted.append(fileId)
+        return self
+
+    def execute(self):
+        return {}
+
+
+@pytest.fixture
+def attachment_drive(app, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(app, "SYNC_MODE", "online")
+    drive = DeletingDrive()
+    monkeypatch.setattr(app, "get_drive_service", lambda: drive)
+    return drive
+
+
+def test_attachment_gc_keeps_blobs_a_retained_snapshot_references(app, shards, attachment_drive):
+    active, archive = shards
+    snapshotted = stored_blob(app, b"quote kept in a snapshot", "drive-snapshotted")
+    unused = stored_blob(app, b"quote nobody uses", "drive-unused")
+    attach(active, snapshotted)
+    app.create_db_snapshot(active)
+    conn = sqlite3.connect(active)
+    conn.execute("DELETE FROM attachments")
+    conn.commit()
+    conn.close()
+
+    assert app.collect_attachment_garbage([active, archive]) == 1
+    assert attachment_drive.deleted == ["drive-unused"]
+    assert os.path.exists(app.attachment_blob_path(snapshotted))
+    assert not os.path.exists(app.attachment_blob_path(unused))
+
+
+def test_attachment_gc_leaves_drive_alone_while_a_shard_is_missing(app, shards, attachment_drive):
+    active, archive = shards
+    os.remove(archive)
+    uploaded = stored_blob(app, b"quote another deployment may reference", "drive-uploaded")
+    local_only = stored_blob(app, b"quote never uploaded")
+
+    assert app.collect_attachment_garbage([active, archive]) == 1
+    assert attachment_drive.deleted == []
+    assert os.path.exists(app.attachment_blob_path(uploaded))
+    assert not os.path.exists(app.attachment_blob_path(local_only))
+
+
+def test_maintenance_leaves_archived_shards_untouched(app, shards):
+    active, archive = shards
+    with open(archive, "rb") as frozen:
+        before = frozen.read()
+
+    assert app.run_db_maintenance(force=True, db_file=archive) is False
+    assert app.run_db_maintenance(force=True, db_file=active) is True
+    with open(archive, "rb") as frozen:
+        assert frozen.read() == before
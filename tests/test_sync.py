@@ -0,0 +1,223 @@
+import shutil
+import sqlite3
+
+import pytest
+
+from conftest import add_item, catalog_numbers
+
+
+# Function to create a database for one deployment, initialized like the app does at startup
+def make_deployment(app, tmp_path, name, source=None):
+    path = str(tmp_path / f"{name}.db")
+    if source:
+        shutil.copyfile(source, path)
+    app.init_db(path)
+    return path
+
+
+def test_first_sync_of_an_existing_copy_merges_instead_of_overwriting(app, tmp_path, drive):
+    remote = make_deployment(app, tmp_path, "remote")
+    add_item(remote, "R-1")
+    drive.publish(remote)
+    # A copy taken before the remote gained R-2, with no record of which revision it came from
+    local = make_deployment(app, tmp_path, "local", source=remote)
+    add_item(remote, "R-2")
+    drive.publish(remote)
+
+    add_item(local, "L-1")
+    assert app.sync_shard(local, drive.file_id) == 1
+
+    assert drive.catalog_numbers() == ["L-1", "R-1", "R-2"]
+    assert catalog_numbers(local) == ["L-1", "R-1", "R-2"]
+
+
+def test_upload_that_replaced_an_unmerged_revision_merges_it_back(app, tmp_path, drive, monkeypatch):
+    remote = make_deployment(app, tmp_path, "remote")
+    add_item(remote, "R-1")
+    drive.publish(remote)
+    first = make_deployment(app, tmp_path, "first", source=remote)
+    second = make_deployment(app, tmp_path, "second", source=remote)
+    app.sync_shard(first, drive.file_id)
+    app.sync_shard(second, drive.file_id)
+
+    add_item(first, "A-1")
+    add_item(second, "B-1")
+
+    # The second deployment's upload lands after the first one's last check but before its upload
+    run_resumable_upload = app.run_resumable_upload
+    raced = []
+
+    def racing_upload(request, **kwargs):
+        if not raced:
+            raced.append(True)
+            app.sync_shard(second, drive.file_id)
+        return run_resumable_upload(request, **kwargs)
+
+    monkeypatch.setattr(app, "run_resumable_upload", racing_upload)
+    app.sync_shard(first, drive.file_id)
+
+    # Initial copy, the second deployment's upload, the one that replaced it, and the re-upload
+    assert len(drive.revisions()) == 4
+    assert drive.catalog_numbers() == ["A-1", "B-1", "R-1"]
+    assert catalog_numbers(first) == ["A-1", "B-1", "R-1"]
+
+
+def test_sync_with_nothing_pending_pulls_remote_changes(app, tmp_path, drive):
+    remote = make_deployment(app, tmp_path, "remote")
+    drive.publish(remote)
+    local = make_deployment(app, tmp_path, "local", source=remote)
+    other = make_deployment(app, tmp_path, "other", source=remote)
+    app.sync_shard(local, drive.file_id)
+
+    add_item(other, "O-1")
+    app.sync_shard(other, drive.file_id)
+
+    assert app.sync_shard(local, drive.file_id) == 0
+    assert catalog_numbers(local) == ["O-1"]
+
+
+# Function to map each item's local id to its catalog number
+def item_ids(db_path):
+    conn = sqlite3.connect(db_path)
+    rows = conn.execute("SELECT id, catalog_number FROM inventory").fetchall()
+    conn.close()
+    return dict(rows)
+
+
+def test_sync_keeps_the_item_ids_an_edit_or_merge_holds(app, tmp_path, drive, monkeypatch):
+    remote = make_deployment(app, tmp_path, "remote")
+    drive.publish(remote)
+    local = make_deployment(app, tmp_path, "local", source=remote)
+    other = make_deployment(app, tmp_path, "other", source=remote)
+    app.sync_shard(local, drive.file_id)
+
+    add_item(other, "O-1")
+    add_item(other, "O-2")
+    app.sync_shard(other, drive.file_id)
+
+    # Ids a session picked up before the sync: the item being edited and a near-duplicate pair
+    add_item(local, "L-1")
+    add_item(local, "L-2")
+    add_item(local, "L2")
+    held = {catalog_number: item_id for item_id, catalog_number in item_ids(local).items()}
+    app.sync_shard(local, drive.file_id)
+
+    assert {held[catalog_number]: catalog_number for catalog_number in ("L-1", "L-2", "L2")}.items() <= item_ids(local).items()
+    assert max(item_ids(local)) == 5
+
+    monkeypatch.setattr(app, "LOCAL_DB_FILE", local)
+    app.edit_inventory_item(held["L-1"], {"quantity": 4})
+    app.merge_near_duplicate_groups([[held["L-2"], held["L2"]]])
+
+    conn = sqlite3.connect(local)
+    quantities = dict(conn.execute("SELECT catalog_number, quantity FROM inventory").fetchall())
+    conn.close()
+    assert quantities["L-1"] == 4
+    assert sorted(quantities) == ["L-1", "L-2", "O-1", "O-2"]
+
+
+# Function to set up a deployment in sync with Drive and a snapshot taken before it added L-1
+def restored_deployment(app, tmp_path, drive, monkeypatch):
+    monkeypatch.setattr(app, "SYNC_MODE", "offline_first")
+    remote = make_deployment(app, tmp_path, "remote")
+    add_item(remote, "R-1")
+    drive.publish(remote)
+    local = make_deployment(app, tmp_path, "local", source=remote)
+    app.sync_shard(local, drive.file_id)
+
+    snapshot = app.create_db_snapshot(local)
+    add_item(local, "L-1")
+    app.sync_shard(local, drive.file_id)
+    assert drive.catalog_numbers() == ["L-1", "R-1"]
+
+    app.restore_db_snapshot(snapshot, local)
+    return remote, local
+
+
+def test_restored_snapshot_replaces_the_remote_copy_at_the_next_sync(app, tmp_path, drive, monkeypatch):
+    _, local = restored_deployment(app, tmp_path, drive, monkeypatch)
+    assert app.read_restore_state(local)[0] is not None
+
+    app.sync_shard(local, drive.file_id)
+
+    assert catalog_numbers(local) == ["R-1"]
+    assert drive.catalog_numbers() == ["R-1"]
+    assert app.read_restore_state(local) == (None, None)
+
+
+def test_restore_waits_for_a_decision_when_drive_moved_on(app, tmp_path, drive, monkeypatch):
+    remote, local = restored_deployment(app, tmp_path, drive, monkeypatch)
+    other = make_deployment(app, tmp_path, "other", source=remote)
+    add_item(other, "O-1")
+    app.sync_shard(other, drive.file_id)
+
+    with pytest.raises(RuntimeError):
+        app.sync_shard(local, drive.file_id)
+    assert app.read_restore_state(local)[1] is not None
+    assert drive.catalog_numbers() == ["L-1", "O-1", "R-1"]
+    assert catalog_numbers(local) == ["R-1"]
+
+    app.resolve_restore_conflict(keep=True, db_file=local)
+    app.sync_shard(local, drive.file_id)
+    assert drive.catalog_numbers() == ["R-1"]
+
+
+def test_discarded_restore_takes_the_remote_copy(app, tmp_path, drive, monkeypatch):
+    remote, local = restored_deployment(app, tmp_path, drive, monkeypatch)
+    other = make_deployment(app, tmp_path, "other", source=remote)
+    add_item(other, "O-1")
+    app.sync_shard(other, drive.file_id)
+    with pytest.raises(RuntimeError):
+        app.sync_shard(local, drive.file_id)
+
+    app.resolve_restore_conflict(keep=False, db_file=local)
+    app.sync_shard(local, drive.file_id)
+    assert catalog_numbers(local) == ["L-1", "O-1", "R-1"]
+    assert app.read_restore_state(local) == (None, None)
+
+
+# Function to read what replay should reproduce: items by uid and their status history
+def replayed_state(db_path):
+    conn = sqlite3.connect(db_path)
+    items = conn.execute("SELECT uid, catalog_number, status, quantity FROM inventory ORDER BY uid").fetchall()
+    events = conn.execute('''
+        SELECT i.uid, e.from_status, e.to_status, e.actor, e.quantity
+        FROM status_events e JOIN inventory i ON i.id = e.item_id
+        ORDER BY e.id
+    ''').fetchall()
+    conn.close()
+    return items, events
+
+
+# Function to replay a journal onto a database in one transaction, as a merge does
+def replay(app, db_path, entries):
+    conn = app.get_db_connection(db_path, read_only=False)
+    cursor = conn.cursor()
+    for entry in entries:
+        app.apply_journal_entry(cursor, entry)
+    conn.commit()
+    conn.close()
+
+
+def test_replaying_a_journal_again_changes_nothing(app, tmp_path, db_file):
+    target = make_deployment(app, tmp_path, "target")
+    app.add_inventory_item("Tester", "J-1", "Sigma", "Reagent", "", 2, "", "", 0.0, "Requested")
+    app.add_inventory_item("Tester", "J-2", "Sigma", "Buffer", "", 1, "", "", 0.0, "Requested")
+    app.edit_inventory_item(1, {"status": "Ordered", "quantity": 4}, actor="Buyer")
+    app.delete_inventory_item("J-2", "Sigma")
+
+    conn = sqlite3.connect(db_file)
+    entries = conn.execute(
+        "SELECT op_id, table_name, operation, item_uid, before_json, after_json FROM change_journal ORDER BY seq"
+    ).fetchall()
+    conn.close()
+
+    # Interrupted after the first entries, then replayed in full, then once more
+    replay(app, target, entries[:2])
+    replay(app, target, entries)
+    replay(app, target, entries)
+
+    assert replayed_state(target) == replayed_state(db_file)
+    conn = sqlite3.connect(target)
+    assert conn.execute("SELECT COUNT(*) FROM applied_ops").fetchone()[0] == len(entries)
+    conn.close()
@@ -0,0 +1,144 @@
+import http.server
+import json
+import os
+import re
+import threading
+
+import googleapiclient.discovery
+import pytest
+from googleapiclient.errors import HttpError
+from googleapiclient.http import build_http
+
+CHUNK = 256 * 1024
+
+
+# A local stand-in for Drive's resumable upload endpoint. Each PUT to the session, whether a chunk
+# or a status query, takes the next scripted fault: "ok", a status code to fail with, or
+# ("partial", n, status) to keep only the first n bytes of the chunk and then fail.
+class ResumableEndpoint(http.server.ThreadingHTTPServer):
+    def __init__(self, faults):
+        super().__init__(("127.0.0.1", 0), ResumableHandler)
+        self.faults = list(faults)
+        self.received = bytearray()
+        self.chunk_starts = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+
+class ResumableHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def reply(self, status, headers=None, body=b""):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    # Function to acknowledge what has arrived so far, as Drive does with 308 Resume Incomplete
+    def resume_incomplete(self):
+        received = len(self.server.received)
+        self.reply(308, {"Range": f"bytes=0-{received - 1}"} if received else {})
+
+    # Opening the session: the update request itself
+    def do_PATCH(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.reply(200, {"Location": f"{self.server.url}session"})
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        fault = self.server.faults.pop(0) if self.server.faults else "ok"
+        query = re.fullmatch(r"bytes \*/(\d+)", self.headers["Content-Range"])
+        if not query:
+            start, total = map(int, re.fullmatch(r"bytes (\d+)-\d+/(\d+)", self.headers["Content-Range"]).groups())
+            self.server.chunk_starts.append(start)
+            if start != len(self.server.received):
+                return self.reply(400)
+            if isinstance(fault, tuple):
+                _, kept, fault = fault
+                self.server.received += body[:kept]
+            elif fault == "ok":
+                self.server.received += body
+        if fault != "ok":
+            return self.reply(fault)
+        if not query and len(self.server.received) == total:
+            return self.reply(200, {"Content-Type": "application/json"}, json.dumps({"id": "inventory", "headRevisionId": "2"}).encode())
+        self.resume_incomplete()
+
+
+# Function to run the endpoint for a test and build an upload request for a file against it
+@pytest.fixture
+def upload(app, tmp_path):
+    servers = []
+
+    def start(faults, size):
+        server = ResumableEndpoint(faults)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        path = tmp_path / "inventory.db.gz"
+        path.write_bytes(os.urandom(size))
+        service = googleapiclient.discovery.build(
+            "drive", "v3", http=build_http(), static_discovery=True, client_options={"api_endpoint": server.url}
+        )
+        request = app.build_upload_request(service, str(path), chunksize=CHUNK, drive_file_id="inventory")
+        # Media uploads always get an https URL; the local endpoint speaks plain http
+        request.uri = request.uri.replace("https://", "http://", 1)
+        return server, request, path.read_bytes()
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_interrupted_upload_resumes_from_the_acknowledged_byte(app, upload, monkeypatch):
+    monkeypatch.setattr(app.random, "uniform", lambda low, high: high)
+    faults = [
+        "ok",                       # first chunk
+        ("partial", 100000, 503),   # second chunk cut off after 100000 bytes
+        "ok",                       # status query: 308 up to the cut
+        "ok",                       # next chunk, from the cut
+        429,                        # following chunk throttled
+        503,                        # status query fails as well
+    ]
+    server, request, payload = upload(faults, 4 * CHUNK + 1000)
+    sleeps = []
+    progress = []
+
+    response = app.run_resumable_upload(request, progress_callback=progress.append, sleep=sleeps.append)
+
+    assert response == {"id": "inventory", "headRevisionId": "2"}
+    assert bytes(server.received) == payload
+    # Each retry starts at the last byte the endpoint acknowledged, never back at zero
+    assert server.chunk_starts == [0, CHUNK, CHUNK + 100000, 2 * CHUNK + 100000, 2 * CHUNK + 100000, 3 * CHUNK + 100000]
+    # Backoff doubles while failures are consecutive and resets after a chunk goes through
+    assert sleeps == [1.0, 1.0, 2.0]
+    assert progress[-1] == 1.0
+
+
+def test_upload_gives_up_after_the_retry_budget(app, upload):
+    _, request, _ = upload([503] * 10, 2 * CHUNK)
+    sleeps = []
+
+    with pytest.raises(HttpError) as error:
+        app.run_resumable_upload(request, max_retries=2, sleep=sleeps.append)
+
+    assert error.value.resp.status == 503
+    assert len(sleeps) == 2
+
+
+def test_upload_does_not_retry_a_client_error(app, upload):
+    server, request, _ = upload([403], 2 * CHUNK)
+    sleeps = []
+
+    with pytest.raises(HttpError):
+        app.run_resumable_upload(request, sleep=sleeps.append)
+
+    assert sleeps == []
+    assert server.chunk_starts == [0]